@@ -1,244 +1,255 @@
-from flask import Flask, render_template, request, jsonify
+from flask import (Flask, Response, abort, g, redirect, render_template, request, jsonify, send_from_directory,
+                   url_for)
 from flask_cors import CORS
+from markupsafe import Markup
+import csv
+import io
+import json
+import asyncio
+import os
 import sqlite3
-import requests
-from bs4 import BeautifulSoup
+import time
+import zlib
+from contextlib import aclosing, closing
 from urllib.parse import urlparse
-import re
+from bulk import BulkImporter, parse_csv_urls, parse_url_list, MAX_URLS_PER_JOB
+from fetcher import get_fetcher, MAX_PAGE_BYTES
+from extractor import LeadExtractor
+from crawler import CRAWL_ENABLED, get_crawler, shutdown_crawler
+from scrape_cache import get_scrape_cache
+from render import get_renderer, shutdown_renderer
+import metrics
+from metrics import ScrapeTrace
+import db
+from db import get_db, init_db
+from writer import WriterBusyError, close_writer, get_writer, wait_saved
+from jobs import DONE, FAILED, enqueue_job, get_job
+from job_runner import JobRunner
+from refresh import (REFRESH_PER_HOST_LIMIT, REFRESH_RATE, REFRESH_WORKERS, parse_age, parse_missing,
+                     parse_refresh_limit, refresh_lead, select_stale_leads)
+from search import decode_search_cursor, match_query, search_leads
+from leads import (READABLE_FIELDS, content_hash, known_domains, get_lead, lead_domain, leads_version, list_leads,
+                   iter_leads, count_leads, parse_cursor, parse_filters, parse_fields, parse_limit)
+from urlnorm import canonical_url
+from httpcache import cached_fragment, cached_page, compress_response
+from assets import (ASSETS_DIR, ASSETS_ENABLED, ASSET_NAME_RE, asset_mimetype, asset_path,
+                    get_asset_pipeline, stop_asset_pipeline)
 
 app = Flask(__name__)
 CORS(app)
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('leads.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS leads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company TEXT,
-            url TEXT NOT NULL,
-            title TEXT,
-            description TEXT,
-            email TEXT,
-            phone TEXT,
-            logo_url TEXT,
-            favicon_url TEXT,
-            twitter_handle TEXT,
-            linkedin_url TEXT,
-            facebook_url TEXT,
-            instagram_url TEXT,
-            contact_page TEXT,
-            industry_keywords TEXT,
-            language TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def get_db():
-    conn = sqlite3.connect('leads.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Scraping function
-def scrape_website(url):
+def create_app(start_jobs=True):
+    """Set up the database, start the scrape job workers and return the app.
+
+    The entry point for WSGI servers (see wsgi.py). Safe to call in every
+    worker process; schema setup is serialized across them.
+    """
+    init_db()
+    if start_jobs:
+        job_runner.start()
+        bulk_importer.start()
+        refresh_importer.start()
+        if ASSETS_ENABLED:
+            get_asset_pipeline().start()
+    return app
+
+def drain():
+    """Finish in-flight work before the process exits.
+
+    Icons being fetched are stored, running scrape jobs finish (queued ones
+    stay in the database for the next worker), bulk and refresh scrapes
+    already running complete and their jobs are handed back with the rest
+    of their URLs still queued, for another worker to resume, the headless
+    browser is closed, then contact crawls in progress finish, then every
+    queued lead is written.
+    """
+    stop_asset_pipeline()
+    job_runner.stop()
+    bulk_importer.shutdown()
+    refresh_importer.shutdown()
+    shutdown_renderer()
+    shutdown_crawler()
+    close_writer()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Opt-in profiling, only when PROFILE_DIR is configured
+    g.profile = None
+    if metrics.PROFILE_DIR and (request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+        g.profile = metrics.start_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    if g.get('profile') is not None:
+        response.headers['X-Profile-File'] = metrics.dump_profile(g.profile, request.endpoint or 'unmatched')
+        g.profile = None
+    if 'request_started' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(request.method, endpoint, response.status_code,
+                                time.perf_counter() - g.request_started)
+    return response
+
+# gzip/brotli for JSON and HTML responses that weren't served from the page cache
+app.after_request(compress_response)
+
+@app.teardown_request
+def release_db(exc):
+    # Connections are kept per thread; don't let a failed request leave a transaction open
+    db.release()
+
+def save_lead(lead, scraped=True):
+    """Insert a lead dict into the database and return the new id.
+
+    The insert goes through the batching writer and this returns once the
+    batch holding it has been committed. scraped=False marks a lead sent by
+    a client rather than scraped here, which leaves last_scraped_at alone.
+    """
+    return get_writer().save(lead, scraped=scraped)
+
+# Scraping functions
+async def rescrape_website_async(url, fetcher):
+    """scrape_website_async for refreshes, which must ask the site even when the cached copy is fresh"""
+    return await scrape_website_async(url, fetcher, revalidate=True)
+
+def _resolve_cache(cache):
+    # True means the shared on-disk cache (None if disabled); False/None means no caching
+    if cache is True:
+        return get_scrape_cache()
+    return cache or None
+
+def scrape_website(url, fetcher=None, max_bytes=MAX_PAGE_BYTES, cache=True, revalidate=False):
+    """Stream a page through the pooled fetch layer and extract lead details.
+
+    Parsing happens as the page downloads; reading stops at max_bytes or as
+    soon as every field has been found. Results are cached on disk: fresh
+    entries skip the network, stale ones are revalidated with a conditional
+    GET and reused on 304 Not Modified. With revalidate=True fresh entries
+    are revalidated too, so the result always reflects the live page.
+    """
+    scrape = _Scrape(url, cache, revalidate)
+    try:
+        if scrape.start():
+            return scrape.cached
+        with closing((fetcher or get_fetcher()).stream_text(scrape.url, max_bytes, headers=scrape.headers,
+                                                            meta=scrape.meta)) as chunks:
+            for text in chunks:
+                if scrape.feed(text):
+                    break
+        if scrape.fetched():
+            with scrape.trace.timed('render'):
+                scrape.rendered(get_renderer().render(scrape.url))
+        return scrape.finish()
+    except Exception as e:
+        return scrape.error(e)
+
+async def scrape_website_async(url, fetcher, max_bytes=MAX_PAGE_BYTES, cache=True, revalidate=False):
+    """scrape_website on an open fetcher.AsyncFetcher, for bulk imports and refreshes"""
+    scrape = _Scrape(url, cache, revalidate)
     try:
+        if scrape.start():
+            return scrape.cached
+        async with aclosing(fetcher.stream_text(scrape.url, max_bytes, headers=scrape.headers,
+                                                meta=scrape.meta)) as chunks:
+            async for text in chunks:
+                if scrape.feed(text):
+                    break
+        if scrape.fetched():
+            with scrape.trace.timed('render'):
+                scrape.rendered(await asyncio.wrap_future(get_renderer().submit(scrape.url)))
+        return scrape.finish()
+    except Exception as e:
+        return scrape.error(e)
+
+class _Scrape:
+    """The steps of one scrape around the fetch, shared by scrape_website and scrape_website_async"""
+
+    def __init__(self, url, cache, revalidate):
         # Add scheme if missing
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        page_text = soup.get_text()
-        
-        # Get title - try multiple sources
-        title = ''
-        if soup.title and soup.title.string:
-            title = soup.title.string.strip()
-        
-        # If title is empty or too short, try og:title
-        if not title or len(title) < 3:
-            og_title = soup.find('meta', attrs={'property': 'og:title'})
-            if og_title and og_title.get('content'):
-                title = og_title.get('content').strip()
-        
-        # If still no title, try twitter:title
-        if not title or len(title) < 3:
-            twitter_title = soup.find('meta', attrs={'name': 'twitter:title'})
-            if twitter_title and twitter_title.get('content'):
-                title = twitter_title.get('content').strip()
-        
-        # If still no title, try h1
-        if not title or len(title) < 3:
-            h1 = soup.find('h1')
-            if h1 and h1.get_text():
-                title = h1.get_text().strip()[:100]  # Limit to 100 chars
-        
-        # Get meta description - try multiple sources
-        description = ''
-        
-        # Try standard meta description (case-insensitive)
-        meta_desc = soup.find('meta', attrs={'name': lambda x: x and x.lower() == 'description'})
-        if meta_desc and meta_desc.get('content'):
-            description = meta_desc.get('content').strip()
-        
-        # Try og:description
-        if not description:
-            og_desc = soup.find('meta', attrs={'property': 'og:description'})
-            if og_desc and og_desc.get('content'):
-                description = og_desc.get('content').strip()
-        
-        # Try twitter:description
-        if not description:
-            twitter_desc = soup.find('meta', attrs={'name': 'twitter:description'})
-            if twitter_desc and twitter_desc.get('content'):
-                description = twitter_desc.get('content').strip()
-        
-        # Fallback: try to get first paragraph
-        if not description:
-            # Look for paragraphs in main content areas
-            for selector in ['main p', 'article p', '.content p', 'p']:
-                paragraphs = soup.select(selector)
-                for p in paragraphs:
-                    text = p.get_text().strip()
-                    # Skip very short paragraphs and common boilerplate
-                    if len(text) > 50 and 'cookie' not in text.lower():
-                        description = text[:300]  # Limit to 300 chars
-                        break
-                if description:
-                    break
-        
-        # Extract company name from domain
-        domain = urlparse(url).netloc
-        company = domain.replace('www.', '').split('.')[0].capitalize()
-        
-        # Extract email addresses
-        email = ''
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        emails = re.findall(email_pattern, page_text)
-        # Filter out common non-contact emails
-        filtered_emails = [e for e in emails if not any(x in e.lower() for x in ['example', 'test', 'noreply', 'no-reply'])]
-        if filtered_emails:
-            email = filtered_emails[0]  # Take first valid email
-        
-        # Extract phone numbers (basic patterns)
-        phone = ''
-        phone_patterns = [
-            r'\+?1?[-.]?\(?\d{3}\)?[-.]?\d{3}[-.]?\d{4}',  # US/Canada
-            r'\+\d{1,3}[-.]?\d{3,4}[-.]?\d{3,4}[-.]?\d{3,4}',  # International
-        ]
-        for pattern in phone_patterns:
-            phones = re.findall(pattern, page_text)
-            if phones:
-                phone = phones[0]
-                break
-        
-        # Get logo URL
-        logo_url = ''
-        # Try og:image first
-        og_image = soup.find('meta', attrs={'property': 'og:image'})
-        if og_image and og_image.get('content'):
-            logo_url = og_image.get('content')
-        # Try common logo selectors
-        if not logo_url:
-            logo_img = soup.select_one('img[class*="logo"], img[id*="logo"], .logo img, #logo img')
-            if logo_img and logo_img.get('src'):
-                logo_url = logo_img.get('src')
-                # Make absolute URL
-                if logo_url.startswith('/'):
-                    logo_url = f"{urlparse(url).scheme}://{domain}{logo_url}"
-        
-        # Get favicon
-        favicon_url = ''
-        favicon = soup.find('link', rel=lambda x: x and 'icon' in x.lower())
-        if favicon and favicon.get('href'):
-            favicon_url = favicon.get('href')
-            if favicon_url.startswith('/'):
-                favicon_url = f"{urlparse(url).scheme}://{domain}{favicon_url}"
-        else:
-            # Default favicon location
-            favicon_url = f"{urlparse(url).scheme}://{domain}/favicon.ico"
-        
-        # Extract social media links
-        twitter_handle = ''
-        linkedin_url = ''
-        facebook_url = ''
-        instagram_url = ''
-        
-        # Check meta tags for Twitter
-        twitter_site = soup.find('meta', attrs={'name': 'twitter:site'})
-        if twitter_site and twitter_site.get('content'):
-            twitter_handle = twitter_site.get('content').replace('@', '')
-        
-        # Find social media links
-        all_links = soup.find_all('a', href=True)
-        for link in all_links:
-            href = link.get('href', '').lower()
-            if 'twitter.com' in href and not twitter_handle:
-                twitter_handle = href.split('twitter.com/')[-1].split('?')[0].split('/')[0]
-            elif 'linkedin.com' in href and not linkedin_url:
-                linkedin_url = link.get('href')
-            elif 'facebook.com' in href and not facebook_url:
-                facebook_url = link.get('href')
-            elif 'instagram.com' in href and not instagram_url:
-                instagram_url = link.get('href')
-        
-        # Find contact page
-        contact_page = ''
-        for link in all_links:
-            href = link.get('href', '').lower()
-            link_text = link.get_text().lower()
-            if any(word in href or word in link_text for word in ['contact', 'about', 'get-in-touch']):
-                contact_page = link.get('href')
-                if contact_page.startswith('/'):
-                    contact_page = f"{urlparse(url).scheme}://{domain}{contact_page}"
-                break
-        
-        # Extract industry keywords
-        keywords = ''
-        meta_keywords = soup.find('meta', attrs={'name': 'keywords'})
-        if meta_keywords and meta_keywords.get('content'):
-            keywords = meta_keywords.get('content').strip()
-        
-        # Get language
-        language = 'en'  # default
-        html_tag = soup.find('html')
-        if html_tag and html_tag.get('lang'):
-            language = html_tag.get('lang')
-        
-        # Add note if description is from fallback
-        result = {
-            'success': True,
-            'company': company,
-            'url': url,
-            'title': title if title else 'No title found',
-            'description': description if description else 'No description found',
-            'email': email,
-            'phone': phone,
-            'logo_url': logo_url,
-            'favicon_url': favicon_url,
-            'twitter_handle': twitter_handle,
-            'linkedin_url': linkedin_url,
-            'facebook_url': facebook_url,
-            'instagram_url': instagram_url,
-            'contact_page': contact_page,
-            'industry_keywords': keywords,
-            'language': language
-        }
-        
-        return result
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+        self.url = url
+        self.cache = cache
+        self.revalidate = revalidate
+        self.trace = None
+        self.entry = None
+        self.cached = None
+        self.headers = None
+        self.meta = {}
+        self.extractor = LeadExtractor()
+        self.started = None
+
+    def start(self):
+        """Look the page up in the cache; True if the cached result is to be returned as is"""
+        self.trace = ScrapeTrace(self.url)
+        self.cache = _resolve_cache(self.cache)
+        with self.trace.timed('cache'):
+            self.entry = self.cache.get(self.url) if self.cache else None
+        if self.entry and self.entry.is_fresh(self.cache.ttl) and not self.revalidate:
+            self.trace.finish('cached')
+            self.cached = self.entry.result_for(self.url)
+            return True
+        self.headers = self.entry.conditional_headers() if self.entry else None
+        self.started = time.perf_counter()
+        return False
+
+    def feed(self, text):
+        """Parse a chunk of the page; True once the rest isn't needed"""
+        with self.trace.timed('parse'):
+            self.extractor.feed(text)
+        return self.extractor.is_complete()
+
+    def fetched(self):
+        """Record the download; True if the page should go to the headless browser"""
+        self.trace.fetched(self.meta, time.perf_counter() - self.started)
+        return _needs_render(self.extractor, self.meta, self.entry)
+
+    def rendered(self, html):
+        if html is not None:
+            self.extractor = _rendered_extractor(html, self.trace)
+
+    def finish(self):
+        return _finish_scrape(self.url, self.extractor, self.meta, self.cache, self.entry, self.trace)
+
+    def error(self, e):
+        return _scrape_error(e, self.trace)
+
+def _needs_render(extractor, meta, entry):
+    # Only JavaScript shells go to the headless browser (render.py); a 304 reuses the stored result
+    if (meta.get('status_code') == 304 and entry) or get_renderer() is None:
+        return False
+    extractor.close()
+    return extractor.is_empty_shell()
+
+def _rendered_extractor(html, trace):
+    extractor = LeadExtractor()
+    with trace.timed('parse'):
+        extractor.feed(html)
+    return extractor
+
+def _finish_scrape(url, extractor, meta, cache, entry, trace):
+    # Not modified - reuse the stored extraction without parsing anything
+    if meta.get('status_code') == 304 and entry:
+        cache.revalidated(url, meta['etag'], meta['last_modified'])
+        trace.finish('not_modified')
+        return entry.result_for(url)
+    
+    with trace.timed('extract'):
+        extractor.close()
+        result = extractor.result(url, timings=trace.fields)
+    with trace.timed('cache'):
+        if cache:
+            cache.put(url, result, meta.get('etag'), meta.get('last_modified'))
+    trace.finish('ok')
+    return result
+
+def _scrape_error(e, trace):
+    category = trace.failed(e) if trace else metrics.error_category(e)
+    return {
+        'success': False,
+        'error': str(e),
+        'error_category': category
+    }
 
 # Routes
 @app.route('/')
@@ -253,138 +264,401 @@ def add_lead():
         if not url:
             return render_template('add_lead.html', error='Please enter a URL')
         
-        # Scrape the website
-        result = scrape_website(url)
-        
-        if not result['success']:
-            return render_template('add_lead.html', error=f"Error scraping website: {result['error']}")
-        
-        # Save to database
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute(
-            '''INSERT INTO leads (company, url, title, description, email, phone, logo_url, favicon_url, 
-               twitter_handle, linkedin_url, facebook_url, instagram_url, contact_page, industry_keywords, language) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (result['company'], result['url'], result['title'], result['description'], result['email'],
-             result['phone'], result['logo_url'], result['favicon_url'], result['twitter_handle'],
-             result['linkedin_url'], result['facebook_url'], result['instagram_url'], result['contact_page'],
-             result['industry_keywords'], result['language'])
-        )
-        conn.commit()
-        conn.close()
-        
-        return render_template('add_lead.html', success=True, lead=result)
+        # Queue the scrape and show its progress page
+        job = queue_scrape(url)
+        return redirect(url_for('add_lead', job=job['id']))
+    
+    job_id = request.args.get('job', type=int)
+    if job_id is None:
+        return render_template('add_lead.html')
     
-    return render_template('add_lead.html')
+    job = get_job(get_db(), job_id)
+    if job is None:
+        return render_template('add_lead.html', error='Scrape job not found')
+    if job['status'] == DONE:
+        return render_template('add_lead.html', success=True, lead=get_lead(get_db(), job['lead_id']))
+    if job['status'] == FAILED:
+        return render_template('add_lead.html', error=f"Error scraping website: {job['error']}")
+    return render_template('add_lead.html', pending=True, job=job)
+
+def queue_scrape(url):
+    """Queue a scrape + save job for url and wake a worker; returns the job dict"""
+    job = enqueue_job(get_db(), url)
+    job_runner.notify()
+    return job
+
+@app.route('/api/jobs', methods=['POST'])
+def add_job_api():
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or '').strip()
+    if not url:
+        return jsonify({'success': False, 'error': 'URL is required'}), 400
+    return jsonify({'success': True, 'job': queue_scrape(url)}), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def job_status_api(job_id):
+    conn = get_db()
+    job = get_job(conn, job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job['status'] == DONE:
+        job['lead'] = get_lead(conn, job['lead_id'])
+    return jsonify({'success': True, 'job': job})
+
+DASHBOARD_PAGE_SIZE = 50
+KEYWORDS_PREVIEW_LENGTH = 50
+DASHBOARD_FIELDS = list(READABLE_FIELDS) + ['icon_asset']
+# Icons are named by their content, so a URL never changes what it serves
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+@app.route('/assets/<name>')
+def asset(name):
+    # Icon thumbnails from the local asset cache (assets.py)
+    if not ASSET_NAME_RE.match(name):
+        abort(404)
+    response = send_from_directory(os.path.abspath(ASSETS_DIR), asset_path(name), mimetype=asset_mimetype(name),
+                                   max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    # SVG icons can carry scripts; never run them
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+def lead_card(lead):
+    """A lead's dashboard card, rendered once per version of its content"""
+    def render():
+        keywords = lead['industry_keywords'] or ''
+        if len(keywords) > KEYWORDS_PREVIEW_LENGTH:
+            keywords = keywords[:KEYWORDS_PREVIEW_LENGTH] + '...'
+        created_date = (lead['created_at'] or '').split(' ')[0]
+        return Markup(render_template('lead_card.html', lead=lead, created_date=created_date,
+                                      keywords_preview=keywords, hotlink_icons=not ASSETS_ENABLED))
+    # created_at never changes for an id, everything else shown is in the content hash or the icon
+    return cached_fragment((lead['id'], content_hash(lead), lead['icon_asset']), render)
 
 @app.route('/dashboard')
 def dashboard():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM leads ORDER BY created_at DESC')
-    leads = cursor.fetchall()
-    conn.close()
+    try:
+        filters = parse_filters(request.args)
+        cursor = parse_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return render_template('dashboard.html', leads=[], total=0, filters={}, error=str(e))
     
-    return render_template('dashboard.html', leads=leads)
-
-# API endpoint for Chrome extension
-@app.route('/api/leads', methods=['POST'])
-def add_lead_api():
-    data = request.json
+    conn = get_db()
     
-    url = data.get('url', '').strip()
-    title = data.get('title', '').strip()
-    description = data.get('description', '').strip()
+    def build():
+        leads, next_cursor = list_leads(conn, filters, DASHBOARD_PAGE_SIZE, cursor, DASHBOARD_FIELDS)
+        total = count_leads(conn, filters)
+        return Response(render_template('dashboard.html', leads=leads, cards=[lead_card(lead) for lead in leads],
+                                        total=total, filters=filters, next_cursor=next_cursor,
+                                        is_first_page=cursor is None), mimetype='text/html')
     
+    # 304 or the stored page unless a lead changed since
+    return cached_page(leads_version(conn), build)
+
+# Most leads and bytes (after decompression) accepted in one batch upload
+MAX_BATCH_LEADS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+# Unparseable URLs listed in a bulk import response
+MAX_INVALID_REPORTED = 100
+# Extra fields the extension may send with a lead, and their defaults
+EXTENSION_FIELDS = {
+    'email': '', 'phone': '', 'logo_url': '', 'favicon_url': '', 'twitter_handle': '', 'linkedin_url': '',
+    'facebook_url': '', 'instagram_url': '', 'contact_page': '', 'industry_keywords': '', 'language': 'en'
+}
+
+def json_text(data, field, default=''):
+    """A JSON field as a string: numbers and booleans are converted, objects and arrays raise ValueError"""
+    value = data.get(field)
+    if value is None:
+        return default
+    if isinstance(value, (dict, list)):
+        raise ValueError(f'{field} must be a string')
+    return str(value)
+
+def lead_from_json(data):
+    """Lead dict from a JSON object sent by the extension; raises ValueError without a usable URL"""
+    url = json_text(data, 'url').strip()
     if not url:
-        return jsonify({'success': False, 'error': 'URL is required'}), 400
+        raise ValueError('URL is required')
+    # Raises ValueError for URLs that can't be parsed, e.g. http://[bad
+    canonical_url(url)
     
     # Extract company name from URL
     domain = urlparse(url).netloc
     company = domain.replace('www.', '').split('.')[0].capitalize()
     
-    # Extract additional data from request
-    email = data.get('email', '')
-    phone = data.get('phone', '')
-    logo_url = data.get('logo_url', '')
-    favicon_url = data.get('favicon_url', '')
-    twitter_handle = data.get('twitter_handle', '')
-    linkedin_url = data.get('linkedin_url', '')
-    facebook_url = data.get('facebook_url', '')
-    instagram_url = data.get('instagram_url', '')
-    contact_page = data.get('contact_page', '')
-    keywords = data.get('industry_keywords', '')
-    language = data.get('language', 'en')
+    lead = {
+        'company': company,
+        'url': url,
+        'title': json_text(data, 'title').strip(),
+        'description': json_text(data, 'description').strip()
+    }
+    for field, default in EXTENSION_FIELDS.items():
+        lead[field] = json_text(data, field, default)
+    return lead
+
+def is_retryable(error):
+    """Whether a lead that failed to save with error may succeed if sent again"""
+    if isinstance(error, sqlite3.OperationalError):
+        # Locked or unreachable database
+        return True
+    return not isinstance(error, (ValueError, sqlite3.Error))
+
+def read_json_body(max_bytes):
+    """Parse the request body as JSON, decompressing it first if it was sent gzip or deflate encoded"""
+    body = request.get_data(cache=False)
+    if len(body) > max_bytes:
+        abort(413)
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding in ('gzip', 'deflate'):
+        # 16 + MAX_WBITS expects a gzip header, MAX_WBITS a zlib one
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, max_bytes + 1)
+        except zlib.error:
+            raise ValueError('Could not decompress the request body')
+        if len(body) > max_bytes:
+            abort(413)
+    elif encoding != 'identity':
+        abort(415)
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ValueError('Request body is not valid JSON')
+
+# API endpoint for Chrome extension
+@app.route('/api/leads', methods=['POST'])
+def add_lead_api():
+    data = request.get_json(silent=True)
+    
+    try:
+        lead = lead_from_json(data if isinstance(data, dict) else {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     # Save to database
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO leads (company, url, title, description, email, phone, logo_url, favicon_url,
-           twitter_handle, linkedin_url, facebook_url, instagram_url, contact_page, industry_keywords, language)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-        (company, url, title, description, email, phone, logo_url, favicon_url, twitter_handle,
-         linkedin_url, facebook_url, instagram_url, contact_page, keywords, language)
-    )
-    conn.commit()
-    lead_id = cursor.lastrowid
-    conn.close()
+    try:
+        lead_id = save_lead(lead, scraped=False)
+    except WriterBusyError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    
+    return jsonify({'success': True, 'lead': dict(id=lead_id, **lead)})
+
+@app.route('/api/leads/batch', methods=['POST'])
+def add_leads_batch_api():
+    # Many leads in one request and one transaction, e.g. the extension's upload queue
+    try:
+        data = read_json_body(MAX_BATCH_BYTES)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    items = data.get('leads') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'Send a JSON array of leads'}), 400
+    if len(items) > MAX_BATCH_LEADS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BATCH_LEADS} leads per batch'}), 400
+    
+    results = [None] * len(items)
+    leads = []
+    for index, item in enumerate(items):
+        try:
+            leads.append((index, lead_from_json(item if isinstance(item, dict) else {})))
+        except ValueError as e:
+            results[index] = {'index': index, 'success': False, 'error': str(e), 'retryable': False}
     
-    return jsonify({
-        'success': True,
-        'lead': {
-            'id': lead_id,
-            'company': company,
-            'url': url,
-            'title': title,
-            'description': description,
-            'email': email,
-            'phone': phone,
-            'logo_url': logo_url,
-            'favicon_url': favicon_url,
-            'twitter_handle': twitter_handle,
-            'linkedin_url': linkedin_url,
-            'facebook_url': facebook_url,
-            'instagram_url': instagram_url,
-            'contact_page': contact_page,
-            'industry_keywords': keywords,
-            'language': language
-        }
-    })
+    try:
+        futures = get_writer().submit_many([lead for _, lead in leads], scraped=False)
+    except WriterBusyError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    
+    for (index, lead), future in zip(leads, futures):
+        try:
+            results[index] = {'index': index, 'success': True, 'id': wait_saved(future), 'url': lead['url']}
+        except Exception as e:
+            results[index] = {'index': index, 'success': False, 'error': str(e), 'retryable': is_retryable(e)}
+    
+    saved = sum(1 for result in results if result['success'])
+    return jsonify({'success': True, 'saved': saved, 'failed': len(items) - saved, 'results': results})
 
 @app.route('/api/leads', methods=['GET'])
 def get_leads_api():
+    # Filters: domain, language, has_email, since, until. Paging: limit, cursor. Projection: fields
+    try:
+        filters = parse_filters(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        cursor = parse_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM leads ORDER BY created_at DESC')
-    rows = cursor.fetchall()
-    conn.close()
     
-    leads = []
-    for row in rows:
-        leads.append({
-            'id': row['id'],
-            'company': row['company'],
-            'url': row['url'],
-            'title': row['title'],
-            'description': row['description'],
-            'email': row['email'],
-            'phone': row['phone'],
-            'logo_url': row['logo_url'],
-            'favicon_url': row['favicon_url'],
-            'twitter_handle': row['twitter_handle'],
-            'linkedin_url': row['linkedin_url'],
-            'facebook_url': row['facebook_url'],
-            'instagram_url': row['instagram_url'],
-            'contact_page': row['contact_page'],
-            'industry_keywords': row['industry_keywords'],
-            'language': row['language'],
-            'created_at': row['created_at']
-        })
+    def build():
+        leads, next_cursor = list_leads(conn, filters, limit, cursor, fields)
+        return jsonify({'success': True, 'leads': leads, 'next_cursor': next_cursor})
+    
+    return cached_page(leads_version(conn), build)
+
+@app.route('/api/leads/search', methods=['GET'])
+def search_leads_api():
+    # Full-text search over company, title, description and keywords; same filters, fields and paging as GET /api/leads
+    query = match_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify({'success': False, 'error': 'q must contain at least one word'}), 400
+    try:
+        filters = parse_filters(request.args)
+        fields = parse_fields(request.args.get('fields'))
+        limit = parse_limit(request.args.get('limit'))
+        cursor = decode_search_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
-    return jsonify({'success': True, 'leads': leads})
+    conn = get_db()
+    
+    def build():
+        leads, next_cursor = search_leads(conn, query, filters, limit, cursor, fields)
+        return jsonify({'success': True, 'leads': leads, 'next_cursor': next_cursor})
+    
+    return cached_page(leads_version(conn), build)
+
+@app.route('/api/leads/export', methods=['GET'])
+def export_leads_api():
+    # Streams every matching lead as CSV (default) or NDJSON; takes the same filters and fields as GET /api/leads
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'error': 'format must be csv or ndjson'}), 400
+    try:
+        filters = parse_filters(request.args)
+        fields = parse_fields(request.args.get('fields')) or list(READABLE_FIELDS)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    def generate():
+        # Long-running read on its own connection rather than the thread's shared one
+        conn = db.connect()
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if export_format == 'csv':
+                writer.writerow(fields)
+            for row in iter_leads(conn, filters, fields):
+                if export_format == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(fields, row))) + '\n')
+                # Flush in ~64 KB pieces rather than one write per row
+                if buffer.tell() >= 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            conn.close()
+    
+    if export_format == 'csv':
+        mimetype, filename = 'text/csv', 'leads.csv'
+    else:
+        mimetype, filename = 'application/x-ndjson', 'leads.ndjson'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# Bulk import - scrapes run on a shared worker pool, contact crawls on the crawler's, clients poll for progress
+# Scrapes queued from /add-lead and /api/jobs
+job_runner = JobRunner(scrape_website, save_lead,
+                       enrich=(lambda result: get_crawler().crawl(result)) if CRAWL_ENABLED else None)
+
+bulk_importer = BulkImporter(scrape_website_async, save_lead, kind='import',
+                             enrich=lambda result: get_crawler().submit(result))
+
+@app.route('/api/leads/bulk', methods=['POST'])
+def bulk_import_api():
+    # Accept a CSV upload (multipart "file" or a text/csv body) or JSON {"urls": [...]}
+    upload = request.files.get('file')
+    if upload:
+        urls, invalid = parse_csv_urls(upload.read().decode('utf-8-sig', errors='replace'))
+    elif request.mimetype == 'text/csv':
+        urls, invalid = parse_csv_urls(request.get_data(as_text=True))
+    else:
+        data = request.get_json(silent=True) or {}
+        urls = data.get('urls')
+        if not isinstance(urls, list):
+            return jsonify({'success': False, 'error': 'Provide a JSON "urls" list or a CSV file'}), 400
+        urls, invalid = parse_url_list(urls)
+    
+    # Unparseable rows are reported back, the rest are imported
+    invalid = invalid[:MAX_INVALID_REPORTED]
+    if not urls:
+        return jsonify({'success': False, 'error': 'No URLs found', 'invalid': invalid}), 400
+    if len(urls) > MAX_URLS_PER_JOB:
+        return jsonify({'success': False, 'error': f'At most {MAX_URLS_PER_JOB} URLs per job'}), 400
+    
+    # Domains that already have a lead are skipped unless ?skip_known=false
+    skipped = 0
+    if request.args.get('skip_known', 'true').lower() not in ('0', 'false', 'no'):
+        known = known_domains(get_db(), {lead_domain(url) for url in urls})
+        if known:
+            new_urls = [url for url in urls if lead_domain(url) not in known]
+            skipped = len(urls) - len(new_urls)
+            urls = new_urls
+    
+    # Contact-page crawl: CONTACT_CRAWL setting unless ?crawl_contacts= says otherwise
+    crawl_contacts = request.args.get('crawl_contacts', '').lower()
+    crawl_contacts = crawl_contacts in ('1', 'true', 'yes') if crawl_contacts else CRAWL_ENABLED
+    
+    try:
+        job = bulk_importer.submit(urls, skipped, enrich=crawl_contacts)
+    except RuntimeError as e:
+        # Shutting down - another worker will take the retry
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return jsonify({'success': True, 'job': job, 'invalid': invalid}), 202
+
+@app.route('/api/leads/bulk/<job_id>', methods=['GET'])
+def bulk_import_status_api(job_id):
+    job = bulk_importer.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+# Re-scrapes of existing leads, updated in place (see refresh.py)
+refresh_importer = BulkImporter(rescrape_website_async, refresh_lead, kind='refresh', max_in_flight=REFRESH_WORKERS,
+                                per_host_limit=REFRESH_PER_HOST_LIMIT, rate=REFRESH_RATE,
+                                enrich=lambda result: get_crawler().submit(result))
+
+@app.route('/api/leads/refresh', methods=['POST'])
+def refresh_leads_api():
+    # Leads scraped more than ?older_than= days ago and/or missing any of ?missing=, narrowed by the list filters
+    try:
+        older_than = parse_age(request.args.get('older_than'))
+        missing = parse_missing(request.args.get('missing'))
+        filters = parse_filters(request.args)
+        limit = parse_refresh_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    leads = select_stale_leads(get_db(), older_than, missing, filters, limit)
+    crawl_contacts = request.args.get('crawl_contacts', '').lower()
+    crawl_contacts = crawl_contacts in ('1', 'true', 'yes') if crawl_contacts else CRAWL_ENABLED
+    try:
+        job = refresh_importer.submit([url for _, url in leads], enrich=crawl_contacts)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return jsonify({'success': True, 'job': job}), 202
+
+@app.route('/api/leads/refresh/<job_id>', methods=['GET'])
+def refresh_status_api(job_id):
+    job = refresh_importer.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    # Prometheus text exposition format
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True, port=5000)
+    # Development server; use gunicorn (gunicorn.conf.py) in production
+    create_app().run(debug=os.environ.get('FLASK_DEBUG', '1') == '1', port=int(os.environ.get('PORT', 5000)),
+                     threaded=True)
@@ -0,0 +1,367 @@
+"""
+Local thumbnail cache for lead logos and favicons.
+
+The dashboard shows each lead's icon from /assets/ rather than hotlinking
+the site's own image. A background AssetPipeline picks up leads whose icon
+hasn't been fetched yet (icon_asset IS NULL), tries the logo and then the
+favicon, fetches them on a small thread pool and, with Pillow installed,
+downscales raster images to THUMBNAIL_SIZE PNGs. Files are named by a hash
+of their bytes, so leads sharing an icon share one file. The directory is
+kept under ASSETS_MAX_MB by deleting the files least recently stored or
+reused (the assets table, created by a schema migration, records their sizes).
+
+leads.icon_asset holds the file name, '' when the lead has no usable icon
+(or it was evicted), and NULL until the pipeline has been through it.
+leads.icon_retry_at is when a lead still without one may be taken again:
+claiming it sets a lease of ICON_CLAIM_LEASE seconds, so leads claimed by a
+process that died are picked up once it runs out, and a fetch that failed on
+a timeout, reset or server error waits ICON_RETRY_DELAY seconds, doubling
+each time, before the next attempt (icon_attempts counts them). Only a
+missing image (404/410) or one that can't be used stores ''.
+Without Pillow, icons are stored as fetched when they are small enough.
+"""
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import db
+from fetcher import get_fetcher
+from metrics import ASSET_FETCHES
+
+ASSETS_ENABLED = os.environ.get('ASSET_CACHE', '1') != '0'
+ASSETS_DIR = os.environ.get('ASSETS_DIR', 'assets')
+ASSETS_MAX_BYTES = int(os.environ.get('ASSETS_MAX_MB', 200)) * 1024 * 1024
+ASSET_WORKERS = int(os.environ.get('ASSET_WORKERS', 4))
+# Thumbnails fit in a square this many pixels wide (the dashboard shows them at 48px)
+THUMBNAIL_SIZE = 96
+MAX_ICON_BYTES = 1024 * 1024
+# Largest icon stored as-is when it can't be resized (SVG, or no Pillow)
+MAX_RAW_BYTES = 64 * 1024
+# Images with more pixels than this are skipped rather than decoded
+MAX_PIXELS = 4096 * 4096
+ICON_TIMEOUT = 10
+# Seconds a claimed lead is held before another pass may take it
+ICON_CLAIM_LEASE = 600
+# Wait after the first failed attempt on a transient error, doubled after each further one
+ICON_RETRY_DELAY = 3600
+# Transient failures before a lead is given up on
+ICON_MAX_ATTEMPTS = 5
+# HTTP statuses that mean the image isn't there, rather than that the site is having trouble
+MISSING_STATUSES = (404, 410)
+CLAIM_BATCH = 50
+POLL_INTERVAL = 5.0
+# Size is checked, and the oldest files evicted, once every EVICT_EVERY stored icons
+EVICT_EVERY = 50
+
+# File signatures of the image types kept, and their extensions
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'\x00\x00\x01\x00', 'ico'),
+)
+MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp',
+             'ico': 'image/x-icon', 'svg': 'image/svg+xml'}
+ASSET_NAME_RE = re.compile(r'^[0-9a-f]{32}\.(?:png|jpg|gif|webp|ico|svg)$')
+
+
+def image_type(data):
+    """Extension for image bytes by their signature, or None"""
+    for signature, ext in SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    head = data[:1024].lstrip().lower()
+    if head.startswith((b'<svg', b'<?xml')) and b'<svg' in head:
+        return 'svg'
+    return None
+
+
+def make_thumbnail(data):
+    """(bytes, ext) of the icon to store for downloaded image data, or None if it isn't usable"""
+    ext = image_type(data)
+    if ext is None:
+        return None
+    if Image is not None and ext != 'svg':
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if image.width * image.height > MAX_PIXELS:
+                    return None
+                if ext == 'ico' and hasattr(image, 'ico'):
+                    # Largest size in the .ico
+                    image.size = max(image.ico.sizes(), key=lambda size: size[0] * size[1])
+                image = image.convert('RGBA')
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                out = io.BytesIO()
+                image.save(out, 'PNG', optimize=True)
+                return out.getvalue(), 'png'
+        except Exception:
+            # Pillow raises all sorts of errors on broken or unsupported files
+            return None
+    if len(data) > MAX_RAW_BYTES:
+        return None
+    return data, ext
+
+
+def icon_urls(lead):
+    """Absolute http(s) URLs to try for a lead's icon, logo first"""
+    urls = []
+    for value in (lead['logo_url'], lead['favicon_url']):
+        if not value:
+            continue
+        url = urljoin(lead['url'], value.strip())
+        if url.startswith(('http://', 'https://')) and url not in urls:
+            urls.append(url)
+    return urls
+
+
+class AssetStore:
+    """Content-addressed icon files under a directory, indexed in the assets table"""
+
+    def __init__(self, directory=ASSETS_DIR, max_bytes=ASSETS_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._stored = 0
+        self._stored_lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, asset_path(name))
+
+    def put(self, conn, data, ext):
+        """Store icon bytes (once per distinct content) and return the file name"""
+        name = f'{hashlib.sha256(data).hexdigest()[:32]}.{ext}'
+        path = self.path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = f'{path}.{threading.get_ident()}.tmp'
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        with conn:
+            conn.execute(
+                '''INSERT INTO assets (name, bytes, used_at) VALUES (?, ?, ?)
+                   ON CONFLICT (name) DO UPDATE SET used_at = excluded.used_at''',
+                (name, len(data), time.time())
+            )
+        with self._stored_lock:
+            self._stored += 1
+            due = self._stored % EVICT_EVERY == 0
+        if due:
+            self.evict(conn)
+        return name
+
+    def evict(self, conn):
+        """Delete the least recently stored files beyond max_bytes; returns how many"""
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM assets').fetchone()[0]
+        evicted = 0
+        while total > self.max_bytes:
+            rows = conn.execute('SELECT name, bytes FROM assets ORDER BY used_at LIMIT 100').fetchall()
+            if not rows:
+                break
+            names = []
+            for name, size in rows:
+                names.append(name)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            placeholders = ', '.join('?' * len(names))
+            with conn:
+                # Leads showing an evicted icon go without rather than fetching it again
+                conn.execute(f"UPDATE leads SET icon_asset = '' WHERE icon_asset IN ({placeholders})", names)
+                conn.execute(f'DELETE FROM assets WHERE name IN ({placeholders})', names)
+            for name in names:
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+            evicted += len(names)
+        return evicted
+
+
+class AssetPipeline:
+    """Background thread that claims leads without an icon and fetches theirs on a thread pool"""
+
+    def __init__(self, store=None, workers=ASSET_WORKERS, fetcher=None):
+        self.store = store or AssetStore()
+        self.workers = workers
+        self._fetcher = fetcher
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._executor = None
+        self._claimed = set()
+        self._claimed_lock = threading.Lock()
+
+    def start(self):
+        """Start the pipeline thread (once)"""
+        if self._thread is not None or not self.workers:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='asset-fetch')
+        self._thread = threading.Thread(target=self._run, name='asset-pipeline', daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Look for new leads now rather than at the next poll"""
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self, timeout=None):
+        """Finish the icons being fetched; leads claimed but not started are left for the next run"""
+        if self._thread is None:
+            return
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._thread.join(timeout)
+        self._thread = None
+        with self._claimed_lock:
+            unfinished = list(self._claimed)
+            self._claimed.clear()
+        if unfinished:
+            conn = db.connect()
+            with conn:
+                conn.execute(f'UPDATE leads SET icon_retry_at = NULL WHERE icon_asset IS NULL AND id IN '
+                             f"({', '.join('?' * len(unfinished))})", unfinished)
+            conn.close()
+
+    def claim(self, conn, limit=CLAIM_BATCH):
+        """Lease up to limit leads without an icon that are due; returns their rows"""
+        now = time.time()
+        with conn:
+            rows = conn.execute(
+                '''UPDATE leads SET icon_retry_at = ?
+                   WHERE id IN (SELECT id FROM leads
+                                WHERE icon_asset IS NULL AND (icon_retry_at IS NULL OR icon_retry_at <= ?)
+                                LIMIT ?)
+                   RETURNING id, url, logo_url, favicon_url, icon_attempts''',
+                (now + ICON_CLAIM_LEASE, now, limit)
+            ).fetchall()
+        with self._claimed_lock:
+            self._claimed.update(row['id'] for row in rows)
+        return rows
+
+    def fetch_icon(self, lead):
+        """Fetch, shrink and store the first usable icon of a lead.
+
+        Returns its file name, '' when the lead has no usable icon, or None when
+        a download failed in a way worth trying again later.
+        """
+        conn = db.get_db()
+        transient = False
+        for url in icon_urls(lead):
+            try:
+                data = self._download(url)
+            except ValueError:
+                ASSET_FETCHES.inc('unusable')
+                continue
+            except requests.RequestException as e:
+                ASSET_FETCHES.inc('error')
+                response = getattr(e, 'response', None)
+                if response is None or response.status_code not in MISSING_STATUSES:
+                    transient = True
+                continue
+            thumbnail = make_thumbnail(data)
+            if thumbnail is None:
+                ASSET_FETCHES.inc('unusable')
+                continue
+            ASSET_FETCHES.inc('stored')
+            return self.store.put(conn, *thumbnail)
+        return None if transient else ''
+
+    def _download(self, url):
+        fetcher = self._fetcher or get_fetcher()
+        with fetcher.session.get(url, timeout=ICON_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > MAX_ICON_BYTES:
+                    raise ValueError('Icon too large')
+            return bytes(data)
+
+    def _process(self, lead):
+        try:
+            name = self.fetch_icon(lead)
+            conn = db.get_db()
+            with conn:
+                if name is not None or lead['icon_attempts'] + 1 >= ICON_MAX_ATTEMPTS:
+                    conn.execute('UPDATE leads SET icon_asset = ?, icon_retry_at = NULL WHERE id = ?',
+                                 (name or '', lead['id']))
+                else:
+                    delay = ICON_RETRY_DELAY * 2 ** lead['icon_attempts']
+                    conn.execute('UPDATE leads SET icon_retry_at = ?, icon_attempts = icon_attempts + 1 '
+                                 'WHERE id = ?', (time.time() + delay, lead['id']))
+        except Exception:
+            # Disk or database trouble - the lead is taken again once its claim runs out
+            db.release()
+        finally:
+            with self._claimed_lock:
+                self._claimed.discard(lead['id'])
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                try:
+                    leads = self.claim(db.get_db())
+                except sqlite3.Error:
+                    db.release()
+                    leads = []
+                if leads:
+                    try:
+                        wait([self._executor.submit(self._process, lead) for lead in leads])
+                    except RuntimeError:
+                        # Executor shut down under us
+                        break
+                    continue
+                with self._wake:
+                    if not self._stopping:
+                        self._wake.wait(POLL_INTERVAL)
+        finally:
+            db.close()
+
+
+def asset_mimetype(name):
+    return MIMETYPES[name.rsplit('.', 1)[1]]
+
+
+def asset_path(name):
+    """Path of a stored icon relative to ASSETS_DIR"""
+    return os.path.join(name[:2], name)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_asset_pipeline():
+    """Process-wide AssetPipeline, created on first use"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = AssetPipeline()
+    return _pipeline
+
+
+def stop_asset_pipeline():
+    """Stop the process-wide pipeline if one was started"""
+    with _pipeline_lock:
+        pipeline = _pipeline
+    if pipeline is not None:
+        pipeline.stop()
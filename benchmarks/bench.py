@@ -0,0 +1,449 @@
+"""
+Benchmark suite for the scraper and the leads API.
+
+Serves the saved pages in benchmarks/corpus from a local HTTP server, so
+runs are reproducible and need no network, and measures:
+
+- scrape: app.scrape_website end to end (fetch, parse, extract), cache off
+- parse: LeadExtractor alone on pages already in memory
+- api: GET /api/leads (first page, filtered, deep cursor pages),
+  GET /api/leads/search and POST /api/leads on databases of 10k, 100k and
+  1M synthetic leads. The response cache (httpcache) is cleared before each
+  GET so the queries are measured; list_cached times the cached page alone
+
+Every scrape and parse result is checked against the fields recorded for
+the page in corpus.json, so a change that gets faster by extracting less
+fails instead of passing quietly. Timings are compared with a stored
+baseline, and any check failure or a p50 slower than the baseline by more
+than the tolerance makes the run exit with status 1.
+
+    python benchmarks/bench.py                      # everything, compared to baseline.json
+    python benchmarks/bench.py --only scrape,parse  # skip the API benchmarks
+    python benchmarks/bench.py --rows 10000,100000  # smaller databases
+    python benchmarks/bench.py --save-baseline      # record this run as the new baseline
+
+Baselines are machine-specific; record one on the machine you compare on.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# Measure the scraper, not the on-disk scrape cache
+os.environ['SCRAPE_CACHE'] = '0'
+
+import db
+from app import app, scrape_website
+from extractor import extract_lead
+from leads import LEAD_FIELDS
+from httpcache import page_cache
+from writer import ROW_COLUMNS, get_writer, lead_row
+
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+CORPUS_MANIFEST = os.path.join(BENCH_DIR, 'corpus.json')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+# Bumped when results stop being comparable with older baselines (2: API GETs no longer served from the page cache)
+BASELINE_FORMAT = 2
+
+DEFAULT_ROWS = (10000, 100000, 1000000)
+# A p50 this much slower than the baseline counts as a regression
+DEFAULT_TOLERANCE = 0.25
+PAD_MARKER = '<!-- ARTICLES -->'
+INSERT_BATCH = 10000
+
+LANGUAGES = ('en', 'en', 'en', 'de', 'fr', 'es')
+COMPANY_WORDS = ('acme', 'northwind', 'globex', 'initech', 'umbrella', 'stark', 'wayne', 'tyrell', 'cyberdyne',
+                 'hooli', 'vandelay', 'soylent', 'wonka', 'gringotts', 'oscorp', 'aperture')
+INDUSTRY_WORDS = ('logistics', 'software', 'plumbing', 'bakery', 'consulting', 'ceramics', 'analytics', 'solar',
+                  'dental', 'architecture', 'marketing', 'freight', 'security', 'robotics', 'catering', 'fitness')
+
+
+# -- corpus
+
+def load_corpus():
+    """Pages from corpus.json with their HTML; pad_kb pages are filled with generated articles"""
+    with open(CORPUS_MANIFEST, encoding='utf-8') as f:
+        pages = json.load(f)
+    for page in pages:
+        with open(os.path.join(CORPUS_DIR, page['file']), encoding='utf-8') as f:
+            html = f.read()
+        if page.get('pad_kb'):
+            html = html.replace(PAD_MARKER, filler_articles(page['pad_kb'] * 1024))
+        page['html'] = html
+        page['body'] = html.encode('utf-8')
+    return pages
+
+
+def filler_articles(size):
+    """Deterministic article markup of about size bytes"""
+    rng = random.Random(size)
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        words = ' '.join(rng.choice(INDUSTRY_WORDS + COMPANY_WORDS) for _ in range(60))
+        part = (f'<article><h2><a href="/news/{n}">Story {n}: {words[:60]}</a></h2>'
+                f'<p class="standfirst">{words}.</p><img src="/img/story-{n}.jpg" alt=""></article>\n')
+        parts.append(part)
+        total += len(part)
+        n += 1
+    return ''.join(parts)
+
+
+class CorpusHandler(BaseHTTPRequestHandler):
+    pages = {}
+
+    def do_GET(self):
+        body = self.pages.get(self.path.split('?')[0])
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(pages):
+    """Serve each page at /<name>/ on a free local port; returns (server, base_url)"""
+    CorpusHandler.pages = {f'/{page["name"]}/': page['body'] for page in pages}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CorpusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='corpus-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def check_result(page, result):
+    """Mismatches between an extraction result and the page's expected fields"""
+    if not result.get('success'):
+        return [f'{page["name"]}: scrape failed: {result.get("error")}']
+    return [f'{page["name"]}: {field} = {result.get(field)!r}, expected {value!r}'
+            for field, value in page.get('expect', {}).items() if result.get(field) != value]
+
+
+# -- timing
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(samples, elapsed=None):
+    """Latency percentiles in ms and throughput per second for a list of durations in seconds"""
+    ordered = sorted(samples)
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    return {
+        'count': len(samples),
+        'per_sec': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(ordered, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    return time.perf_counter() - start, value
+
+
+# -- benchmarks
+
+def bench_scrape(pages, base_url, iterations, concurrency):
+    """End-to-end app.scrape_website, per page and all pages concurrently"""
+    results = {}
+    failures = []
+    for page in pages:
+        url = f'{base_url}/{page["name"]}/'
+        samples = []
+        for i in range(iterations):
+            seconds, result = timed(scrape_website, url)
+            samples.append(seconds)
+            if i == 0:
+                failures += check_result(page, result)
+        results[f'scrape/{page["name"]}'] = summarize(samples)
+
+    urls = [f'{base_url}/{page["name"]}/' for page in pages] * iterations
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda url: timed(scrape_website, url)[0], urls))
+    results[f'scrape/all_x{concurrency}'] = summarize(timings, time.perf_counter() - start)
+    return results, failures
+
+
+def bench_parse(pages, iterations):
+    """LeadExtractor on in-memory HTML, no network"""
+    results = {}
+    failures = []
+    for page in pages:
+        url = f'https://{page["name"]}.test/'
+        samples = []
+        for i in range(iterations):
+            seconds, result = timed(extract_lead, page['html'], url)
+            samples.append(seconds)
+            if i == 0:
+                failures += check_result(page, result)
+        summary = summarize(samples)
+        summary['mb_per_sec'] = round(len(page['body']) * len(samples) / sum(samples) / 1e6, 2)
+        results[f'parse/{page["name"]}'] = summary
+    return results, failures
+
+
+def synthetic_leads(count, seed=1):
+    """count distinct leads spread over the last year, newest last"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=365) / count
+    for i in range(count):
+        company = f'{rng.choice(COMPANY_WORDS)}-{rng.choice(INDUSTRY_WORDS)}-{i}'
+        industry = rng.choice(INDUSTRY_WORDS)
+        url = f'https://www.{company}.com/'
+        lead = {field: '' for field in LEAD_FIELDS}
+        lead.update({
+            'company': company.split('-')[0].capitalize(),
+            'url': url,
+            'title': f'{company.split("-")[0].capitalize()} {industry.capitalize()} - Home',
+            'description': f'{industry.capitalize()} services from {company}, '
+                           f'serving {rng.choice(INDUSTRY_WORDS)} and {rng.choice(INDUSTRY_WORDS)} clients.',
+            'email': f'info@{company}.com' if rng.random() < 0.5 else '',
+            'phone': f'+1 555 {rng.randint(100, 999)} {rng.randint(1000, 9999)}' if rng.random() < 0.4 else '',
+            'industry_keywords': f'{industry}, {rng.choice(INDUSTRY_WORDS)}',
+            'language': rng.choice(LANGUAGES),
+        })
+        created_at = (start + step * i).strftime('%Y-%m-%d %H:%M:%S')
+        yield lead_row(lead) + [created_at]
+
+
+def build_database(path, rows):
+    """Create a leads database at path holding rows synthetic leads"""
+    db.configure(path)
+    db.init_db()
+    conn = db.connect(path)
+    sql = (f'INSERT INTO leads ({", ".join(ROW_COLUMNS)}, created_at) '
+           f'VALUES ({", ".join("?" * (len(ROW_COLUMNS) + 1))})')
+    batch = []
+    for row in synthetic_leads(rows):
+        batch.append(row)
+        if len(batch) == INSERT_BATCH:
+            with conn:
+                conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany(sql, batch)
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def database_for(rows, db_dir):
+    """Path of a database with rows leads in db_dir, building it unless it already exists"""
+    path = os.path.join(db_dir, f'bench-leads-{rows}.db')
+    if os.path.exists(path):
+        conn = db.connect(path)
+        existing = conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+        conn.close()
+        if existing >= rows:
+            return path
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    print(f'  building {rows:,} leads ...', flush=True)
+    start = time.perf_counter()
+    build_database(path, rows)
+    print(f'  built in {time.perf_counter() - start:.1f}s', flush=True)
+    return path
+
+
+def timed_get(client, url, expect=200, cached=False):
+    # Repeated GETs would otherwise be answered from the page cache without touching the database
+    if not cached:
+        page_cache.clear()
+    start = time.perf_counter()
+    response = client.get(url)
+    seconds = time.perf_counter() - start
+    if response.status_code != expect:
+        raise RuntimeError(f'GET {url} returned {response.status_code}')
+    return seconds, response.get_json()
+
+
+def bench_api(rows_list, iterations, db_dir):
+    """The /api/leads endpoints on databases of each size in rows_list"""
+    results = {}
+    failures = []
+    client = app.test_client()
+    for rows in rows_list:
+        print(f'api {rows:,} rows', flush=True)
+        path = database_for(rows, db_dir)
+        db.configure(path)
+        label = f'api/{rows}'
+        cases = {
+            'list': '/api/leads',
+            'list_fields': '/api/leads?fields=id,company,url,email&limit=200',
+            'list_filtered': '/api/leads?language=de&has_email=true',
+            'list_since': '/api/leads?since=2025-06-01&until=2025-06-30',
+            'search': '/api/leads/search?q=logistics',
+            'search_prefix': '/api/leads/search?q=north',
+        }
+        for name, url in cases.items():
+            samples = []
+            for _ in range(iterations):
+                seconds, data = timed_get(client, url)
+                samples.append(seconds)
+            if not data.get('leads'):
+                failures.append(f'{label}/{name}: no leads returned')
+            results[f'{label}/{name}'] = summarize(samples)
+
+        # Cursor paging: time each of the first `iterations` pages in turn
+        samples = []
+        url = '/api/leads?limit=100'
+        for _ in range(iterations):
+            seconds, data = timed_get(client, url)
+            samples.append(seconds)
+            if not data.get('next_cursor'):
+                break
+            url = f'/api/leads?limit=100&cursor={data["next_cursor"]}'
+        results[f'{label}/list_pages'] = summarize(samples)
+
+        # The same page again and again, served from the response cache after the first request
+        samples = [timed_get(client, '/api/leads', cached=True)[0] for _ in range(iterations)]
+        results[f'{label}/list_cached'] = summarize(samples)
+
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            response = client.post('/api/leads', json={
+                'url': f'https://bench-{rows}-{i}-{time.time_ns()}.com/', 'title': 'Bench', 'description': 'Bench lead'
+            })
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures.append(f'{label}/post: status {response.status_code}')
+                break
+        results[f'{label}/post'] = summarize(samples)
+        db.close()
+    return results, failures
+
+
+# -- baseline
+
+def compare(results, baseline, tolerance):
+    """Print results next to the baseline; returns the names that regressed"""
+    regressions = []
+    print(f'\n{"benchmark":<36} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"per sec":>10} {"base p50":>10} {"change":>8}')
+    for name, summary in results.items():
+        base = baseline.get(name)
+        change = ''
+        if base and base['p50_ms']:
+            ratio = summary['p50_ms'] / base['p50_ms'] - 1
+            change = f'{ratio:+.0%}'
+            if ratio > tolerance:
+                regressions.append(name)
+                change += ' !'
+        print(f'{name:<36} {summary["p50_ms"]:>10.3f} {summary["p90_ms"]:>10.3f} {summary["p99_ms"]:>10.3f} '
+              f'{summary["per_sec"]:>10.1f} {base["p50_ms"] if base else "-":>10} {change:>8}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--only', default='scrape,parse,api', help='comma-separated: scrape, parse, api')
+    parser.add_argument('--iterations', type=int, default=50, help='runs per page or request (default 50)')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads for the concurrent scrape run')
+    parser.add_argument('--rows', default=','.join(map(str, DEFAULT_ROWS)), help='database sizes for the API runs')
+    parser.add_argument('--db-dir', help='keep generated databases here and reuse them on later runs')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare with or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='write this run to the baseline file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed p50 slowdown before a benchmark counts as regressed (default 0.25)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    only = {name.strip() for name in args.only.split(',')}
+    results = {}
+    failures = []
+    pages = load_corpus()
+
+    if 'scrape' in only:
+        print('scrape', flush=True)
+        server, base_url = start_server(pages)
+        try:
+            found, failed = bench_scrape(pages, base_url, args.iterations, args.concurrency)
+        finally:
+            server.shutdown()
+        results.update(found)
+        failures += failed
+    if 'parse' in only:
+        print('parse', flush=True)
+        found, failed = bench_parse(pages, args.iterations)
+        results.update(found)
+        failures += failed
+    if 'api' in only:
+        db_dir = args.db_dir or tempfile.mkdtemp(prefix='leads-bench-')
+        os.makedirs(db_dir, exist_ok=True)
+        try:
+            found, failed = bench_api([int(rows) for rows in args.rows.split(',')], args.iterations, db_dir)
+            results.update(found)
+            failures += failed
+        finally:
+            # Flush the writer before its database goes away
+            get_writer().close()
+            if not args.db_dir:
+                shutil.rmtree(db_dir, ignore_errors=True)
+
+    run = {
+        'format': BASELINE_FORMAT,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('format') != BASELINE_FORMAT:
+            print(f'\n{args.baseline} was recorded by an older version of this suite; '
+                  're-record it with --save-baseline')
+            baseline = {}
+        baseline = baseline.get('results', {})
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+
+    if failures:
+        print('\nExtraction checks failed:')
+        for failure in failures:
+            print('  ' + failure)
+    if regressions:
+        print(f'\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}:')
+        for name in regressions:
+            print('  ' + name)
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""
+Bulk URL import: scrape large lists of URLs with many requests in flight.
+
+Jobs and their URLs are stored in the database (see jobs.py), so their
+progress can be read from any web process and a restart loses nothing.
+"""
+import asyncio
+import csv
+import io
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import db
+from fetcher import AsyncFetcher
+from jobs import (BULK_LEASE_SECONDS, claim_bulk_job, create_bulk_job, finish_bulk_job, get_bulk_job,
+                  prune_bulk_jobs, queued_bulk_items, record_bulk_item, release_bulk_jobs, renew_bulk_jobs)
+from urlnorm import canonical_url
+
+# Scrapes in flight per importer, and how many of them may hit one host
+MAX_IN_FLIGHT = int(os.environ.get('BULK_IN_FLIGHT', 64))
+PER_HOST_LIMIT = 2
+# Threads saving scrape results (saves wait on the database, scrapes don't need threads)
+SAVE_THREADS = 8
+MAX_URLS_PER_JOB = 50000
+# Idle importers look for unheld jobs this often (jobs submitted in this process wake them at once)
+POLL_INTERVAL = 2.0
+PRUNE_INTERVAL = 60 * 60
+
+# Column names recognised as the URL column in an uploaded CSV
+CSV_URL_COLUMNS = ('url', 'website', 'domain', 'site', 'homepage')
+
+
+def parse_url_list(urls):
+    """Strip, drop blanks and de-duplicate a list of URLs (by canonical URL), keeping order.
+
+    Returns (urls, invalid), invalid being {'url', 'error'} dicts for the
+    entries that can't be parsed as URLs; the rest are still returned.
+    """
+    seen = set()
+    cleaned = []
+    invalid = []
+    for url in urls:
+        if not isinstance(url, str):
+            continue
+        url = url.strip()
+        if not url:
+            continue
+        try:
+            key = canonical_url(url)
+        except ValueError as e:
+            invalid.append({'url': url, 'error': f'Invalid URL: {e}'})
+            continue
+        if key not in seen:
+            seen.add(key)
+            cleaned.append(url)
+    return cleaned, invalid
+
+
+def parse_csv_urls(text):
+    """Read URLs from CSV text - uses a url/website/domain column if there is a header, else the first column.
+
+    Returns (urls, invalid) like parse_url_list.
+    """
+    rows = csv.reader(io.StringIO(text))
+    first = next(rows, None)
+    if first is None:
+        return [], []
+
+    column = 0
+    header = [cell.strip().lower() for cell in first]
+    for name in CSV_URL_COLUMNS:
+        if name in header:
+            column = header.index(name)
+            break
+    else:
+        # No recognised header, the first row is data
+        rows = iter([first] + list(rows))
+
+    return parse_url_list(row[column] for row in rows if len(row) > column)
+
+
+def host_of(url):
+    """Host used for per-host concurrency limits"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class RateLimiter:
+    """Spaces calls out to at most `rate` per second, across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def reserve(self):
+        """Take the next start slot; returns the seconds to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        return start - now
+
+
+class BulkImporter:
+    """Runs scrape + save for stored bulk jobs (jobs.bulk_jobs) on an event loop.
+
+    Jobs live in the database, so any process can report their progress.
+    Each importer takes jobs of its ``kind`` that no other process holds
+    and queues their URLs per host; a URL is only started while its host has
+    fewer than ``per_host_limit`` scrapes in flight, so a list full of one
+    domain cannot hog the importer (or hammer the site).
+
+    Scrapes run as coroutines on the importer's own loop thread, at most
+    ``max_in_flight`` at a time, sharing one fetcher.AsyncFetcher: ``scrape``
+    is a coroutine function taking (url, fetcher), like
+    app.scrape_website_async. Saving blocks on the database, so ``save``
+    runs on a small thread pool.
+
+    ``enrich`` is an optional second stage for jobs submitted with
+    enrich=True: it takes a successful scrape result and returns a
+    concurrent Future of the result to save. The URL's slot is freed for the
+    next scrape while it runs.
+
+    ``rate``, if given, caps how many scrapes start per second over all hosts.
+    """
+
+    def __init__(self, scrape, save, kind='import', max_in_flight=MAX_IN_FLIGHT, per_host_limit=PER_HOST_LIMIT,
+                 enrich=None, rate=None):
+        self.kind = kind
+        self.max_in_flight = max_in_flight
+        self._scrape = scrape
+        self._save = save
+        self._enrich = enrich
+        self._per_host_limit = per_host_limit
+        self._limiter = RateLimiter(rate) if rate else None
+        self._name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._loop = None
+        self._loop_thread = None
+        self._fetcher = None
+        self._slots = None  # asyncio.Semaphore of max_in_flight, created on the loop
+        self._savers = None
+        self._thread = None
+        self._wake = threading.Condition()
+        self._lock = threading.RLock()
+        self._jobs = {}     # job id -> [enrich, URLs not yet saved], for the jobs this importer holds
+        self._pending = {}  # host -> deque of (job id, item id, url)
+        self._active = {}   # host -> scrapes started and not yet fetched
+        self._tasks = set()  # concurrent Futures of the scrape coroutines
+        self._closed = False
+        self._last_renewal = 0.0
+        self._last_prune = 0.0
+
+    def start(self):
+        """Start taking jobs (once)"""
+        if self._thread is not None or self._closed:
+            return
+        self._savers = ThreadPoolExecutor(max_workers=SAVE_THREADS, thread_name_prefix=f'bulk-{self.kind}-save')
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name=f'bulk-{self.kind}-loop',
+                                             daemon=True)
+        self._loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+        self._thread = threading.Thread(target=self._claim_loop, name=f'bulk-{self.kind}', daemon=True)
+        self._thread.start()
+
+    async def _open(self):
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._fetcher = AsyncFetcher(limit=self.max_in_flight, limit_per_host=self._per_host_limit)
+        await self._fetcher.__aenter__()
+
+    def submit(self, urls, skipped=0, enrich=False):
+        """Store a job for a list of URLs and return its progress report.
+
+        ``skipped`` counts URLs the caller left out (e.g. already known
+        leads); they are reported as completed without being scraped. The
+        job is run by whichever started importer of this kind claims it
+        first, usually this one.
+        """
+        if self._closed:
+            raise RuntimeError('Bulk importer is shut down')
+        conn = db.get_db()
+        job_id = create_bulk_job(conn, self.kind, urls, skipped, enrich and self._enrich is not None)
+        with self._wake:
+            self._wake.notify()
+        return get_bulk_job(conn, job_id, self.kind)
+
+    def get(self, job_id):
+        """Progress report of a job of this kind, from any process, or None"""
+        return get_bulk_job(db.get_db(), job_id, self.kind)
+
+    def shutdown(self, wait=True):
+        """Stop taking jobs and finish the scrapes already running (saving them).
+
+        URLs not started yet stay queued in the database, and the jobs are
+        handed back so another process carries on with them.
+        """
+        with self._wake:
+            self._closed = True
+            self._wake.notify_all()
+        with self._lock:
+            self._pending.clear()
+            tasks = list(self._tasks)
+        if self._thread is not None:
+            self._thread.join()
+        if self._loop is not None:
+            # Scrapes still waiting for a slot give up as soon as they get one
+            futures.wait(tasks, timeout=None if wait else 0)
+            asyncio.run_coroutine_threadsafe(self._fetcher.__aexit__(None, None, None), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._savers.shutdown(wait=wait)
+        with self._lock:
+            held = list(self._jobs)
+            self._jobs.clear()
+        if held:
+            conn = db.connect()
+            try:
+                release_bulk_jobs(conn, held, self._name)
+            finally:
+                conn.close()
+
+    def _claim_loop(self):
+        try:
+            while not self._closed:
+                claimed = False
+                try:
+                    conn = db.get_db()
+                    claimed = self._claim(conn)
+                    self._renew(conn)
+                    self._maybe_prune(conn)
+                except sqlite3.Error:
+                    # Locked for longer than the busy timeout - try again at the next poll
+                    db.release()
+                if claimed:
+                    continue
+                with self._wake:
+                    if not self._closed:
+                        self._wake.wait(POLL_INTERVAL)
+        finally:
+            db.close()
+
+    def _claim(self, conn):
+        # Take one unheld job and queue its remaining URLs; returns whether there was one
+        row = claim_bulk_job(conn, self.kind, self._name)
+        if row is None:
+            return False
+        job_id, enrich = row
+        items = queued_bulk_items(conn, job_id)
+        if not items:
+            finish_bulk_job(conn, job_id)
+            return True
+        with self._lock:
+            if self._closed:
+                release_bulk_jobs(conn, [job_id], self._name)
+                return False
+            self._jobs[job_id] = [bool(enrich), len(items)]
+            for item_id, url in items:
+                self._pending.setdefault(host_of(url), deque()).append((job_id, item_id, url))
+            self._dispatch(list(self._pending))
+        return True
+
+    def _renew(self, conn):
+        now = time.monotonic()
+        if now - self._last_renewal < BULK_LEASE_SECONDS / 3:
+            return
+        self._last_renewal = now
+        with self._lock:
+            held = list(self._jobs)
+        if held:
+            renew_bulk_jobs(conn, held, self._name)
+
+    def _maybe_prune(self, conn):
+        now = time.monotonic()
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._last_prune = now
+            prune_bulk_jobs(conn)
+
+    def _dispatch(self, hosts):
+        # Caller holds self._lock
+        if self._closed:
+            return
+        for host in hosts:
+            queue = self._pending.get(host)
+            while queue and self._active.get(host, 0) < self._per_host_limit:
+                job_id, item_id, url = queue.popleft()
+                self._active[host] = self._active.get(host, 0) + 1
+                task = asyncio.run_coroutine_threadsafe(self._run(host, job_id, item_id, url), self._loop)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+            if not queue:
+                self._pending.pop(host, None)
+
+    def _task_done(self, task):
+        with self._lock:
+            self._tasks.discard(task)
+
+    async def _run(self, host, job_id, item_id, url):
+        pending = None
+        result = None
+        async with self._slots:
+            if not self._closed:
+                try:
+                    if self._limiter is not None:
+                        await asyncio.sleep(self._limiter.reserve())
+                    result = await self._scrape(url, self._fetcher)
+                    with self._lock:
+                        enrich = job_id in self._jobs and self._jobs[job_id][0]
+                    if result['success'] and enrich:
+                        pending = self._enrich(result)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+
+        # The host's slot is free once its page has been fetched, even if the second stage is still running
+        with self._lock:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del self._active[host]
+            self._dispatch([host])
+        if result is None:
+            # Shut down before it started; the URL stays queued in the database
+            return
+
+        if pending is not None:
+            try:
+                result = await asyncio.wrap_future(pending)
+            except Exception:
+                # The scrape result stands without the second stage
+                pass
+        await asyncio.get_running_loop().run_in_executor(self._savers, self._save_result, job_id, item_id, result)
+
+    def _save_result(self, job_id, item_id, result):
+        lead_id = None
+        error = None
+        try:
+            if result['success']:
+                lead_id = self._save(result)
+            else:
+                error = result['error']
+        except Exception as e:
+            error = str(e)
+
+        conn = db.get_db()
+        try:
+            record_bulk_item(conn, item_id, lead_id, error)
+        except sqlite3.Error:
+            # Not recorded - the URL stays queued and is scraped again when the job is next claimed
+            db.release()
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job[1] -= 1
+            if job[1]:
+                return
+            del self._jobs[job_id]
+        try:
+            if not finish_bulk_job(conn, job_id):
+                # Some outcomes couldn't be recorded; let the job be claimed again for them
+                release_bulk_jobs(conn, [job_id], self._name)
+        except sqlite3.Error:
+            # Still leased to us - it is claimed again once the lease runs out
+            db.release()
@@ -0,0 +1,19 @@
+// Background service worker: retries queued lead uploads (queue.js) after the
+// popup has closed, e.g. once the server is back up.
+importScripts('queue.js');
+
+const FLUSH_ALARM = 'flushLeadQueue';
+
+function scheduleFlush() {
+    chrome.alarms.create(FLUSH_ALARM, { periodInMinutes: 1 });
+}
+
+chrome.runtime.onInstalled.addListener(scheduleFlush);
+chrome.runtime.onStartup.addListener(scheduleFlush);
+
+chrome.alarms.onAlarm.addListener(async (alarm) => {
+    if (alarm.name !== FLUSH_ALARM) return;
+    if ((await getQueue()).length > 0) {
+        await flushQueueIfDue();
+    }
+});
@@ -0,0 +1,171 @@
+// Runs inside the captured page (via chrome.scripting.executeScript), so it must
+// not use anything outside its own body
+function extractLeadDetails() {
+    // Get title - try multiple sources
+    let title = document.title || '';
+    
+    // If title is empty or too short, try og:title
+    if (!title || title.length < 3) {
+        const ogTitle = document.querySelector('meta[property="og:title"]');
+        if (ogTitle) title = ogTitle.getAttribute('content') || title;
+    }
+    
+    // If still no title, try twitter:title
+    if (!title || title.length < 3) {
+        const twitterTitle = document.querySelector('meta[name="twitter:title"]');
+        if (twitterTitle) title = twitterTitle.getAttribute('content') || title;
+    }
+    
+    // If still no title, try h1
+    if (!title || title.length < 3) {
+        const h1 = document.querySelector('h1');
+        if (h1) title = h1.textContent.trim().substring(0, 100);
+    }
+    
+    // Get meta description - try multiple sources
+    let description = '';
+    
+    // Try standard meta description (case-insensitive)
+    let metaDesc = document.querySelector('meta[name="description"]');
+    if (!metaDesc) {
+        metaDesc = document.querySelector('meta[name="Description"]');
+    }
+    if (metaDesc) {
+        description = metaDesc.getAttribute('content') || '';
+    }
+    
+    // Try og:description
+    if (!description) {
+        const ogDesc = document.querySelector('meta[property="og:description"]');
+        if (ogDesc) description = ogDesc.getAttribute('content') || '';
+    }
+    
+    // Try twitter:description
+    if (!description) {
+        const twitterDesc = document.querySelector('meta[name="twitter:description"]');
+        if (twitterDesc) description = twitterDesc.getAttribute('content') || '';
+    }
+    
+    // Fallback: try to get first meaningful paragraph
+    if (!description) {
+        const selectors = ['main p', 'article p', '.content p', 'p'];
+        for (const selector of selectors) {
+            const paragraphs = document.querySelectorAll(selector);
+            for (const p of paragraphs) {
+                const text = p.textContent.trim();
+                // Skip very short paragraphs and common boilerplate
+                if (text.length > 50 && !text.toLowerCase().includes('cookie')) {
+                    description = text.substring(0, 300);
+                    break;
+                }
+            }
+            if (description) break;
+        }
+    }
+    
+    // Extract email addresses from page text
+    let email = '';
+    const pageText = document.body.innerText;
+    const emailRegex = /\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b/g;
+    const emails = pageText.match(emailRegex) || [];
+    const filteredEmails = emails.filter(e => 
+        !e.toLowerCase().includes('example') && 
+        !e.toLowerCase().includes('test') &&
+        !e.toLowerCase().includes('noreply')
+    );
+    if (filteredEmails.length > 0) email = filteredEmails[0];
+    
+    // Extract phone numbers
+    let phone = '';
+    const phoneRegex = /(\+?1?[-.]?\(?\d{3}\)?[-.]?\d{3}[-.]?\d{4}|\+\d{1,3}[-.]?\d{3,4}[-.]?\d{3,4}[-.]?\d{3,4})/g;
+    const phones = pageText.match(phoneRegex) || [];
+    if (phones.length > 0) phone = phones[0];
+    
+    // Get logo URL
+    let logoUrl = '';
+    const ogImage = document.querySelector('meta[property="og:image"]');
+    if (ogImage) {
+        logoUrl = ogImage.getAttribute('content') || '';
+    }
+    if (!logoUrl) {
+        const logoImg = document.querySelector('img[class*="logo"], img[id*="logo"], .logo img, #logo img');
+        if (logoImg) logoUrl = logoImg.src || '';
+    }
+    
+    // Get favicon
+    let faviconUrl = '';
+    const favicon = document.querySelector('link[rel*="icon"]');
+    if (favicon) {
+        faviconUrl = favicon.href || '';
+    } else {
+        faviconUrl = window.location.origin + '/favicon.ico';
+    }
+    
+    // Extract social media handles/links
+    let twitterHandle = '';
+    let linkedinUrl = '';
+    let facebookUrl = '';
+    let instagramUrl = '';
+    
+    // Check meta tags for Twitter
+    const twitterSite = document.querySelector('meta[name="twitter:site"]');
+    if (twitterSite) {
+        twitterHandle = (twitterSite.getAttribute('content') || '').replace('@', '');
+    }
+    
+    // Find social media links
+    const allLinks = document.querySelectorAll('a[href]');
+    allLinks.forEach(link => {
+        const href = link.href.toLowerCase();
+        if (href.includes('twitter.com') && !twitterHandle) {
+            twitterHandle = href.split('twitter.com/')[1]?.split('?')[0]?.split('/')[0] || '';
+        } else if (href.includes('linkedin.com') && !linkedinUrl) {
+            linkedinUrl = link.href;
+        } else if (href.includes('facebook.com') && !facebookUrl) {
+            facebookUrl = link.href;
+        } else if (href.includes('instagram.com') && !instagramUrl) {
+            instagramUrl = link.href;
+        }
+    });
+    
+    // Find contact page
+    let contactPage = '';
+    allLinks.forEach(link => {
+        const href = link.href.toLowerCase();
+        const text = link.textContent.toLowerCase();
+        if ((href.includes('contact') || text.includes('contact') || 
+             href.includes('about') || text.includes('about')) && !contactPage) {
+            contactPage = link.href;
+        }
+    });
+    
+    // Get keywords
+    let keywords = '';
+    const metaKeywords = document.querySelector('meta[name="keywords"]');
+    if (metaKeywords) {
+        keywords = metaKeywords.getAttribute('content') || '';
+    }
+    
+    // Get language
+    let language = 'en';
+    const htmlTag = document.querySelector('html');
+    if (htmlTag && htmlTag.lang) {
+        language = htmlTag.lang;
+    }
+    
+    return {
+        title: title.trim() || 'No title found',
+        description: description.trim() || 'No description found',
+        email: email,
+        phone: phone,
+        logo_url: logoUrl,
+        favicon_url: faviconUrl,
+        twitter_handle: twitterHandle,
+        linkedin_url: linkedinUrl,
+        facebook_url: facebookUrl,
+        instagram_url: instagramUrl,
+        contact_page: contactPage,
+        industry_keywords: keywords,
+        language: language
+    };
+}
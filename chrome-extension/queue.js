@@ -0,0 +1,140 @@
+// Offline upload queue for captured leads, shared by the popup and the background worker.
+// Captures are stored in chrome.storage.local first and uploaded in batches to
+// /api/leads/batch, so nothing is lost when the server is slow or down: failed
+// uploads stay queued and are retried with backoff (see background.js).
+
+// Batch endpoint - change this if your backend runs on a different port
+const BATCH_API_URL = 'http://localhost:5000/api/leads/batch';
+
+const QUEUE_KEY = 'leadQueue';
+const QUEUE_STATE_KEY = 'leadQueueState';
+// Leads per upload request (the server accepts up to 1000)
+const MAX_BATCH = 200;
+// Retry delays after failed uploads: 30s, 1m, 2m, ... up to 30m
+const RETRY_BASE_MS = 30 * 1000;
+const RETRY_MAX_MS = 30 * 60 * 1000;
+
+// Run fn holding a Web Lock shared by the popup and the background worker
+async function withLock(name, fn) {
+    if (navigator.locks) {
+        return navigator.locks.request(name, fn);
+    }
+    return fn();
+}
+
+async function getQueue() {
+    const stored = await chrome.storage.local.get(QUEUE_KEY);
+    return stored[QUEUE_KEY] || [];
+}
+
+async function getQueueState() {
+    const stored = await chrome.storage.local.get(QUEUE_STATE_KEY);
+    return stored[QUEUE_STATE_KEY] || { failures: 0, retryAt: 0, lastError: '' };
+}
+
+// Add captured leads to the queue; a newer capture of a queued URL replaces the older one
+async function enqueueLeads(leads) {
+    return withLock('lead-queue', async () => {
+        const queue = await getQueue();
+        const byUrl = new Map(queue.map(entry => [entry.lead.url, entry]));
+        for (const lead of leads) {
+            byUrl.set(lead.url, { id: crypto.randomUUID(), lead: lead, queuedAt: Date.now() });
+        }
+        const updated = Array.from(byUrl.values());
+        await chrome.storage.local.set({ [QUEUE_KEY]: updated });
+        return updated.length;
+    });
+}
+
+// Gzip a string with the browser's CompressionStream (falls back to plain text)
+async function compressBody(text) {
+    if (typeof CompressionStream === 'undefined') {
+        return { body: text, encoding: null };
+    }
+    const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+    return { body: await new Response(stream).arrayBuffer(), encoding: 'gzip' };
+}
+
+async function uploadBatch(entries) {
+    const { body, encoding } = await compressBody(JSON.stringify({ leads: entries.map(entry => entry.lead) }));
+    const headers = { 'Content-Type': 'application/json' };
+    if (encoding) headers['Content-Encoding'] = encoding;
+
+    const response = await fetch(BATCH_API_URL, { method: 'POST', headers: headers, body: body });
+    const result = await response.json().catch(() => ({}));
+    if (!response.ok || !result.success) {
+        throw new Error(result.error || `Server returned ${response.status}`);
+    }
+    return result;
+}
+
+async function removeFromQueue(ids) {
+    // Re-read under the lock: captures may have been queued while the upload was in flight
+    await withLock('lead-queue', async () => {
+        const queue = await getQueue();
+        await chrome.storage.local.set({ [QUEUE_KEY]: queue.filter(entry => !ids.has(entry.id)) });
+    });
+}
+
+// The server marks per-lead errors that would fail on every retry (bad URL or fields)
+function isPermanentFailure(item) {
+    return item.retryable === false;
+}
+
+// Schedule the next retry with exponential backoff and build the flush result
+async function recordFailure(message, sent, rejected) {
+    const state = await getQueueState();
+    const failures = state.failures + 1;
+    const delay = Math.min(RETRY_MAX_MS, RETRY_BASE_MS * 2 ** (failures - 1));
+    await chrome.storage.local.set({
+        [QUEUE_STATE_KEY]: { failures: failures, retryAt: Date.now() + delay, lastError: message }
+    });
+    return { sent: sent, rejected: rejected, remaining: (await getQueue()).length, error: message };
+}
+
+async function flushQueueNow() {
+    let sent = 0;
+    const rejected = [];
+    while (true) {
+        const batch = (await getQueue()).slice(0, MAX_BATCH);
+        if (batch.length === 0) break;
+        let result;
+        try {
+            result = await uploadBatch(batch);
+        } catch (error) {
+            return recordFailure(error.message, sent, rejected);
+        }
+        const done = new Set();
+        result.results.forEach((item, index) => {
+            if (item.success) {
+                done.add(batch[index].id);
+            } else if (isPermanentFailure(item)) {
+                // Would fail on every retry, so it leaves the queue too
+                done.add(batch[index].id);
+                rejected.push({ url: batch[index].lead.url, error: item.error });
+            }
+        });
+        await removeFromQueue(done);
+        sent += result.saved;
+        if (done.size < batch.length) {
+            // Some leads could not be written - keep them for the next retry
+            return recordFailure('Some leads could not be saved', sent, rejected);
+        }
+    }
+    await chrome.storage.local.set({ [QUEUE_STATE_KEY]: { failures: 0, retryAt: 0, lastError: '' } });
+    return { sent: sent, rejected: rejected, remaining: 0, error: null };
+}
+
+// Upload everything queued, one batch request per MAX_BATCH leads.
+// Resolves to { sent, rejected, remaining, error }; never throws.
+async function flushQueue() {
+    // One flush at a time across the popup and the background worker
+    return withLock('lead-queue-flush', flushQueueNow);
+}
+
+// Flush only if the backoff delay after the last failure has passed
+async function flushQueueIfDue() {
+    const state = await getQueueState();
+    if (Date.now() < state.retryAt) return null;
+    return flushQueue();
+}
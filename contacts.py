@@ -0,0 +1,226 @@
+"""
+Contact extraction: email addresses and phone numbers.
+
+ContactCollector gathers candidates from three places, in order of trust:
+JSON-LD structured data (ContactPoint, Organization, ...), mailto:/tel:
+links, and finally the visible page text. Text is scanned incrementally as
+it arrives with one precompiled pattern covering emails and both phone
+formats, and scanning stops after MAX_SCAN_CHARS. Candidates are ranked
+rather than first-match-wins, so a mailto: link in the footer beats a stray
+address earlier in the copy.
+"""
+import json
+import re
+from urllib.parse import unquote
+
+# Parts are length-bounded (RFC 5321 limits) so a long run of word characters can't make matching quadratic
+EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,253}\.[A-Z|a-z]{2,63}\b'
+PHONE_PATTERNS = [
+    r'\+?1?[-.]?\(?\d{3}\)?[-.]?\d{3}[-.]?\d{4}',  # US/Canada
+    r'\+\d{1,3}[-.]?\d{3,4}[-.]?\d{3,4}[-.]?\d{3,4}',  # International
+]
+EMAIL_RE = re.compile(EMAIL_PATTERN)
+PHONE_RE = re.compile(PHONE_PATTERNS[0])
+# One pass finds all three; alternatives are tried in this order at each position
+CONTACT_RE = re.compile(
+    f'(?P<email>{EMAIL_PATTERN})|(?P<phone>{PHONE_PATTERNS[0]})|(?P<intl_phone>{PHONE_PATTERNS[1]})'
+)
+IGNORED_EMAIL_WORDS = ['example', 'test', 'noreply', 'no-reply']
+# "logo@2x.png" looks like an email address
+IGNORED_EMAIL_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.css', '.js')
+ROLE_MAILBOXES = ('info', 'contact', 'hello', 'sales', 'support', 'office', 'enquiries', 'inquiries')
+
+# Where a candidate came from, most trusted first
+SOURCE_CONTACT_POINT = 'contact_point'
+SOURCE_STRUCTURED = 'structured_data'
+SOURCE_LINK = 'link'
+SOURCE_TEXT = 'text'
+SOURCE_TEXT_INTL = 'text_intl'
+SOURCE_SCORES = {
+    SOURCE_CONTACT_POINT: 500, SOURCE_STRUCTURED: 400, SOURCE_LINK: 300, SOURCE_TEXT: 200, SOURCE_TEXT_INTL: 100
+}
+MARKUP_SOURCES = (SOURCE_CONTACT_POINT, SOURCE_STRUCTURED, SOURCE_LINK)
+
+# Input bounds
+MAX_SCAN_CHARS = 512 * 1024
+MAX_JSON_LD_CHARS = 256 * 1024
+MAX_CANDIDATES = 10
+# A match ending this close to the end of the text so far could still grow, so it waits for more text
+# (longer than any match of CONTACT_RE)
+MATCH_MARGIN = 512
+
+
+class Candidate:
+    __slots__ = ('value', 'source', 'count', 'order')
+
+    def __init__(self, value, source, order):
+        self.value = value
+        self.source = source
+        self.count = 1
+        self.order = order
+
+
+def is_ignored_email(email):
+    email = email.lower()
+    return any(word in email for word in IGNORED_EMAIL_WORDS) or email.endswith(IGNORED_EMAIL_SUFFIXES)
+
+
+def phone_key(phone):
+    """Digits of a phone number, used to merge differently formatted copies"""
+    return re.sub(r'\D', '', phone)
+
+
+class ContactCollector:
+    """Collects and ranks email and phone candidates for one page"""
+
+    def __init__(self, max_scan_chars=MAX_SCAN_CHARS):
+        self.max_scan_chars = max_scan_chars
+        self._emails = {}  # lowercased address -> Candidate
+        self._phones = {}  # digits -> Candidate
+        self._order = 0
+        self._buffer = ''  # text not yet scanned
+        self._scanned = 0
+        self._done = False
+
+    # -- sources
+
+    def add_href(self, href):
+        """Record a mailto: or tel: link target"""
+        scheme, _, target = href.strip().partition(':')
+        scheme = scheme.lower()
+        if scheme == 'mailto':
+            for address in unquote(target.split('?')[0]).split(','):
+                if EMAIL_RE.fullmatch(address.strip()):
+                    self._add_email(address.strip(), SOURCE_LINK)
+        elif scheme == 'tel':
+            self._add_phone(unquote(target.split(';')[0]).strip(), SOURCE_LINK)
+
+    def add_json_ld(self, text):
+        """Record emails and phones from a <script type="application/ld+json"> block"""
+        if len(text) > MAX_JSON_LD_CHARS:
+            return
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            if not isinstance(node, dict):
+                continue
+            types = node.get('@type')
+            types = types if isinstance(types, list) else [types]
+            source = SOURCE_CONTACT_POINT if 'ContactPoint' in types else SOURCE_STRUCTURED
+            for value in _strings(node.get('email')):
+                value = value.strip()
+                if value.lower().startswith('mailto:'):
+                    value = value[len('mailto:'):]
+                if EMAIL_RE.fullmatch(value):
+                    self._add_email(value, source)
+            for value in _strings(node.get('telephone')):
+                self._add_phone(value.strip(), source)
+            stack.extend(value for key, value in node.items() if isinstance(value, (dict, list)))
+
+    def feed_text(self, text, final=False):
+        """Scan more page text. Pass final=True once no more text will follow.
+
+        Scanning ends early once both an email and a phone came from markup,
+        since no text match can outrank them.
+        """
+        if self._done:
+            return
+        if self.has_markup_contacts():
+            self._done = True
+            self._buffer = ''
+            return
+        room = self.max_scan_chars - self._scanned - len(self._buffer)
+        if len(text) >= room:
+            text = text[:max(0, room)]
+            final = True
+        # The buffer starts with the last character already scanned (if any) so \b sees it
+        buffer = self._buffer + text
+        start = 1 if self._scanned else 0
+        settled = len(buffer) if final else len(buffer) - MATCH_MARGIN
+        pos = start
+        for match in CONTACT_RE.finditer(buffer, start):
+            if match.end() > settled:
+                break
+            kind = match.lastgroup
+            if kind == 'email':
+                if not is_ignored_email(match.group()):
+                    self._add_email(match.group(), SOURCE_TEXT)
+                # Text from neighbouring elements runs together, so "555-123-4567info@acme.com"
+                # holds a phone number as well
+                phone = PHONE_RE.search(match.group(), 0, match.group().index('@'))
+                if phone:
+                    self._add_phone(phone.group(), SOURCE_TEXT)
+            else:
+                self._add_phone(match.group(), SOURCE_TEXT if kind == 'phone' else SOURCE_TEXT_INTL)
+            pos = match.end()
+        else:
+            # Nothing left to match in the settled part; resume at a word break before the margin
+            if settled > pos:
+                pos = max(pos, max(buffer.rfind(space, pos, settled) for space in ' \n\t') + 1)
+        if final:
+            self._done = True
+            self._buffer = ''
+            return
+        self._scanned += pos - start
+        self._buffer = buffer[pos - 1:] if pos else buffer
+
+    # -- results
+
+    def has_markup_contacts(self):
+        """True once both an email and a phone came from structured data or links"""
+        return (any(candidate.source in MARKUP_SOURCES for candidate in self._emails.values())
+                and any(candidate.source in MARKUP_SOURCES for candidate in self._phones.values()))
+
+    def emails(self, domain=None):
+        """Email candidates, best first. Addresses on the site's own domain and role mailboxes rank higher."""
+        def score(candidate):
+            local, _, host = candidate.value.lower().partition('@')
+            bonus = 0
+            if domain and (host == domain or host.endswith('.' + domain)):
+                bonus += 50
+            if local in ROLE_MAILBOXES:
+                bonus += 10
+            return SOURCE_SCORES[candidate.source] + bonus + min(candidate.count, 10)
+        return self._ranked(self._emails, score)
+
+    def phones(self):
+        """Phone candidates, best first"""
+        return self._ranked(self._phones, lambda candidate: SOURCE_SCORES[candidate.source] + min(candidate.count, 10))
+
+    # -- internals
+
+    def _ranked(self, candidates, score):
+        return sorted(candidates.values(), key=lambda candidate: (-score(candidate), candidate.order))[:MAX_CANDIDATES]
+
+    def _add(self, candidates, key, value, source):
+        candidate = candidates.get(key)
+        if candidate is None:
+            candidates[key] = Candidate(value, source, self._order)
+            self._order += 1
+            return
+        candidate.count += 1
+        if SOURCE_SCORES[source] > SOURCE_SCORES[candidate.source]:
+            candidate.source = source
+
+    def _add_email(self, email, source):
+        self._add(self._emails, email.lower(), email, source)
+
+    def _add_phone(self, phone, source):
+        key = phone_key(phone)
+        if len(key) >= 7:
+            self._add(self._phones, key, phone, source)
+
+
+def _strings(value):
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, str)]
+    return []
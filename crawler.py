@@ -0,0 +1,296 @@
+"""
+Contact-page crawl: the optional second scrape stage.
+
+After a homepage has been scraped, ContactCrawler fetches the contact and
+about pages it linked to (and, optionally, matching pages listed in the
+site's sitemap) to find emails and phone numbers the homepage did not show,
+and merges them into the same lead.
+
+Crawls run on their own thread pool, so in bulk imports the next homepage
+scrape does not wait for them. Every request goes through a HostScheduler
+that limits concurrent requests per host and spaces them by a crawl delay
+(the larger of CRAWL_DELAY and the site's robots.txt Crawl-delay), and
+pages that robots.txt disallows are not fetched. robots.txt files are
+cached per host.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+from extractor import CONTACT_LINK_WORDS, LeadExtractor
+from fetcher import get_fetcher
+from leads import lead_domain
+from urlnorm import canonical_url
+
+CRAWL_ENABLED = os.environ.get('CONTACT_CRAWL', '0') == '1'
+CRAWL_SITEMAP = os.environ.get('CONTACT_CRAWL_SITEMAP', '0') == '1'
+CRAWL_WORKERS = 8
+# Politeness - requests in flight per host, and seconds between request starts to one host
+CRAWL_PER_HOST = 1
+CRAWL_DELAY = float(os.environ.get('CONTACT_CRAWL_DELAY', 1.0))
+# A robots.txt Crawl-delay above this is capped rather than stalling the crawl
+MAX_CRAWL_DELAY = 10.0
+MAX_CONTACT_PAGES = 3
+MAX_PAGE_BYTES = 512 * 1024
+MAX_SITEMAP_BYTES = 1024 * 1024
+
+ROBOTS_TTL = 60 * 60
+MAX_ROBOTS_ENTRIES = 10000
+ROBOTS_AGENT = '*'
+
+LOC_RE = re.compile(r'<loc>\s*([^<\s]+)\s*</loc>', re.IGNORECASE)
+
+
+class RobotsCache:
+    """robots.txt rules per host, fetched once and kept for ROBOTS_TTL seconds"""
+
+    def __init__(self, fetcher=None, ttl=ROBOTS_TTL, max_entries=MAX_ROBOTS_ENTRIES):
+        self._fetcher = fetcher
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # origin -> (fetched_at, parser)
+        self._loading = {}  # origin -> Event, so one thread fetches while the others wait
+
+    def get(self, url):
+        """RobotFileParser for the site url belongs to"""
+        parts = urlsplit(url)
+        origin = f'{parts.scheme}://{parts.netloc}'
+        while True:
+            with self._lock:
+                entry = self._entries.get(origin)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    self._entries.move_to_end(origin)
+                    return entry[1]
+                loading = self._loading.get(origin)
+                if loading is None:
+                    loading = self._loading[origin] = threading.Event()
+                    break
+            loading.wait()
+
+        parser = None
+        try:
+            parser = self._load(origin)
+        finally:
+            # Store the entry before waking the waiters, so they find it instead of fetching again
+            with self._lock:
+                if parser is not None:
+                    self._entries[origin] = (time.monotonic(), parser)
+                    self._entries.move_to_end(origin)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                del self._loading[origin]
+            loading.set()
+        return parser
+
+    def allowed(self, url):
+        return self.get(url).can_fetch(ROBOTS_AGENT, url)
+
+    def crawl_delay(self, url):
+        return self.get(url).crawl_delay(ROBOTS_AGENT)
+
+    def _load(self, origin):
+        parser = RobotFileParser(origin + '/robots.txt')
+        try:
+            response = (self._fetcher or get_fetcher()).fetch(origin + '/robots.txt', max_bytes=MAX_PAGE_BYTES)
+        except Exception:
+            # Unreachable robots.txt - treat the site as open, like a missing one
+            response = None
+        # Same rules as RobotFileParser.read(): 401/403 forbid everything, other errors allow everything
+        if response is None or response.status_code >= 400:
+            if response is not None and response.status_code in (401, 403):
+                parser.disallow_all = True
+            else:
+                parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+        return parser
+
+
+class HostScheduler:
+    """Per-host concurrency limit and minimum spacing between requests"""
+
+    def __init__(self, per_host_limit=CRAWL_PER_HOST):
+        self.per_host_limit = per_host_limit
+        self._cond = threading.Condition()
+        self._hosts = {}  # host -> [requests in flight, earliest next start]
+
+    def touch(self, host, delay):
+        """Note a request made to host outside the scheduler, e.g. the homepage scrape"""
+        with self._cond:
+            state = self._hosts.setdefault(host, [0, 0.0])
+            state[1] = max(state[1], time.monotonic() + delay)
+
+    @contextmanager
+    def slot(self, host, delay):
+        """Wait until host may be sent another request, then hold one of its slots"""
+        with self._cond:
+            while True:
+                state = self._hosts.setdefault(host, [0, 0.0])
+                wait = state[1] - time.monotonic()
+                if state[0] < self.per_host_limit and wait <= 0:
+                    break
+                self._cond.wait(wait if state[0] < self.per_host_limit else None)
+            state[0] += 1
+            state[1] = time.monotonic() + delay
+        try:
+            yield
+        finally:
+            with self._cond:
+                state[0] -= 1
+                self._prune()
+                self._cond.notify_all()
+
+    def _prune(self):
+        # Caller holds self._cond; forget idle hosts whose delay has passed
+        if len(self._hosts) > 1000:
+            now = time.monotonic()
+            for host in [host for host, (active, next_start) in self._hosts.items() if not active and next_start < now]:
+                del self._hosts[host]
+
+
+def merge_contacts(lead, emails, phones):
+    """Add crawled candidates to a lead, filling email/phone if the homepage had none"""
+    lead = dict(lead)
+    lead['emails'] = list(dict.fromkeys(lead.get('emails', []) + emails))
+    lead['phones'] = list(dict.fromkeys(lead.get('phones', []) + phones))
+    if not lead.get('email') and lead['emails']:
+        lead['email'] = lead['emails'][0]
+    if not lead.get('phone') and lead['phones']:
+        lead['phone'] = lead['phones'][0]
+    return lead
+
+
+class ContactCrawler:
+    """Fetches a lead's contact pages politely and merges what they list"""
+
+    def __init__(self, fetcher=None, max_workers=CRAWL_WORKERS, per_host_limit=CRAWL_PER_HOST,
+                 crawl_delay=CRAWL_DELAY, use_sitemap=CRAWL_SITEMAP):
+        self._fetcher = fetcher
+        self.crawl_delay = crawl_delay
+        self.use_sitemap = use_sitemap
+        self.robots = RobotsCache(fetcher)
+        self.scheduler = HostScheduler(per_host_limit)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='contact-crawl')
+
+    def needs_crawl(self, lead):
+        return lead.get('success') and not (lead.get('email') and lead.get('phone'))
+
+    def submit(self, lead):
+        """Crawl in the background; returns a Future of the merged lead"""
+        return self._executor.submit(self.crawl, lead)
+
+    def crawl(self, lead):
+        """Fetch the lead's contact pages and return the lead with their contacts merged in"""
+        if not self.needs_crawl(lead):
+            return lead
+        # The homepage was just fetched, so the first contact page waits a crawl delay too
+        self.scheduler.touch(urlsplit(lead['url']).netloc, self.crawl_delay)
+        emails = []
+        phones = []
+        for url in self.contact_urls(lead):
+            found = self._page_contacts(url)
+            if found:
+                emails += found[0]
+                phones += found[1]
+                if emails and phones:
+                    break
+        return merge_contacts(lead, emails, phones)
+
+    def contact_urls(self, lead):
+        """Same-site contact/about pages to visit, linked ones first"""
+        base = lead['url']
+        site = lead_domain(base)
+        seen = {canonical_url(base)}
+        urls = []
+        candidates = lead.get('contact_links') or [lead.get('contact_page')]
+        if self.use_sitemap:
+            candidates = candidates + self.sitemap_urls(base)
+        for href in candidates:
+            if not href or href.lower().startswith(('mailto:', 'tel:', 'javascript:', '#')):
+                continue
+            url = urljoin(base, href).split('#')[0]
+            if not url.startswith(('http://', 'https://')) or lead_domain(url) != site:
+                continue
+            key = canonical_url(url)
+            if key not in seen:
+                seen.add(key)
+                urls.append(url)
+                if len(urls) == MAX_CONTACT_PAGES:
+                    break
+        return urls
+
+    def sitemap_urls(self, base):
+        """Contact-like page URLs from the site's sitemap (robots.txt Sitemap: lines, else /sitemap.xml)"""
+        parts = urlsplit(base)
+        sitemaps = self.robots.get(base).site_maps() or [f'{parts.scheme}://{parts.netloc}/sitemap.xml']
+        urls = []
+        for sitemap in sitemaps[:2]:
+            text = self._fetch_text(sitemap, MAX_SITEMAP_BYTES)
+            for loc in LOC_RE.findall(text or ''):
+                path = urlsplit(loc).path.lower()
+                if any(word in path for word in CONTACT_LINK_WORDS):
+                    urls.append(loc)
+        return urls
+
+    def _delay(self, url):
+        robots_delay = self.robots.crawl_delay(url) or 0
+        return min(max(self.crawl_delay, float(robots_delay)), MAX_CRAWL_DELAY)
+
+    def _fetch_text(self, url, max_bytes):
+        if not self.robots.allowed(url):
+            return None
+        try:
+            with self.scheduler.slot(urlsplit(url).netloc, self._delay(url)):
+                response = (self._fetcher or get_fetcher()).fetch(url, max_bytes=max_bytes)
+        except Exception:
+            return None
+        return response.text if response.status_code < 400 else None
+
+    def _page_contacts(self, url):
+        """Ranked (emails, phones) found on one page, or None if it could not be fetched"""
+        if not self.robots.allowed(url):
+            return None
+        extractor = LeadExtractor()
+        try:
+            with self.scheduler.slot(urlsplit(url).netloc, self._delay(url)):
+                with closing((self._fetcher or get_fetcher()).stream_text(url, MAX_PAGE_BYTES)) as chunks:
+                    for text in chunks:
+                        extractor.feed(text)
+                        if extractor.contacts.has_markup_contacts():
+                            break
+            extractor.close()
+        except Exception:
+            return None
+        return extractor.ranked_contacts(lead_domain(url))
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+
+
+_crawler = None
+_crawler_lock = threading.Lock()
+
+
+def get_crawler():
+    """Process-wide ContactCrawler, created on first use"""
+    global _crawler
+    if _crawler is None:
+        with _crawler_lock:
+            if _crawler is None:
+                _crawler = ContactCrawler()
+    return _crawler
+
+
+def shutdown_crawler(wait=True):
+    """Stop the process-wide crawler if one was started, finishing the crawls already running"""
+    with _crawler_lock:
+        crawler = _crawler
+    if crawler is not None:
+        crawler.shutdown(wait=wait, cancel_pending=True)
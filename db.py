@@ -0,0 +1,182 @@
+"""
+Database connection management.
+
+Each thread keeps one open connection to the leads database instead of
+connecting per request. Connections run in WAL mode, so readers never block
+the writer and concurrent saves from the extension wait on a busy timeout
+instead of failing with "database is locked". The database path comes from
+the LEADS_DB environment variable (default leads.db) or configure().
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows - no lock, fine for the single-process dev server
+    fcntl = None
+
+from migrations import migrate, pending_migrations
+
+DATABASE_PATH = os.environ.get('LEADS_DB', 'leads.db')
+
+# Per-connection settings, applied on connect
+BUSY_TIMEOUT_MS = 10000
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',   # fsync at checkpoints only; safe with WAL
+    'PRAGMA cache_size=-20000',    # 20 MB page cache
+    'PRAGMA mmap_size=268435456',  # 256 MB memory-mapped reads
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+)
+
+# Online backups copy this many pages per step, pausing BACKUP_PAUSE seconds between steps
+# so the app's writes get through
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01
+# A backup the app's writes keep restarting is finished with VACUUM INTO instead
+MAX_BACKUP_RESTARTS = 3
+# When set, init_db backs the database up here before applying migrations to it
+BACKUP_DIR = os.environ.get('LEADS_BACKUP_DIR', '')
+
+_local = threading.local()
+
+
+def configure(path):
+    """Point the app at a different database file"""
+    global DATABASE_PATH
+    DATABASE_PATH = path
+
+
+def connect(path=None):
+    """Open a new connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(path or DATABASE_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_db():
+    """This thread's connection, opened on first use and kept for reuse.
+
+    Don't close it - call release() when a unit of work is done instead.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DATABASE_PATH:
+        if conn is not None:
+            conn.close()
+        conn = connect()
+        _local.conn = conn
+        _local.path = DATABASE_PATH
+    return conn
+
+
+def release():
+    """Roll back anything left uncommitted on this thread's connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close():
+    """Close this thread's connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+@contextmanager
+def init_lock():
+    """Hold an exclusive lock on a file next to the database, so one process sets up the schema at a time"""
+    if fcntl is None:
+        yield
+        return
+    with open(DATABASE_PATH + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def backup(target, pages=BACKUP_PAGES):
+    """Copy the database to target while the app keeps running.
+
+    Uses SQLite's online backup API, pages at a time. Writes from other
+    connections restart the copy; after MAX_BACKUP_RESTARTS it is done with
+    VACUUM INTO instead, which copies one consistent snapshot without
+    blocking writers. Raises FileExistsError if target exists.
+    """
+    if os.path.exists(target):
+        raise FileExistsError(target)
+    restarts = 0
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, remaining_before
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > MAX_BACKUP_RESTARTS:
+                raise _BackupRestarted()
+        remaining_before = remaining
+        if remaining:
+            time.sleep(BACKUP_PAUSE)
+
+    source = connect()
+    try:
+        dest = sqlite3.connect(target)
+        try:
+            source.backup(dest, pages=pages, progress=progress)
+            dest.close()
+        except _BackupRestarted:
+            dest.close()
+            os.remove(target)
+            source.execute('VACUUM INTO ?', (target,))
+        except BaseException:
+            dest.close()
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+    finally:
+        source.close()
+    return target
+
+
+def backup_path(directory):
+    """A new timestamped backup file name in directory"""
+    name = os.path.splitext(os.path.basename(DATABASE_PATH))[0]
+    return os.path.join(directory, f'{name}_backup_{time.strftime("%Y%m%d_%H%M%S")}.db')
+
+
+def has_leads_table(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'leads'").fetchone() is not None
+
+
+def init_db():
+    """Bring the schema up to the latest version (see migrations.py).
+
+    Safe to call from several worker processes starting at once: they take
+    turns on a lock file, and there is nothing to do once the database is
+    current. With LEADS_BACKUP_DIR set, a database with migrations pending
+    is backed up first.
+    """
+    with init_lock():
+        conn = connect()
+        try:
+            pending = pending_migrations(conn)
+            if pending and BACKUP_DIR and has_leads_table(conn):
+                os.makedirs(BACKUP_DIR, exist_ok=True)
+                backup(backup_path(BACKUP_DIR))
+            migrate(conn)
+        finally:
+            conn.close()
@@ -0,0 +1,566 @@
+"""
+Single-pass lead extraction.
+
+LeadExtractor collects every field scrape_website needs (title, meta tags,
+paragraph fallbacks, links, logo, favicon, language and page text) while the
+HTML is parsed once, instead of building a BeautifulSoup tree and walking it
+for each field. It follows the tree-building rules of BeautifulSoup's
+html.parser builder (unclosed tags, void elements, whitespace-only strings,
+script/style text) so fields come out the same as they did from the soup.
+Emails and phone numbers are left to a contacts.ContactCollector, fed as
+the page is parsed.
+"""
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+from bs4.dammit import EntitySubstitution
+
+from contacts import ContactCollector
+
+# Same rules as bs4's HTMLTreeBuilder
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+    'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'
+])
+# Text inside these is not part of get_text()
+STRING_CONTAINERS = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+PRESERVE_WHITESPACE = frozenset(['pre', 'textarea'])
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# Meta tags looked up by property= and by name=
+META_PROPERTIES = ('og:title', 'og:description', 'og:image')
+META_NAMES = ('twitter:title', 'twitter:description', 'twitter:site', 'keywords')
+
+# Paragraph fallback order for the description: main p, article p, .content p, p
+P_MAIN, P_ARTICLE, P_CONTENT, P_ANY = range(4)
+
+SOCIAL_SITES = ('twitter.com', 'linkedin.com', 'facebook.com', 'instagram.com')
+# Links whose href or text holds one of these lead to a contact page
+CONTACT_LINK_WORDS = ('contact', 'about', 'get-in-touch')
+MAX_CONTACT_LINKS = 5
+CONTACT_SCHEMES = ('mailto:', 'tel:')
+JSON_LD_TYPE = 'application/ld+json'
+# Pages with less visible text than this (and no meta tags) are treated as JavaScript shells
+SHELL_TEXT_CHARS = 200
+# A streamed page is done once this much of the body has been read after the head closed
+BODY_CHARS_AFTER_HEAD = 512 * 1024
+SHELL_META = ('description', 'og:title', 'og:description', 'twitter:title', 'twitter:description')
+
+
+class _Element:
+    __slots__ = ('name', 'seq', 'start', 'end', 'marks', 'p_categories', 'title_node')
+
+    def __init__(self, name, seq, start):
+        self.name = name
+        self.seq = seq
+        self.start = start
+        self.end = None
+        self.marks = ()
+        self.p_categories = None
+        self.title_node = None
+
+
+class _FieldTimer:
+    """Splits the time spent in result() by field when given a dict to fill"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter() if timings is not None else None
+
+    def mark(self, field):
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[field] = self.timings.get(field, 0.0) + now - self.last
+            self.last = now
+
+
+def _node_string(node):
+    # Tag.string: the only child if it is a string, recursing through single-child tags
+    if len(node) != 1:
+        return None
+    child = node[0]
+    return child if isinstance(child, str) else _node_string(child)
+
+
+class LeadExtractor(HTMLParser):
+    """Incremental HTML parser that gathers lead fields as it goes"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self._stack = []
+        self._open_counts = {}
+        self._already_closed = []
+        self._data = []
+        self._seq = 0
+        # Open ancestors, counted by kind
+        self._in = {'main': 0, 'article': 0, 'content': 0, 'logo_class': 0, 'logo_id': 0,
+                    'container': 0, 'preserve': 0}
+
+        # Text that soup.get_text() would return, in document order
+        self.chunks = []
+
+        self.title_node = None
+        self.h1 = None
+        self.meta = {}
+        self.logo_src = None
+        self.favicon_href = None
+        self.html_lang = None
+        self.links = []  # (href, element)
+        self.paragraphs = [None, None, None, None]  # (seq, text) per P_* category
+
+        # Early termination state, see is_complete()
+        self.head_closed = False
+        self._body_chars = 0
+        self._title_element = None
+        self._links_checked = 0
+        self._social_found = set()
+        self._contact_found = False
+
+        # Emails and phones, from JSON-LD, mailto:/tel: links and the page text
+        self.contacts = ContactCollector()
+        self._chunks_scanned = 0
+        self._json_ld = None
+        self._json_ld_parts = []
+
+    def feed(self, data):
+        if self.head_closed:
+            self._body_chars += len(data)
+        super().feed(data)
+
+    # -- parser events
+
+    def handle_starttag(self, name, attrs, handle_empty_element=True):
+        attrs = {key: ('' if value is None else value) for key, value in attrs}
+        self._flush()
+
+        element = _Element(name, self._seq, len(self.chunks))
+        self._seq += 1
+        parent = self._stack[-1] if self._stack else None
+
+        if parent is not None and parent.title_node is not None:
+            element.title_node = []
+            parent.title_node.append(element.title_node)
+        elif name == 'title' and self.title_node is None:
+            element.title_node = self.title_node = []
+            self._title_element = element
+
+        if name == 'meta':
+            self._meta(attrs)
+        elif name == 'a':
+            if 'href' in attrs:
+                self.links.append((attrs['href'], element))
+                if attrs['href'].lstrip().lower().startswith(CONTACT_SCHEMES):
+                    self.contacts.add_href(attrs['href'])
+        elif name == 'p':
+            element.p_categories = (self._in['main'], self._in['article'], self._in['content'], True)
+        elif name == 'img':
+            if self.logo_src is None and (
+                    'logo' in attrs.get('class', '') or 'logo' in attrs.get('id', '')
+                    or self._in['logo_class'] or self._in['logo_id']):
+                self.logo_src = attrs.get('src') or ''
+        elif name == 'link':
+            if self.favicon_href is None and 'icon' in attrs.get('rel', '').lower():
+                self.favicon_href = attrs.get('href') or ''
+        elif name == 'h1':
+            if self.h1 is None:
+                self.h1 = element
+        elif name == 'html':
+            if self.html_lang is None:
+                self.html_lang = attrs.get('lang') or ''
+        elif name == 'body':
+            self.head_closed = True
+        elif name == 'script':
+            if self._json_ld is None and attrs.get('type', '').strip().lower() == JSON_LD_TYPE:
+                self._json_ld = element
+
+        if handle_empty_element and name in VOID_ELEMENTS:
+            # Opened and closed in one go; a later explicit end tag is ignored
+            element.end = element.start
+            self._already_closed.append(name)
+            return
+
+        marks = []
+        if name in ('main', 'article'):
+            marks.append(name)
+        if name in STRING_CONTAINERS:
+            marks.append('container')
+        if name in PRESERVE_WHITESPACE:
+            marks.append('preserve')
+        classes = attrs.get('class', '').split()
+        if 'content' in classes:
+            marks.append('content')
+        if 'logo' in classes:
+            marks.append('logo_class')
+        if attrs.get('id') == 'logo':
+            marks.append('logo_id')
+        for mark in marks:
+            self._in[mark] += 1
+        element.marks = marks
+
+        self._stack.append(element)
+        self._open_counts[name] = self._open_counts.get(name, 0) + 1
+
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs, handle_empty_element=False)
+        self.handle_endtag(name)
+
+    def handle_endtag(self, name):
+        if name in self._already_closed:
+            # Redundant end tag for a void element
+            self._already_closed.remove(name)
+            return
+        self._flush()
+        if name == 'head':
+            self.head_closed = True
+        if not self._open_counts.get(name):
+            return
+        while self._stack:
+            element = self._pop()
+            if element.name == name:
+                break
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        if name.startswith(('x', 'X')):
+            code = int(name.lstrip('xX'), 16)
+        else:
+            code = int(name)
+        data = None
+        if code < 256:
+            try:
+                data = bytearray([code]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code)
+            except (ValueError, OverflowError):
+                pass
+        self._data.append(data or '\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self._data.append(character if character is not None else '&%s' % name)
+
+    def handle_comment(self, data):
+        self._flush()
+        self._data.append(data)
+        self._flush(is_text=False)
+
+    def handle_decl(self, data):
+        self._flush()
+        self._data.append(data[len('DOCTYPE '):])
+        self._flush(is_text=False)
+
+    def unknown_decl(self, data):
+        is_cdata = data.upper().startswith('CDATA[')
+        if is_cdata:
+            data = data[len('CDATA['):]
+        self._flush()
+        self._data.append(data)
+        self._flush(is_text=is_cdata)
+
+    def handle_pi(self, data):
+        self._flush()
+        self._data.append(data)
+        self._flush(is_text=False)
+
+    def close(self):
+        super().close()
+        self._flush()
+        while self._stack:
+            self._pop()
+
+    # -- internals
+
+    def _flush(self, is_text=True):
+        if not self._data:
+            return
+        data = ''.join(self._data)
+        self._data = []
+        if not self._in['preserve'] and not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+
+        if self._stack and self._stack[-1].title_node is not None:
+            self._stack[-1].title_node.append(data)
+        if self._json_ld is not None and self._stack and self._stack[-1] is self._json_ld:
+            self._json_ld_parts.append(data)
+        if is_text and not self._in['container']:
+            self.chunks.append(data)
+
+    def _pop(self):
+        element = self._stack.pop()
+        self._open_counts[element.name] -= 1
+        for mark in element.marks:
+            self._in[mark] -= 1
+        element.end = len(self.chunks)
+        if element.p_categories is not None:
+            self._paragraph_closed(element)
+        if element is self._json_ld:
+            self.contacts.add_json_ld(''.join(self._json_ld_parts))
+            self._json_ld = None
+            self._json_ld_parts = []
+        return element
+
+    def _paragraph_closed(self, element):
+        text = None
+        for category, applies in enumerate(element.p_categories):
+            if not applies:
+                continue
+            best = self.paragraphs[category]
+            if best is not None and best[0] < element.seq:
+                continue
+            if text is None:
+                text = self.text_of(element).strip()
+                # Skip very short paragraphs and common boilerplate
+                if len(text) <= 50 or 'cookie' in text.lower():
+                    return
+            self.paragraphs[category] = (element.seq, text[:300])
+
+    def _meta(self, attrs):
+        prop = attrs.get('property')
+        if prop in META_PROPERTIES and prop not in self.meta:
+            self.meta[prop] = attrs.get('content')
+        name = attrs.get('name')
+        if name in META_NAMES and name not in self.meta:
+            self.meta[name] = attrs.get('content')
+        if name and name.lower() == 'description' and 'description' not in self.meta:
+            self.meta['description'] = attrs.get('content')
+
+    # -- early termination
+
+    def is_complete(self):
+        """True once reading more of the page cannot change any extracted field.
+
+        Checked between chunks of a streamed download: the head must be done
+        and every field must have its final value - title, description,
+        logo, favicon, language, all social links and contact page - plus an
+        email and a phone number from markup (JSON-LD or mailto:/tel: links),
+        since those outrank anything found in the text further down.
+
+        Few pages have all of those, so reading also stops once
+        BODY_CHARS_AFTER_HEAD characters of the body have been read: the
+        head fields are settled by then, and links or contacts further down
+        a page that long are given up for the download they would cost.
+        """
+        if not self.head_closed:
+            return False
+        if self._body_chars >= BODY_CHARS_AFTER_HEAD:
+            return True
+        if self.html_lang is None or self.favicon_href is None:
+            return False
+        meta = self.meta
+
+        title_string = self.title_string if self._title_element and self._title_element.end is not None else None
+        if not title_string or len(title_string.strip()) < 3:
+            if not any(meta.get(key) and len(meta[key].strip()) >= 3 for key in ('og:title', 'twitter:title')):
+                if self.h1 is None or self.h1.end is None:
+                    return False
+
+        if not any(meta.get(key) and meta[key].strip() for key in ('description', 'og:description', 'twitter:description')):
+            if self.paragraphs[P_MAIN] is None:
+                return False
+
+        if not meta.get('og:image') and self.logo_src is None:
+            return False
+
+        for link_href, _ in self.links[self._links_checked:]:
+            href = link_href.lower()
+            for site in SOCIAL_SITES:
+                if site in href:
+                    self._social_found.add(site)
+                    break
+        self._links_checked = len(self.links)
+        if meta.get('twitter:site'):
+            self._social_found.add('twitter.com')
+        if len(self._social_found) < len(SOCIAL_SITES):
+            return False
+        if not self._contact_settled():
+            return False
+
+        self._scan_contacts()
+        return self.contacts.has_markup_contacts()
+
+    def is_empty_shell(self):
+        """True if the parsed page looks like a JavaScript app shell: no description or
+        social meta tags and hardly any text. Call after close()."""
+        meta = self.meta
+        if any(meta.get(key) and meta[key].strip() for key in SHELL_META):
+            return False
+        return len(' '.join(self.page_text.split())) < SHELL_TEXT_CHARS
+
+    def _contact_settled(self):
+        # The first matching link wins, so every link before it must be closed (its text final)
+        if not self._contact_found:
+            for link_href, element in self.links:
+                if element.end is None:
+                    return False
+                href = link_href.lower()
+                link_text = self.text_of(element).lower()
+                if any(word in href or word in link_text for word in CONTACT_LINK_WORDS):
+                    self._contact_found = True
+                    break
+        return self._contact_found
+
+    def _scan_contacts(self, final=False):
+        # Hand the text added since the last call to the contact scanner
+        self.contacts.feed_text(''.join(self.chunks[self._chunks_scanned:]), final)
+        self._chunks_scanned = len(self.chunks)
+
+    # -- results
+
+    def ranked_contacts(self, domain=None):
+        """(emails, phones) found on the page, best first; call once parsing is done"""
+        self._scan_contacts(final=True)
+        return ([candidate.value for candidate in self.contacts.emails(domain)],
+                [candidate.value for candidate in self.contacts.phones()])
+
+    def text_of(self, element):
+        return ''.join(self.chunks[element.start:element.end])
+
+    @property
+    def page_text(self):
+        return ''.join(self.chunks)
+
+    @property
+    def title_string(self):
+        if self.title_node is None:
+            return None
+        return _node_string(self.title_node)
+
+    def result(self, url, timings=None):
+        """Build the scrape_website result dict for a page fetched from url.
+
+        If timings is a dict, the seconds spent on each field are added to it.
+        """
+        meta = self.meta
+        timer = _FieldTimer(timings)
+
+        # Get title - try multiple sources
+        title = ''
+        title_string = self.title_string
+        if title_string:
+            title = title_string.strip()
+        if not title or len(title) < 3:
+            if meta.get('og:title'):
+                title = meta['og:title'].strip()
+        if not title or len(title) < 3:
+            if meta.get('twitter:title'):
+                title = meta['twitter:title'].strip()
+        if not title or len(title) < 3:
+            if self.h1 is not None:
+                h1_text = self.text_of(self.h1)
+                if h1_text:
+                    title = h1_text.strip()[:100]
+        timer.mark('title')
+
+        # Get meta description - try multiple sources, then the first meaningful paragraph
+        description = ''
+        for key in ('description', 'og:description', 'twitter:description'):
+            if not description and meta.get(key):
+                description = meta[key].strip()
+        if not description:
+            for candidate in self.paragraphs:
+                if candidate is not None:
+                    description = candidate[1]
+                    break
+        timer.mark('description')
+
+        # Extract company name from domain
+        parsed = urlparse(url)
+        domain = parsed.netloc
+        company = domain.replace('www.', '').split('.')[0].capitalize()
+
+        # Emails and phone numbers, best candidate first - structured data and links before page text
+        emails, phones = self.ranked_contacts((parsed.hostname or '').removeprefix('www.'))
+        email = emails[0] if emails else ''
+        phone = phones[0] if phones else ''
+        timer.mark('contacts')
+
+        # Get logo URL - og:image first, then common logo selectors; relative URLs resolved against the page
+        logo_url = ''
+        if meta.get('og:image'):
+            logo_url = urljoin(url, meta['og:image'].strip())
+        elif self.logo_src:
+            logo_url = urljoin(url, self.logo_src.strip())
+
+        # Get favicon
+        if self.favicon_href:
+            favicon_url = urljoin(url, self.favicon_href.strip())
+        else:
+            favicon_url = f"{parsed.scheme}://{domain}/favicon.ico"
+        timer.mark('images')
+
+        # Social media links - twitter:site meta first
+        twitter_handle = ''
+        linkedin_url = ''
+        facebook_url = ''
+        instagram_url = ''
+        if meta.get('twitter:site'):
+            twitter_handle = meta['twitter:site'].replace('@', '')
+        for link_href, _ in self.links:
+            href = link_href.lower()
+            if 'twitter.com' in href and not twitter_handle:
+                twitter_handle = href.split('twitter.com/')[-1].split('?')[0].split('/')[0]
+            elif 'linkedin.com' in href and not linkedin_url:
+                linkedin_url = link_href
+            elif 'facebook.com' in href and not facebook_url:
+                facebook_url = link_href
+            elif 'instagram.com' in href and not instagram_url:
+                instagram_url = link_href
+        timer.mark('social')
+
+        # Find contact page - the first match, with the rest kept for the contact crawl
+        contact_page = ''
+        contact_links = []
+        for link_href, element in self.links:
+            href = link_href.lower()
+            link_text = self.text_of(element).lower()
+            if any(word in href or word in link_text for word in CONTACT_LINK_WORDS):
+                link = link_href
+                if link.startswith('/'):
+                    link = f"{parsed.scheme}://{domain}{link}"
+                if not contact_page:
+                    contact_page = link
+                if link not in contact_links:
+                    contact_links.append(link)
+                    if len(contact_links) == MAX_CONTACT_LINKS:
+                        break
+        timer.mark('contact_page')
+
+        # Industry keywords and language
+        keywords = meta['keywords'].strip() if meta.get('keywords') else ''
+        language = self.html_lang or 'en'
+
+        return {
+            'success': True,
+            'company': company,
+            'url': url,
+            'title': title if title else 'No title found',
+            'description': description if description else 'No description found',
+            'email': email,
+            'phone': phone,
+            'emails': emails,
+            'phones': phones,
+            'logo_url': logo_url,
+            'favicon_url': favicon_url,
+            'twitter_handle': twitter_handle,
+            'linkedin_url': linkedin_url,
+            'facebook_url': facebook_url,
+            'instagram_url': instagram_url,
+            'contact_page': contact_page,
+            'contact_links': contact_links,
+            'industry_keywords': keywords,
+            'language': language
+        }
+
+
+def extract_lead(html, url):
+    """Extract lead details from a page's HTML in a single parse"""
+    parser = LeadExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.result(url)
@@ -0,0 +1,426 @@
+"""
+HTTP fetch layer for the scraper.
+
+SyncFetcher keeps one pooled requests.Session so repeated scrapes reuse
+keep-alive connections instead of paying TCP + TLS setup every time. New
+connections look their host up in a process-wide DNS cache (DNSCache), so a
+bulk import hitting the same domains over and over doesn't wait on the
+resolver for each connection.
+
+AsyncFetcher keeps many fetches in flight on one event loop with aiohttp
+(optional dependency: pip install aiohttp), for bulk imports and refreshes:
+no thread per request, pooled connections and DNS lookups cached in its
+connector. Without aiohttp it runs the SyncFetcher on the loop's default
+thread pool.
+
+Both fetchers' stream_text() checks the status and content type before reading the body,
+decodes incrementally and stops at a byte limit (or as soon as the caller
+stops iterating).
+"""
+import asyncio
+import codecs
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError
+
+try:
+    import aiohttp
+except ImportError:  # the async engine falls back to the pooled session on threads
+    aiohttp = None
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+DEFAULT_TIMEOUT = 10
+
+# Streaming - pages are cut off after MAX_PAGE_BYTES (decompressed), read in CHUNK_SIZE pieces
+MAX_PAGE_BYTES = int(os.environ.get('SCRAPE_MAX_BYTES', 2 * 1024 * 1024))
+CHUNK_SIZE = 16 * 1024
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Connection pool sizing - pools are kept per host, each holding up to POOL_MAXSIZE connections
+POOL_CONNECTIONS = 100
+POOL_MAXSIZE = 16
+
+# Async engine - connections open at once, overall and per host
+ASYNC_LIMIT = 100
+ASYNC_LIMIT_PER_HOST = 4
+
+# Resolved addresses are reused for DNS_CACHE_TTL seconds; at most DNS_CACHE_SIZE hosts are kept
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+DNS_CACHE_SIZE = 10000
+
+
+class NotHTMLError(requests.RequestException):
+    """The response is not an HTML page, so its body was not downloaded"""
+
+
+def check_content_type(content_type):
+    # A missing Content-Type is given the benefit of the doubt
+    mime = (content_type or '').split(';')[0].strip().lower()
+    if mime and mime not in HTML_CONTENT_TYPES:
+        raise NotHTMLError(f'Skipped non-HTML content: {mime}')
+
+
+def text_decoder(content_type):
+    """Incremental decoder for the charset in a Content-Type header, UTF-8 if there is none"""
+    encoding = 'utf-8'
+    for param in (content_type or '').split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset' and value.strip():
+            encoding = value.strip().strip('"\'')
+    try:
+        return codecs.getincrementaldecoder(encoding)(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def response_meta(status_code, headers):
+    """Status and cache validators of a response"""
+    return {
+        'status_code': status_code,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+    }
+
+
+class FetchResult:
+    """Engine-independent view of a fetched page"""
+
+    def __init__(self, url, status_code, reason, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
+
+    def raise_for_status(self):
+        # Same message format as requests.Response.raise_for_status
+        if 400 <= self.status_code < 500:
+            kind = 'Client Error'
+        elif 500 <= self.status_code < 600:
+            kind = 'Server Error'
+        else:
+            return
+        raise requests.HTTPError(f'{self.status_code} {kind}: {self.reason} for url: {self.url}', response=self)
+
+
+class DNSCache:
+    """Thread-safe cache of getaddrinfo results per (host, port), least recently used dropped first"""
+
+    def __init__(self, ttl=DNS_CACHE_TTL, max_entries=DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (host, port) -> (expires, addresses)
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """Addresses to connect to for host:port, as (family, sockaddr) pairs; raises socket.gaierror"""
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+        # Failures aren't cached; the next connection asks the resolver again
+        addresses = [(family, sockaddr) for family, _, _, _, sockaddr
+                     in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)]
+        with self._lock:
+            self._entries[key] = (now + self.ttl, addresses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return addresses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+dns_cache = DNSCache()
+
+# Connection setup times of the request being sent on this thread, collected by stream_text
+_setup_timings = threading.local()
+
+
+def _record_setup(stage, seconds):
+    timings = getattr(_setup_timings, 'timings', None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class _CachedDNSConnectionMixin:
+    _resolve_seconds = 0.0
+
+    def connect(self):
+        # Only new connections get here; a reused keep-alive connection records no dns or connect time
+        started = time.perf_counter()
+        self._resolve_seconds = 0.0
+        super().connect()
+        _record_setup('connect', time.perf_counter() - started - self._resolve_seconds)
+
+    # Connects to the cached addresses in turn, with urllib3's own error handling for each attempt
+    def _new_conn(self):
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            addresses = dns_cache.resolve(host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        finally:
+            self._resolve_seconds = time.perf_counter() - started
+            _record_setup('dns', self._resolve_seconds)
+        error = None
+        for _, sockaddr in addresses:
+            self._dns_host = sockaddr[0]
+            try:
+                return super()._new_conn()
+            except ConnectTimeoutError as e:  # includes NewConnectionError
+                error = e
+            finally:
+                self._dns_host = host
+        raise error
+
+
+class CachedDNSHTTPConnection(_CachedDNSConnectionMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(_CachedDNSConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDNSHTTPConnection
+
+
+class CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDNSHTTPSConnection
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """Pooled adapter whose new connections resolve hosts through dns_cache"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CachedDNSHTTPConnectionPool,
+            'https': CachedDNSHTTPSConnectionPool,
+        }
+
+
+class SyncFetcher:
+    """Blocking fetcher backed by one shared, pooled requests.Session with cached DNS lookups"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = CachedDNSAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url, timeout=None, max_bytes=None):
+        """Fetch a page of any content type; with max_bytes, the body is cut off after that many bytes"""
+        if max_bytes is None:
+            response = self.session.get(url, timeout=timeout or self.timeout)
+            return FetchResult(response.url, response.status_code, response.reason, response.headers, response.text)
+
+        with self.session.get(url, timeout=timeout or self.timeout, stream=True) as response:
+            decoder = text_decoder(response.headers.get('Content-Type'))
+            body = []
+            received = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                chunk = chunk[:max_bytes - received]
+                received += len(chunk)
+                body.append(decoder.decode(chunk))
+                if received >= max_bytes:
+                    break
+            body.append(decoder.decode(b'', final=True))
+            return FetchResult(response.url, response.status_code, response.reason, response.headers, ''.join(body))
+
+    def stream_text(self, url, max_bytes=MAX_PAGE_BYTES, timeout=None, headers=None, meta=None):
+        """Yield the decoded page in chunks, stopping after max_bytes.
+
+        Raises for error statuses and non-HTML content before any of the
+        body is read. Stop iterating early to drop the rest of the page.
+        ``headers`` are sent with the request; if ``meta`` is a dict it is
+        filled by response_meta() before the first chunk, along with the
+        time taken to get the response headers ("headers_seconds"), the
+        host lookup and connection setup (TCP and TLS) times when a new
+        connection was opened ("dns_seconds", "connect_seconds") and, once
+        the body has been read, its size ("bytes"). A 304 response yields
+        nothing.
+        """
+        _setup_timings.timings = setup = {}
+        try:
+            response = self.session.get(url, timeout=timeout or self.timeout, stream=True, headers=headers)
+        finally:
+            _setup_timings.timings = None
+        try:
+            if meta is not None:
+                meta.update(response_meta(response.status_code, response.headers))
+                for stage, seconds in setup.items():
+                    meta[f'{stage}_seconds'] = seconds
+                # requests counts connection setup in elapsed; headers is the wait after it
+                meta['headers_seconds'] = max(0.0, response.elapsed.total_seconds() - sum(setup.values()))
+            if response.status_code == 304:
+                return
+            FetchResult(response.url, response.status_code, response.reason, response.headers, '').raise_for_status()
+            content_type = response.headers.get('Content-Type')
+            check_content_type(content_type)
+            decoder = text_decoder(content_type)
+
+            received = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                chunk = chunk[:max_bytes - received]
+                received += len(chunk)
+                if meta is not None:
+                    meta['bytes'] = received
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+                if received >= max_bytes:
+                    break
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+def connection_trace_config():
+    """aiohttp TraceConfig adding host lookup and connection setup times to a request's meta dict.
+
+    The dict is passed as the request's trace_request_ctx; connection setup
+    includes the lookup here, stream_text takes it out.
+    """
+    config = aiohttp.TraceConfig()
+
+    def timer(stage):
+        async def on_start(session, context, params):
+            setattr(context, f'{stage}_started', time.perf_counter())
+
+        async def on_end(session, context, params):
+            started = getattr(context, f'{stage}_started', None)
+            meta = context.trace_request_ctx
+            if started is not None and isinstance(meta, dict):
+                meta[f'{stage}_seconds'] = meta.get(f'{stage}_seconds', 0.0) + time.perf_counter() - started
+        return on_start, on_end
+
+    on_start, on_end = timer('dns')
+    config.on_dns_resolvehost_start.append(on_start)
+    config.on_dns_resolvehost_end.append(on_end)
+    on_start, on_end = timer('connect')
+    config.on_connection_create_start.append(on_start)
+    config.on_connection_create_end.append(on_end)
+    return config
+
+
+class AsyncFetcher:
+    """Event-loop fetcher for many in-flight requests.
+
+    Use as ``async with AsyncFetcher() as fetcher:`` on the loop it will run
+    on. Without aiohttp installed, fetches run on the shared SyncFetcher in
+    the loop's default thread pool.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, limit=ASYNC_LIMIT, limit_per_host=ASYNC_LIMIT_PER_HOST,
+                 dns_cache_ttl=DNS_CACHE_TTL):
+        self.timeout = timeout
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self._session = None
+
+    async def __aenter__(self):
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=DEFAULT_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[connection_trace_config()],
+            )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def stream_text(self, url, max_bytes=MAX_PAGE_BYTES, headers=None, meta=None):
+        """Async version of SyncFetcher.stream_text"""
+        if self._session is None:
+            loop = asyncio.get_running_loop()
+            chunks = get_fetcher().stream_text(url, max_bytes, self.timeout, headers, meta)
+            try:
+                while True:
+                    text = await loop.run_in_executor(None, next, chunks, None)
+                    if text is None:
+                        break
+                    yield text
+            finally:
+                chunks.close()
+            return
+
+        started = time.perf_counter()
+        async with self._session.get(url, headers=headers, trace_request_ctx=meta) as response:
+            if meta is not None:
+                meta.update(response_meta(response.status, response.headers))
+                if 'connect_seconds' in meta:
+                    meta['connect_seconds'] = max(0.0, meta['connect_seconds'] - meta.get('dns_seconds', 0.0))
+                setup = meta.get('dns_seconds', 0.0) + meta.get('connect_seconds', 0.0)
+                meta['headers_seconds'] = max(0.0, time.perf_counter() - started - setup)
+            if response.status == 304:
+                return
+            FetchResult(str(response.url), response.status, response.reason, response.headers, '').raise_for_status()
+            content_type = response.headers.get('Content-Type')
+            check_content_type(content_type)
+            decoder = text_decoder(content_type)
+
+            received = 0
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                chunk = chunk[:max_bytes - received]
+                received += len(chunk)
+                if meta is not None:
+                    meta['bytes'] = received
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+                if received >= max_bytes:
+                    break
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """Process-wide SyncFetcher, created on first use"""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = SyncFetcher()
+    return _fetcher
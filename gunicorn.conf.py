@@ -0,0 +1,29 @@
+"""
+gunicorn settings for production: gunicorn -c gunicorn.conf.py wsgi:app
+
+Several worker processes use every core for parsing and API traffic, and
+each runs a pool of threads so a slow scrape only ties up one thread. All
+settings can be overridden with environment variables.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '5000'))
+workers = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count(), 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+# A scrape can wait on a slow site for the full fetch timeout
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# Time a stopping worker gets to finish requests and drain bulk scrapes and queued writes
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+# Restart workers now and then to cap memory growth
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+
+
+def worker_exit(server, worker):
+    # Finish running scrapes and flush queued lead writes before the worker goes away
+    from app import drain
+    drain()
@@ -0,0 +1,188 @@
+"""
+HTTP caching and compression for the dashboard and the leads API.
+
+Pages are versioned by the leads change counter (leads.leads_version),
+which triggers bump on every write to the leads table:
+
+- the ETag is the counter plus the request path and query, so a browser
+  revalidating an unchanged page gets 304 Not Modified without the page
+  being queried or rendered again;
+- rendered pages, and their gzip/brotli encodings, are kept in a
+  per-process LRU cache under the same key, so other clients asking for the
+  same page get the stored bytes;
+- dashboard lead cards are cached as fragments keyed on the lead's content
+  hash, so a new lead re-renders one card rather than the whole page.
+
+Any other response of a compressible type is compressed on the way out
+when the client accepts it. Brotli is used if the brotli package is
+installed, gzip otherwise.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Rendered pages kept per process, by total size
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_MB', 32)) * 1024 * 1024
+FRAGMENT_CACHE_ENTRIES = 5000
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'application/x-ndjson')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _template_stamp():
+    # Part of every ETag, so a deploy with changed templates doesn't get 304s for the old pages
+    try:
+        names = os.listdir(TEMPLATE_DIR)
+    except OSError:
+        return ''
+    return str(max((os.stat(os.path.join(TEMPLATE_DIR, name)).st_mtime_ns for name in names), default=0))
+
+
+TEMPLATE_STAMP = _template_stamp()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its values (``sizeof``, default 1 each)"""
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self._sizeof = sizeof or (lambda value: 1)
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self._sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= self._sizeof(old)
+            self._items[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+# (path, version, encoding) -> (body, mimetype)
+page_cache = LRUCache(RESPONSE_CACHE_BYTES, sizeof=lambda page: len(page[0]))
+fragment_cache = LRUCache(FRAGMENT_CACHE_ENTRIES)
+
+
+def encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def accepted_encoding():
+    """Best encoding the client accepts: br, gzip or identity"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+def page_etag(version):
+    key = f'{TEMPLATE_STAMP}:{request.full_path}'.encode()
+    return f'{version}-{hashlib.sha1(key).hexdigest()[:16]}'
+
+
+def _finish(response, etag):
+    response.set_etag(etag, weak=True)
+    # Cacheable, but check back every time - the 304 is cheap
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cached_page(version, build):
+    """Serve the page for this request at leads version `version`, building it with build() if needed.
+
+    build() returns a Response; only 200 responses are cached. Read the
+    version before querying, so a page is never stored under a newer version
+    than the data it shows.
+    """
+    etag = page_etag(version)
+    if request.if_none_match.contains_weak(etag):
+        return _finish(Response(status=304), etag)
+
+    page = page_cache.get((request.full_path, version, 'identity'))
+    if page is None:
+        response = build()
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        page = (response.get_data(), response.mimetype)
+        page_cache.set((request.full_path, version, 'identity'), page)
+
+    encoding = accepted_encoding() if len(page[0]) >= COMPRESS_MIN_BYTES else 'identity'
+    if encoding != 'identity':
+        key = (request.full_path, version, encoding)
+        encoded = page_cache.get(key)
+        if encoded is None:
+            encoded = (encode(page[0], encoding), page[1])
+            page_cache.set(key, encoded)
+        page = encoded
+    response = Response(page[0], mimetype=page[1])
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return _finish(response, etag)
+
+
+def cached_fragment(key, render):
+    """Rendered markup for key, from the fragment cache or render()"""
+    markup = fragment_cache.get(key)
+    if markup is None:
+        markup = render()
+        fragment_cache.set(key, markup)
+    return markup
+
+
+def compress_response(response):
+    """after_request hook: compress a buffered response of a compressible type if the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = accepted_encoding()
+    if encoding == 'identity':
+        return response
+    response.set_data(encode(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,136 @@
+"""
+Worker threads for the scrape job queue (jobs.py).
+
+Every web process runs SCRAPE_JOB_WORKERS of them (default 2). To scale
+scraping separately from the web server, set SCRAPE_JOB_WORKERS=0 for the
+web processes and run as many standalone workers as needed:
+
+    python job_runner.py --threads 8
+"""
+import argparse
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import db
+from jobs import RETRYABLE_CATEGORIES, claim_job, complete_job, fail_job, prune_jobs
+
+JOB_WORKERS = int(os.environ.get('SCRAPE_JOB_WORKERS', 2))
+# Idle workers look for due jobs this often (new jobs from this process wake them at once)
+POLL_INTERVAL = 1.0
+PRUNE_INTERVAL = 60 * 60
+
+
+class JobRunner:
+    """Pool of threads that claim jobs and scrape + save them.
+
+    ``scrape`` and ``save`` are the same callables BulkImporter takes;
+    ``enrich``, if given, turns a successful scrape result into the result
+    to save (e.g. the contact-page crawl).
+    """
+
+    def __init__(self, scrape, save, enrich=None, workers=JOB_WORKERS):
+        self._scrape = scrape
+        self._save = save
+        self._enrich = enrich
+        self.workers = workers
+        self._name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._threads = []
+        self._last_prune = 0.0
+
+    def start(self, workers=None):
+        """Start the worker threads (once)"""
+        if self._threads:
+            return
+        for index in range(self.workers if workers is None else workers):
+            thread = threading.Thread(target=self._work, args=(f'{self._name}/{index}',),
+                                      name=f'scrape-job-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Wake an idle worker, e.g. right after a job was queued"""
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self, timeout=None):
+        """Let the running jobs finish, then stop the threads"""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self, worker):
+        try:
+            while not self._stopping:
+                try:
+                    conn = db.get_db()
+                    job = claim_job(conn, worker)
+                    if job is not None:
+                        self._run(conn, worker, *job)
+                        continue
+                    self._maybe_prune(conn)
+                except sqlite3.Error:
+                    # Locked for longer than the busy timeout - an unfinished job is handed out again
+                    # when its lease expires
+                    db.release()
+                with self._wake:
+                    if not self._stopping:
+                        self._wake.wait(POLL_INTERVAL)
+        finally:
+            db.close()
+
+    def _run(self, conn, worker, job_id, url, attempts, max_attempts):
+        try:
+            result = self._scrape(url)
+            if not result['success']:
+                category = result.get('error_category')
+                fail_job(conn, job_id, worker, attempts, max_attempts, result['error'], category,
+                         retryable=category in RETRYABLE_CATEGORIES)
+                return
+            if self._enrich is not None:
+                result = self._enrich(result)
+            lead_id = self._save(result)
+        except Exception as e:
+            # Our side (a full write queue, a locked database) - worth retrying
+            fail_job(conn, job_id, worker, attempts, max_attempts, str(e), 'internal')
+            return
+        complete_job(conn, job_id, worker, lead_id)
+
+    def _maybe_prune(self, conn):
+        now = time.monotonic()
+        if now - self._last_prune > PRUNE_INTERVAL:
+            self._last_prune = now
+            prune_jobs(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run scrape job workers')
+    parser.add_argument('--threads', type=int, default=4, help='worker threads (default 4)')
+    args = parser.parse_args()
+
+    from app import create_app, drain, job_runner
+    create_app(start_jobs=False)
+    job_runner.start(args.threads)
+    print(f'Running {args.threads} scrape job workers, Ctrl+C to stop')
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    drain()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Persistent scrape job queue.
+
+Scrapes submitted through /add-lead and POST /api/jobs are rows in the
+scrape_jobs table rather than work done inside the request, so the request
+returns at once and a slow site, a closed browser tab or a restart loses
+nothing. job_runner.JobRunner threads in any process with the database open
+consume the queue.
+
+A job is claimed with a single UPDATE, so two workers never run the same
+one. Claiming leases the job for LEASE_SECONDS; if its worker dies, the job
+is claimed again once the lease runs out. Failures that may pass on their
+own (timeouts, connection errors, 5xx responses) are retried with
+exponential backoff; other failures and jobs out of attempts end as failed.
+
+Bulk imports and lead refreshes (bulk.BulkImporter) are stored here too: a
+bulk_jobs row per job and a bulk_items row per URL. A job is run by one
+process at a time, which holds it on a lease it keeps renewing. A process
+shutting down hands its jobs back with their unfinished URLs still queued,
+and one that dies loses them once the lease runs out; either way another
+process picks the job up where it stopped.
+"""
+import os
+import random
+import time
+import uuid
+
+MAX_ATTEMPTS = int(os.environ.get('SCRAPE_JOB_ATTEMPTS', 4))
+# Retry n waits about RETRY_BASE_DELAY * 2**(n-1) seconds, at most MAX_RETRY_DELAY
+RETRY_BASE_DELAY = 5.0
+MAX_RETRY_DELAY = 10 * 60
+# A running job whose worker hasn't finished it within this many seconds is handed out again
+LEASE_SECONDS = 5 * 60
+# Finished jobs are deleted after this many seconds
+JOB_RETENTION = 7 * 24 * 60 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Scrape error categories (metrics.error_category) worth another attempt
+RETRYABLE_CATEGORIES = ('timeout', 'dns', 'connection', 'http_5xx')
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            worker TEXT,
+            lead_id INTEGER,
+            error TEXT,
+            error_category TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )''',
+    # Due jobs: queued ones by run_at, running ones by lease expiry (also kept in run_at)
+    'CREATE INDEX IF NOT EXISTS idx_scrape_jobs_due ON scrape_jobs (status, run_at)',
+)
+
+# Bulk jobs are held for this many seconds at a time; their owner renews the lease every third of that
+BULK_LEASE_SECONDS = 60
+# Failed URLs listed in a bulk job's progress report
+MAX_BULK_ERRORS = 50
+# Saved lead ids listed in a bulk job's progress report (`succeeded` counts them all)
+MAX_BULK_LEAD_IDS = 1000
+
+BULK_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS bulk_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            enrich INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL
+        )''',
+    # Unfinished jobs of a kind, for claiming
+    'CREATE INDEX IF NOT EXISTS idx_bulk_jobs_open ON bulk_jobs (kind, lease_until) WHERE finished_at IS NULL',
+    '''CREATE TABLE IF NOT EXISTS bulk_items (
+            id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL,
+            lead_id INTEGER,
+            error TEXT
+        )''',
+    'CREATE INDEX IF NOT EXISTS idx_bulk_items_job ON bulk_items (job_id, status, id)',
+)
+
+JOB_FIELDS = ('id', 'url', 'status', 'attempts', 'max_attempts', 'run_at', 'lead_id', 'error', 'error_category',
+              'created_at', 'updated_at')
+
+
+def job_to_dict(row):
+    job = {field: row[field] for field in JOB_FIELDS}
+    # run_at is the lease expiry while running; only a queued job's is worth showing
+    run_at = job.pop('run_at')
+    job['next_attempt_at'] = run_at if job['status'] == QUEUED else None
+    return job
+
+
+def enqueue_job(conn, url, max_attempts=MAX_ATTEMPTS, delay=0):
+    """Add a scrape job for url and commit; returns the job dict"""
+    now = time.time()
+    with conn:
+        row = conn.execute(
+            f'''INSERT INTO scrape_jobs (url, status, max_attempts, run_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?) RETURNING {", ".join(JOB_FIELDS)}''',
+            (url, QUEUED, max_attempts, now + delay, now, now)
+        ).fetchone()
+    return job_to_dict(row)
+
+
+def get_job(conn, job_id):
+    row = conn.execute(f'SELECT {", ".join(JOB_FIELDS)} FROM scrape_jobs WHERE id = ?', (job_id,)).fetchone()
+    return job_to_dict(row) if row else None
+
+
+def claim_job(conn, worker, lease=LEASE_SECONDS):
+    """Lease the next due job to worker; returns (id, url, attempts, max_attempts) or None.
+
+    Due jobs are queued ones whose run_at has passed and running ones whose
+    lease has expired.
+    """
+    now = time.time()
+    with conn:
+        return conn.execute(
+            '''UPDATE scrape_jobs SET status = ?, attempts = attempts + 1, worker = ?, run_at = ?, updated_at = ?
+               WHERE id = (SELECT id FROM scrape_jobs
+                           WHERE status IN (?, ?) AND run_at <= ? ORDER BY run_at, id LIMIT 1)
+               RETURNING id, url, attempts, max_attempts''',
+            (RUNNING, worker, now + lease, now, QUEUED, RUNNING, now)
+        ).fetchone()
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failed ones, with jitter"""
+    delay = min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _update(conn, job_id, worker, **fields):
+    # Only the worker holding the lease may record an outcome
+    fields['updated_at'] = time.time()
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    with conn:
+        conn.execute(
+            f'UPDATE scrape_jobs SET {assignments} WHERE id = ? AND status = ? AND worker = ?',
+            list(fields.values()) + [job_id, RUNNING, worker]
+        )
+
+
+def complete_job(conn, job_id, worker, lead_id):
+    _update(conn, job_id, worker, status=DONE, lead_id=lead_id, error=None, error_category=None)
+
+
+def fail_job(conn, job_id, worker, attempts, max_attempts, error, category=None, retryable=True):
+    """Record a failed attempt: requeue the job after a backoff delay, or fail it for good.
+
+    Returns the job's new status.
+    """
+    if retryable and attempts < max_attempts:
+        _update(conn, job_id, worker, status=QUEUED, run_at=time.time() + retry_delay(attempts),
+                error=error, error_category=category)
+        return QUEUED
+    _update(conn, job_id, worker, status=FAILED, error=error, error_category=category)
+    return FAILED
+
+
+def prune_jobs(conn, retention=JOB_RETENTION):
+    """Delete finished jobs older than retention seconds; returns how many"""
+    with conn:
+        return conn.execute(
+            'DELETE FROM scrape_jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (DONE, FAILED, time.time() - retention)
+        ).rowcount
+
+
+def create_bulk_job(conn, kind, urls, skipped=0, enrich=False):
+    """Store a bulk job of `kind` with its URLs queued and commit; returns the job id.
+
+    ``skipped`` counts URLs the caller left out (e.g. already known leads);
+    they are reported as completed without being scraped.
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with conn:
+        conn.execute(
+            '''INSERT INTO bulk_jobs (id, kind, total, skipped, enrich, created_at, updated_at, finished_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (job_id, kind, len(urls) + skipped, skipped, int(enrich), now, now, None if urls else now)
+        )
+        conn.executemany('INSERT INTO bulk_items (job_id, url, status) VALUES (?, ?, ?)',
+                         ((job_id, url, QUEUED) for url in urls))
+    return job_id
+
+
+def claim_bulk_job(conn, kind, worker, lease=BULK_LEASE_SECONDS):
+    """Take the oldest unfinished bulk job of `kind` that nobody holds; returns (id, enrich) or None"""
+    now = time.time()
+    with conn:
+        return conn.execute(
+            '''UPDATE bulk_jobs SET worker = ?, lease_until = ?, updated_at = ?
+               WHERE id = (SELECT id FROM bulk_jobs
+                           WHERE kind = ? AND finished_at IS NULL AND lease_until <= ? ORDER BY created_at LIMIT 1)
+               RETURNING id, enrich''',
+            (worker, now + lease, now, kind, now)
+        ).fetchone()
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def renew_bulk_jobs(conn, job_ids, worker, lease=BULK_LEASE_SECONDS):
+    """Extend worker's lease on its bulk jobs"""
+    now = time.time()
+    with conn:
+        conn.execute(
+            f'''UPDATE bulk_jobs SET lease_until = ?, updated_at = ?
+                WHERE id IN ({_placeholders(job_ids)}) AND worker = ? AND finished_at IS NULL''',
+            [now + lease, now] + list(job_ids) + [worker]
+        )
+
+
+def release_bulk_jobs(conn, job_ids, worker):
+    """Hand worker's bulk jobs back, so any process can claim them at once"""
+    with conn:
+        conn.execute(
+            f'''UPDATE bulk_jobs SET worker = NULL, lease_until = 0
+                WHERE id IN ({_placeholders(job_ids)}) AND worker = ?''',
+            list(job_ids) + [worker]
+        )
+
+
+def queued_bulk_items(conn, job_id):
+    """(item id, url) of the URLs of a bulk job still to be scraped, in submission order"""
+    return conn.execute('SELECT id, url FROM bulk_items WHERE job_id = ? AND status = ? ORDER BY id',
+                        (job_id, QUEUED)).fetchall()
+
+
+def record_bulk_item(conn, item_id, lead_id=None, error=None):
+    """Store the outcome of one URL: its lead id, or the error if error is given"""
+    with conn:
+        conn.execute('UPDATE bulk_items SET status = ?, lead_id = ?, error = ? WHERE id = ?',
+                     (DONE if error is None else FAILED, lead_id, error, item_id))
+
+
+def finish_bulk_job(conn, job_id):
+    """Mark a bulk job finished unless URLs are still queued; returns whether it was"""
+    now = time.time()
+    with conn:
+        return conn.execute(
+            '''UPDATE bulk_jobs SET finished_at = ?, updated_at = ?, worker = NULL, lease_until = 0
+               WHERE id = ? AND finished_at IS NULL
+                 AND NOT EXISTS (SELECT 1 FROM bulk_items WHERE job_id = ? AND status = ?)''',
+            (now, now, job_id, job_id, QUEUED)
+        ).rowcount == 1
+
+
+def get_bulk_job(conn, job_id, kind=None, max_errors=MAX_BULK_ERRORS, max_lead_ids=MAX_BULK_LEAD_IDS):
+    """Progress report of a bulk job (of `kind`, if given), or None"""
+    row = conn.execute('SELECT kind, total, skipped, created_at, finished_at FROM bulk_jobs WHERE id = ?',
+                       (job_id,)).fetchone()
+    if row is None or (kind is not None and row['kind'] != kind):
+        return None
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM bulk_items WHERE job_id = ? GROUP BY status',
+                               (job_id,)).fetchall())
+    succeeded = counts.get(DONE, 0)
+    failed = counts.get(FAILED, 0)
+    completed = succeeded + failed + row['skipped']
+    if row['finished_at'] is not None:
+        status = 'finished'
+    else:
+        status = 'running' if succeeded + failed else 'queued'
+    return {
+        'id': job_id,
+        'status': status,
+        'total': row['total'],
+        'completed': completed,
+        'succeeded': succeeded,
+        'failed': failed,
+        'skipped': row['skipped'],
+        'progress': round(completed / row['total'], 4) if row['total'] else 1.0,
+        'lead_ids': [lead_id for lead_id, in conn.execute(
+            'SELECT lead_id FROM bulk_items WHERE job_id = ? AND status = ? ORDER BY id LIMIT ?',
+            (job_id, DONE, max_lead_ids))],
+        'errors': [{'url': url, 'error': error} for url, error in conn.execute(
+            'SELECT url, error FROM bulk_items WHERE job_id = ? AND status = ? ORDER BY id LIMIT ?',
+            (job_id, FAILED, max_errors))],
+        'created_at': row['created_at'],
+        'finished_at': row['finished_at'],
+    }
+
+
+def prune_bulk_jobs(conn, retention=JOB_RETENTION):
+    """Delete bulk jobs nobody has touched for retention seconds, with their URLs; returns how many"""
+    cutoff = time.time() - retention
+    with conn:
+        conn.execute('DELETE FROM bulk_items WHERE job_id IN (SELECT id FROM bulk_jobs WHERE updated_at < ?)',
+                     (cutoff,))
+        return conn.execute('DELETE FROM bulk_jobs WHERE updated_at < ?', (cutoff,)).rowcount
@@ -0,0 +1,270 @@
+"""
+Lead queries: filters, field projection and keyset (cursor) pagination.
+
+Pages are ordered newest first by (created_at, id). The cursor is the sort
+key of the last row returned, so fetching the next page is an index range
+scan rather than an OFFSET that re-reads every earlier row.
+"""
+import base64
+import hashlib
+import json
+import time
+from urllib.parse import urlparse
+
+from urlnorm import canonical_url
+
+# Columns written when a lead is saved
+LEAD_FIELDS = (
+    'company', 'url', 'title', 'description', 'email', 'phone', 'logo_url', 'favicon_url',
+    'twitter_handle', 'linkedin_url', 'facebook_url', 'instagram_url', 'contact_page',
+    'industry_keywords', 'language'
+)
+# Columns a client may read
+READABLE_FIELDS = ('id',) + LEAD_FIELDS + ('domain', 'created_at', 'last_scraped_at')
+# Columns merged into the existing row when a lead is saved again; a non-empty new value wins
+MERGE_FIELDS = tuple(field for field in LEAD_FIELDS if field != 'url')
+# What the extractor and the extension put in for a missing title/description - never worth saving over a real one
+PLACEHOLDERS = ('No title found', 'No description found')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Change counter for HTTP caching: bumped by every insert, update and delete on leads
+CHANGE_COUNTER = (
+    'CREATE TABLE IF NOT EXISTS leads_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO leads_version (id, version) VALUES (1, 0)',
+) + tuple(
+    f'''CREATE TRIGGER IF NOT EXISTS leads_version_{event.lower()} AFTER {event} ON leads BEGIN
+            UPDATE leads_version SET version = version + 1 WHERE id = 1;
+        END'''
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+
+def lead_domain(url):
+    """Lowercase host of a lead URL without the www. prefix"""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    host = (urlparse(url).hostname or '').rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+
+def utc_timestamp(seconds=None):
+    """UTC time in the format of SQLite's CURRENT_TIMESTAMP, so it compares with created_at"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def content_hash(lead):
+    """Hash of a lead's scraped fields, to tell cheaply whether a re-scrape found anything new"""
+    values = (lead.get(field) or '' for field in MERGE_FIELDS)
+    text = '\x1f'.join('' if value in PLACEHOLDERS else str(value) for value in values)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def backfill_domains(conn, batch_size=1000):
+    """Fill in the domain column for rows saved before it existed"""
+    while True:
+        rows = conn.execute('SELECT id, url FROM leads WHERE domain IS NULL LIMIT ?', (batch_size,)).fetchall()
+        if not rows:
+            break
+        conn.executemany('UPDATE leads SET domain = ? WHERE id = ?', [(lead_domain(url or ''), lead_id) for lead_id, url in rows])
+        conn.commit()
+
+
+def leads_version(conn):
+    """Current value of the change counter; any write to leads changes it.
+
+    Unlike PRAGMA data_version this also sees this connection's own writes
+    and is the same in every process.
+    """
+    return conn.execute('SELECT version FROM leads_version WHERE id = 1').fetchone()[0]
+
+
+def merge_assignment(field, value):
+    """SET clause keeping the current value of field unless value is non-empty and not a placeholder"""
+    for empty in ('',) + PLACEHOLDERS:
+        value = f"NULLIF({value}, '{empty}')"
+    return f'{field} = COALESCE({value}, {field})'
+
+
+def merge_lead(conn, keep_id, duplicate_id):
+    """Fold a duplicate row into keep_id and delete it"""
+    duplicate = conn.execute(f'SELECT {", ".join(MERGE_FIELDS)} FROM leads WHERE id = ?', (duplicate_id,)).fetchone()
+    assignments = ', '.join(merge_assignment(field, '?') for field in MERGE_FIELDS)
+    conn.execute(f'UPDATE leads SET {assignments} WHERE id = ?', list(duplicate) + [keep_id])
+    conn.execute('DELETE FROM leads WHERE id = ?', (duplicate_id,))
+
+
+def backfill_url_keys(conn, batch_size=1000):
+    """Fill in url_key for rows saved before it existed.
+
+    Rows whose key is already taken are duplicates; they are merged into the
+    oldest row with that key, so the unique index can be built.
+    """
+    keys = dict(conn.execute('SELECT url_key, id FROM leads WHERE url_key IS NOT NULL'))
+    while True:
+        rows = conn.execute(
+            'SELECT id, url FROM leads WHERE url_key IS NULL ORDER BY id LIMIT ?', (batch_size,)
+        ).fetchall()
+        if not rows:
+            break
+        for lead_id, url in rows:
+            key = canonical_url(url or '')
+            if key in keys:
+                merge_lead(conn, keys[key], lead_id)
+            else:
+                conn.execute('UPDATE leads SET url_key = ? WHERE id = ?', (key, lead_id))
+                keys[key] = lead_id
+        conn.commit()
+
+
+def known_domains(conn, domains, batch_size=500):
+    """The subset of domains that already have a lead"""
+    domains = list(domains)
+    known = set()
+    for start in range(0, len(domains), batch_size):
+        chunk = domains[start:start + batch_size]
+        rows = conn.execute(
+            f'SELECT DISTINCT domain FROM leads WHERE domain IN ({", ".join("?" * len(chunk))})', chunk
+        )
+        known.update(row[0] for row in rows)
+    return known
+
+
+def encode_cursor(created_at, lead_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, lead_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, lead_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(created_at, str) or not isinstance(lead_id, int):
+        raise ValueError('Invalid cursor')
+    return created_at, lead_id
+
+
+def parse_cursor(value):
+    """Decode a cursor request arg; None for the first page"""
+    return decode_cursor(value) if value else None
+
+
+def parse_filters(args):
+    """Read list filters from request args; raises ValueError for bad values"""
+    filters = {}
+    domain = args.get('domain', '').strip()
+    if domain:
+        filters['domain'] = lead_domain(domain)
+    language = args.get('language', '').strip()
+    if language:
+        filters['language'] = language
+    has_email = args.get('has_email', '').strip().lower()
+    if has_email:
+        if has_email not in ('1', 'true', 'yes', '0', 'false', 'no'):
+            raise ValueError('has_email must be true or false')
+        filters['has_email'] = has_email in ('1', 'true', 'yes')
+    # Dates compare against created_at text, e.g. 2025-01-31 or 2025-01-31 12:00:00
+    for name in ('since', 'until'):
+        value = args.get(name, '').strip()
+        if value:
+            filters[name] = value.replace('T', ' ')
+    return filters
+
+
+def parse_fields(value):
+    """Validate a comma-separated field list; None means all fields"""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in READABLE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def parse_limit(value):
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be a number')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def build_where(filters, cursor=None):
+    """WHERE clause and parameters for a filter dict (and optional cursor)"""
+    clauses = []
+    params = []
+    if 'domain' in filters:
+        clauses.append('domain = ?')
+        params.append(filters['domain'])
+    if 'language' in filters:
+        clauses.append('language = ?')
+        params.append(filters['language'])
+    if 'has_email' in filters:
+        clauses.append("email <> ''" if filters['has_email'] else "(email IS NULL OR email = '')")
+    if 'since' in filters:
+        clauses.append('created_at >= ?')
+        params.append(filters['since'])
+    if 'until' in filters:
+        # A bare date includes that whole day
+        until = filters['until']
+        clauses.append('created_at < ?' if len(until) > 10 else "created_at < date(?, '+1 day')")
+        params.append(until)
+    if cursor:
+        clauses.append('(created_at, id) < (?, ?)')
+        params.extend(cursor)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def list_leads(conn, filters=None, limit=DEFAULT_PAGE_SIZE, cursor=None, fields=None):
+    """One page of leads, newest first, starting after a decoded cursor.
+
+    Returns (leads, next_cursor) where leads is a list of dicts holding the
+    requested fields and next_cursor is the encoded cursor of the following
+    page, or None on the last page.
+    """
+    columns = list(fields or READABLE_FIELDS)
+    select = list(dict.fromkeys(columns + ['created_at', 'id']))
+    where, params = build_where(filters or {}, cursor)
+    rows = conn.execute(
+        f'SELECT {", ".join(select)} FROM leads{where} ORDER BY created_at DESC, id DESC LIMIT ?',
+        params + [limit + 1]
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return [{column: row[column] for column in columns} for row in rows], next_cursor
+
+
+def get_lead(conn, lead_id, fields=None):
+    """One lead as a dict of the requested fields, or None"""
+    columns = list(fields or READABLE_FIELDS)
+    row = conn.execute(f'SELECT {", ".join(columns)} FROM leads WHERE id = ?', (lead_id,)).fetchone()
+    return {column: row[column] for column in columns} if row else None
+
+
+def iter_leads(conn, filters=None, fields=None, batch_size=1000):
+    """Yield matching leads as tuples of the requested fields, in id order.
+
+    Rows are pulled from the cursor batch_size at a time, so memory stays
+    flat however many rows match.
+    """
+    columns = list(fields or READABLE_FIELDS)
+    where, params = build_where(filters or {})
+    cursor = conn.execute(f'SELECT {", ".join(columns)} FROM leads{where} ORDER BY id', params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
+
+
+def count_leads(conn, filters=None):
+    where, params = build_where(filters or {})
+    return conn.execute(f'SELECT COUNT(*) FROM leads{where}', params).fetchone()[0]
@@ -0,0 +1,277 @@
+"""
+Prometheus-style metrics for the scrape pipeline and the API.
+
+A small in-process registry of counters and histograms rendered in
+the Prometheus text format at /metrics (no client library needed). Scrapes
+are timed per stage by ScrapeTrace, failures are counted by category (see
+error_category), lead writes by batch, and every request by endpoint.
+
+Set PROFILE_DIR to allow per-request profiling: a request with ?profile=1
+(or an X-Profile: 1 header) then runs under cProfile and its stats are
+written to that directory.
+"""
+import cProfile
+import os
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from fetcher import NotHTMLError
+from leads import lead_domain
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+# Histogram buckets (seconds, bytes, rows)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 524288, 1048576, 2097152, 4194304)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+# Text of a requests ConnectionError caused by a failed DNS lookup
+DNS_ERROR_MARKERS = ('NameResolutionError', 'Name or service not known', 'nodename nor servname',
+                     'Temporary failure in name resolution', 'getaddrinfo failed')
+
+# Domains kept for the slowest-domains gauge
+SLOW_DOMAINS_TRACKED = 1000
+SLOW_DOMAINS_SHOWN = 10
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), count, total)) for key, (counts, count, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, count, total) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class SlowDomains:
+    """Slowest recent scrape time per domain, exported for the worst few"""
+
+    def __init__(self, tracked=SLOW_DOMAINS_TRACKED, shown=SLOW_DOMAINS_SHOWN):
+        self.tracked = tracked
+        self.shown = shown
+        self.name = 'scrape_slowest_domain_seconds'
+        self._lock = threading.Lock()
+        self._seconds = {}
+
+    def observe(self, domain, seconds):
+        with self._lock:
+            if seconds > self._seconds.get(domain, 0):
+                self._seconds[domain] = seconds
+            if len(self._seconds) > self.tracked:
+                # Drop the fastest half
+                keep = sorted(self._seconds.items(), key=lambda item: item[1], reverse=True)[:self.tracked // 2]
+                self._seconds = dict(keep)
+
+    def render(self):
+        with self._lock:
+            slowest = sorted(self._seconds.items(), key=lambda item: item[1], reverse=True)[:self.shown]
+        return [f'# HELP {self.name} Longest scrape seen for the slowest domains',
+                f'# TYPE {self.name} gauge'] + [
+            f'{self.name}{_format_labels(("domain",), (domain,))} {seconds}' for domain, seconds in slowest]
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+SCRAPES = register(Counter('scrape_requests_total', 'Scrapes by outcome (ok, cached, not_modified, error)', ['outcome']))
+SCRAPE_ERRORS = register(Counter('scrape_errors_total', 'Failed scrapes by error category', ['category']))
+SCRAPE_SECONDS = register(Histogram('scrape_duration_seconds', 'Total time per scrape'))
+STAGE_SECONDS = register(Histogram(
+    'scrape_stage_seconds', 'Time per scrape stage (dns, connect, headers, download, parse, render, extract, cache)', ['stage']))
+FIELD_SECONDS = register(Histogram(
+    'scrape_field_seconds', 'Time spent building each extracted field', ['field'], buckets=FAST_BUCKETS))
+DOWNLOAD_BYTES = register(Histogram('scrape_download_bytes', 'Bytes read per page', buckets=BYTE_BUCKETS))
+SLOW_DOMAINS = register(SlowDomains())
+DB_WRITE_SECONDS = register(Histogram('db_write_seconds', 'Time to write and commit one batch of leads'))
+DB_WRITE_BATCH = register(Histogram('db_write_batch_size', 'Leads per committed batch', buckets=BATCH_BUCKETS))
+LEAD_REFRESHES = register(Counter('lead_refresh_total', 'Re-scraped leads by outcome (unchanged, updated)', ['outcome']))
+LEAD_REFRESH_FIELDS = register(Counter('lead_refresh_field_updates_total', 'Fields changed by lead refreshes', ['field']))
+RENDERS = register(Counter('render_total', 'Headless renders of JavaScript shells by outcome (ok, timeout, error)',
+                           ['outcome']))
+ASSET_FETCHES = register(Counter('asset_fetch_total', 'Icon downloads by outcome (stored, unusable, error)', ['outcome']))
+HTTP_SECONDS = register(Histogram(
+    'http_request_duration_seconds', 'HTTP request handling time', ['method', 'endpoint', 'status']))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def error_category(exc, stage=None):
+    """Short category for a scrape failure: timeout, dns, tls, connection, http_4xx, http_5xx, not_html, parse or other"""
+    if isinstance(exc, NotHTMLError):
+        return 'not_html'
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        if status is not None:
+            return 'http_4xx' if status < 500 else 'http_5xx'
+        return 'other'
+    if isinstance(exc, (requests.Timeout, TimeoutError, socket.timeout)):
+        return 'timeout'
+    if isinstance(exc, (requests.exceptions.SSLError, ssl.SSLError)):
+        return 'tls'
+    if aiohttp is not None:
+        if isinstance(exc, aiohttp.ClientSSLError):
+            return 'tls'
+        if isinstance(exc, aiohttp.ClientConnectorError):
+            return 'dns' if isinstance(exc.os_error, socket.gaierror) else 'connection'
+    if isinstance(exc, requests.ConnectionError):
+        message = str(exc)
+        return 'dns' if any(marker in message for marker in DNS_ERROR_MARKERS) else 'connection'
+    if isinstance(exc, (ConnectionError, OSError)):
+        return 'connection'
+    if stage in ('parse', 'extract'):
+        return 'parse'
+    return 'other'
+
+
+class ScrapeTrace:
+    """Per-stage timings of one scrape, recorded into the metrics when it ends"""
+
+    def __init__(self, url):
+        self.url = url
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+        self.stage = None
+
+    @contextmanager
+    def timed(self, stage):
+        """Time a block, adding to the stage's total; the stage stays current if the block raises"""
+        outer = self.stage
+        self.stage = stage
+        start = time.perf_counter()
+        yield
+        self.add(stage, time.perf_counter() - start)
+        self.stage = outer
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def fetched(self, meta, download_seconds):
+        """Record the fetch from a stream_text meta dict and the time spent reading it"""
+        for stage in ('dns', 'connect', 'headers'):
+            if meta.get(f'{stage}_seconds') is not None:
+                self.add(stage, meta[f'{stage}_seconds'])
+        # Time spent inside the download loop, minus the parsing that happened in it
+        self.add('download', max(0.0, download_seconds - self.stages.get('parse', 0.0)))
+        if meta.get('bytes') is not None:
+            DOWNLOAD_BYTES.observe(meta['bytes'])
+
+    def finish(self, outcome, category=None):
+        total = time.perf_counter() - self.started
+        SCRAPES.inc(outcome)
+        if category:
+            SCRAPE_ERRORS.inc(category)
+        SCRAPE_SECONDS.observe(total)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage)
+        for field, seconds in self.fields.items():
+            FIELD_SECONDS.observe(seconds, field)
+        if outcome in ('ok', 'error'):
+            SLOW_DOMAINS.observe(lead_domain(self.url), total)
+
+    def failed(self, exc):
+        """Record a failed scrape; returns its error category"""
+        category = error_category(exc, self.stage)
+        self.finish('error', category)
+        return category
+
+
+def observe_request(method, endpoint, status, seconds):
+    HTTP_SECONDS.observe(seconds, method, endpoint, str(status))
+
+
+def start_profile():
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def dump_profile(profile, name):
+    """Stop a profile started by start_profile and write it to PROFILE_DIR; returns the file path"""
+    profile.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{threading.get_ident()}.prof')
+    profile.dump_stats(path)
+    return path
@@ -1,70 +1,64 @@
 """
-Database migration script to add new fields to existing leads database
+Bring an existing leads database up to the current schema.
+
+Backs the database up with SQLite's online backup API (only when there is
+something to migrate), then applies the pending migrations from
+migrations.py. Both run while the app is up; the app applies the same
+migrations itself on start.
+
+    python migrate_database.py                  # back up if needed, then migrate
+    python migrate_database.py --status         # show the version and pending migrations
+    python migrate_database.py --backup-dir backups/ --no-backup
 """
+import argparse
+import os
 import sqlite3
-import shutil
-from datetime import datetime
+import sys
 
-# Backup the database first
-backup_file = f'leads_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
-try:
-    shutil.copy('leads.db', backup_file)
-    print(f"Database backed up to: {backup_file}")
-except Exception as e:
-    print(f"Warning: Could not backup database: {e}")
+import db
+from migrations import latest_version, migrate, pending_migrations, schema_version
 
-# Connect to database
-conn = sqlite3.connect('leads.db')
-cursor = conn.cursor()
 
-# Check current schema
-cursor.execute("PRAGMA table_info(leads)")
-existing_columns = [row[1] for row in cursor.fetchall()]
-print(f"\nExisting columns: {existing_columns}")
+def main():
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations to the leads database')
+    parser.add_argument('--status', action='store_true', help='only show the schema version and pending migrations')
+    parser.add_argument('--backup-dir', default=db.BACKUP_DIR or '.', help='where to write the backup')
+    parser.add_argument('--no-backup', action='store_true', help="don't back up before migrating")
+    args = parser.parse_args()
 
-# New columns to add
-new_columns = {
-    'email': 'TEXT',
-    'phone': 'TEXT',
-    'logo_url': 'TEXT',
-    'favicon_url': 'TEXT',
-    'twitter_handle': 'TEXT',
-    'linkedin_url': 'TEXT',
-    'facebook_url': 'TEXT',
-    'instagram_url': 'TEXT',
-    'contact_page': 'TEXT',
-    'industry_keywords': 'TEXT',
-    'language': 'TEXT'
-}
+    if not os.path.exists(db.DATABASE_PATH):
+        sys.exit(f'No database at {db.DATABASE_PATH}; the app creates it on first start')
 
-# Add missing columns
-added_columns = []
-for col_name, col_type in new_columns.items():
-    if col_name not in existing_columns:
+    with db.init_lock():
+        conn = db.connect()
         try:
-            cursor.execute(f'ALTER TABLE leads ADD COLUMN {col_name} {col_type}')
-            added_columns.append(col_name)
-            print(f"✓ Added column: {col_name}")
-        except Exception as e:
-            print(f"✗ Error adding {col_name}: {e}")
+            pending = pending_migrations(conn)
+            print(f'Schema version {schema_version(conn)} of {latest_version()} ({db.DATABASE_PATH})')
+            for migration in pending:
+                print(f'  pending: {migration.version} {migration.description}')
+            if args.status:
+                return
+            if not pending:
+                print('\n✓ Database already up to date!')
+                return
 
-conn.commit()
+            if not args.no_backup and db.has_leads_table(conn):
+                os.makedirs(args.backup_dir, exist_ok=True)
+                print(f'Database backed up to: {db.backup(db.backup_path(args.backup_dir))}')
 
-# Verify new schema
-cursor.execute("PRAGMA table_info(leads)")
-new_columns_list = [row[1] for row in cursor.fetchall()]
-print(f"\nUpdated columns: {new_columns_list}")
+            try:
+                applied = migrate(conn, on_migration=lambda migration: print(
+                    f'  applying {migration.version}: {migration.description}', flush=True))
+            except sqlite3.Error as e:
+                sys.exit(f'✗ Migration failed, database left at version {schema_version(conn)}: {e}')
+            count = conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+        finally:
+            conn.close()
 
-# Show current leads count
-cursor.execute("SELECT COUNT(*) FROM leads")
-count = cursor.fetchone()[0]
-print(f"\nTotal leads in database: {count}")
+    print(f'\n✓ Migration completed! Applied {len(applied)} migration(s), now at version {latest_version()}.')
+    print(f'  Total leads in database: {count}')
+    print("  Run 'python refresh.py --missing email,phone' to re-scrape leads with empty new fields.")
 
-conn.close()
 
-if added_columns:
-    print(f"\n✓ Migration completed! Added {len(added_columns)} new columns.")
-    print("  Note: Existing leads will have NULL/empty values for new fields.")
-    print("  Re-scrape websites to populate new data.")
-else:
-    print("\n✓ Database already up to date!")
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in the database header (PRAGMA user_version).
+MIGRATIONS lists every schema change since the first release, in order, and
+migrate() applies the ones above the database's version. db.init_db runs it
+on every start, so a new deploy brings the schema up to date on the live
+database; migrate_database.py does the same from the command line, with a
+backup first.
+
+A migration has up to three parts:
+
+- columns, added in a short transaction of their own (ALTER TABLE ADD
+  COLUMN only changes the table definition, not the rows);
+- a backfill of existing rows, run in batches that each commit, so the app
+  keeps writing in between. Backfills only touch rows still missing the
+  value, so an interrupted run picks up where it stopped;
+- DDL statements (indexes, tables, triggers), applied in one transaction
+  together with the version bump, so the migration is either fully applied
+  or not at all.
+
+Databases created before versioning report version 0. Every step checks for
+what is already there (IF NOT EXISTS, missing columns only), so migrations
+replay safely over whatever an older release had built.
+"""
+from contextlib import contextmanager
+
+from jobs import BULK_SCHEMA, SCHEMA as JOB_SCHEMA
+from leads import CHANGE_COUNTER, backfill_domains, backfill_url_keys
+from search import ensure_search_index
+
+
+class Migration:
+    """One schema change, identified by the user_version it brings the database to"""
+
+    def __init__(self, version, description, columns=None, backfill=None, statements=(), apply=None):
+        self.version = version
+        self.description = description
+        self.columns = columns or {}
+        self.backfill = backfill
+        self.statements = statements
+        self.apply = apply
+
+    def run(self, conn):
+        if self.columns:
+            with transaction(conn):
+                add_columns(conn, self.columns)
+        if self.backfill is not None:
+            self.backfill(conn)
+        with transaction(conn):
+            # Another process may have got here first
+            if schema_version(conn) >= self.version:
+                return
+            for statement in self.statements:
+                conn.execute(statement)
+            if self.apply is not None:
+                self.apply(conn)
+            conn.execute(f'PRAGMA user_version = {self.version:d}')
+
+
+@contextmanager
+def transaction(conn):
+    """Run a block in one write transaction, taken up front so it can't fail half way on a busy lock"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def add_columns(conn, columns):
+    """Add the columns missing from the leads table; returns the names added"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(leads)')}
+    added = []
+    for name, column_type in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE leads ADD COLUMN {name} {column_type}')
+            added.append(name)
+    return added
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1].version
+
+
+def pending_migrations(conn):
+    """Migrations not yet applied to the database, in order"""
+    version = schema_version(conn)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def migrate(conn, on_migration=None):
+    """Apply every pending migration in order; returns the versions applied.
+
+    on_migration(migration) is called before each one starts.
+    """
+    applied = []
+    for migration in pending_migrations(conn):
+        if on_migration is not None:
+            on_migration(migration)
+        migration.run(conn)
+        applied.append(migration.version)
+    return applied
+
+
+# Fields added by the first release; its migrate_database.py added them to older tables
+FIRST_RELEASE_COLUMNS = {
+    'email': 'TEXT',
+    'phone': 'TEXT',
+    'logo_url': 'TEXT',
+    'favicon_url': 'TEXT',
+    'twitter_handle': 'TEXT',
+    'linkedin_url': 'TEXT',
+    'facebook_url': 'TEXT',
+    'instagram_url': 'TEXT',
+    'contact_page': 'TEXT',
+    'industry_keywords': 'TEXT',
+    'language': 'TEXT',
+}
+
+LEADS_TABLE = f'''CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company TEXT,
+    url TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    {''.join(f'{name} {column_type}, ' for name, column_type in FIRST_RELEASE_COLUMNS.items())}
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)'''
+
+MIGRATIONS = (
+    Migration(
+        1, 'leads table with contact, social and language fields',
+        statements=(LEADS_TABLE,),
+        apply=lambda conn: add_columns(conn, FIRST_RELEASE_COLUMNS),
+    ),
+    Migration(
+        2, 'domain column and list indexes',
+        columns={'domain': 'TEXT'},
+        backfill=backfill_domains,
+        # Indexes backing the default ordering and each filter
+        statements=(
+            'CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at DESC, id DESC)',
+            'CREATE INDEX IF NOT EXISTS idx_leads_domain ON leads (domain, created_at DESC, id DESC)',
+            'CREATE INDEX IF NOT EXISTS idx_leads_language ON leads (language, created_at DESC, id DESC)',
+            "CREATE INDEX IF NOT EXISTS idx_leads_has_email ON leads (created_at DESC, id DESC) WHERE email <> ''",
+        ),
+    ),
+    Migration(
+        3, 'canonical URL key, duplicates merged',
+        columns={'url_key': 'TEXT'},
+        backfill=backfill_url_keys,
+        statements=('CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_url_key ON leads (url_key)',),
+    ),
+    Migration(4, 'full-text search index', apply=ensure_search_index),
+    Migration(5, 'scrape job queue', statements=JOB_SCHEMA),
+    Migration(
+        6, 'refresh tracking',
+        columns={'last_scraped_at': 'TIMESTAMP', 'content_hash': 'TEXT'},
+        # Least recently scraped first, for refresh.py
+        statements=('CREATE INDEX IF NOT EXISTS idx_leads_last_scraped ON leads (last_scraped_at, id)',),
+    ),
+    Migration(7, 'change counter for HTTP caching', statements=CHANGE_COUNTER),
+    Migration(
+        8, 'icon cache',
+        columns={'icon_asset': 'TEXT'},
+        statements=(
+            # Leads still waiting for the icon pipeline (assets.py)
+            'CREATE INDEX IF NOT EXISTS idx_leads_icon_pending ON leads (id) WHERE icon_asset IS NULL',
+            # Icon files in the thumbnail cache
+            '''CREATE TABLE IF NOT EXISTS assets (
+                   name TEXT PRIMARY KEY,
+                   bytes INTEGER NOT NULL,
+                   used_at REAL NOT NULL
+               )''',
+            'CREATE INDEX IF NOT EXISTS idx_assets_used_at ON assets (used_at)',
+        ),
+    ),
+    Migration(9, 'persistent bulk import and refresh jobs', statements=BULK_SCHEMA),
+    Migration(
+        10, 'icon claim leases and retries',
+        columns={'icon_retry_at': 'REAL', 'icon_attempts': 'INTEGER NOT NULL DEFAULT 0'},
+        statements=(
+            # Claims used to be marked icon_asset = '', which can't be told apart from no icon;
+            # give every lead with an icon URL one more pass
+            "UPDATE leads SET icon_asset = NULL WHERE icon_asset = '' AND COALESCE(logo_url, favicon_url) IS NOT NULL",
+            'DROP INDEX IF EXISTS idx_leads_icon_pending',
+            # Leads waiting for the icon pipeline, by when they are next due (assets.py)
+            'CREATE INDEX IF NOT EXISTS idx_leads_icon_due ON leads (icon_retry_at) WHERE icon_asset IS NULL',
+        ),
+    ),
+)
@@ -0,0 +1,198 @@
+"""
+Re-scrape existing leads and update them in place.
+
+Leads are picked by staleness (last scraped more than N days ago, or never
+scraped by the server) and/or by missing fields, then re-scraped on a
+BulkImporter pool with one request per host at a time and an overall rate
+limit. Each result goes into the existing row:
+
+- if its content hash equals the one stored at the last scrape, only
+  last_scraped_at is touched;
+- otherwise only the fields whose new non-empty value differs are updated.
+
+Every lead is checked against the live site: a cached copy of the page is
+never reused as is, but its validators make an unchanged page cost a
+conditional GET answered with 304 Not Modified and no parsing. Updates are
+written directly rather than through the LeadWriter, since each one has to
+read the row it changes.
+
+    python refresh.py --older-than 30 --missing email,phone
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+import db
+from bulk import BulkImporter
+from leads import MERGE_FIELDS, PLACEHOLDERS, build_where, content_hash, parse_filters, utc_timestamp
+from metrics import LEAD_REFRESH_FIELDS, LEAD_REFRESHES
+from urlnorm import canonical_url
+
+# Leads not scraped for this many days are stale
+REFRESH_MAX_AGE_DAYS = int(os.environ.get('REFRESH_MAX_AGE_DAYS', 30))
+# Refresh scrapes in flight - fewer than a bulk import and rate limited, so they don't crowd out new imports
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 8))
+REFRESH_RATE = float(os.environ.get('REFRESH_RATE', 10))
+REFRESH_PER_HOST_LIMIT = 1
+MAX_REFRESH_LEADS = 100000
+
+
+def parse_missing(value):
+    """Validate a comma-separated list of fields that may be missing; [] for none"""
+    if not value:
+        return []
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in MERGE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def parse_age(value):
+    """Validate an older_than value in days; None if not given"""
+    if value in (None, ''):
+        return None
+    try:
+        days = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('older_than must be a number of days')
+    if days < 0:
+        raise ValueError('older_than must be a number of days')
+    return days
+
+
+def parse_refresh_limit(value):
+    if not value:
+        return MAX_REFRESH_LEADS
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be a number')
+    return max(1, min(limit, MAX_REFRESH_LEADS))
+
+
+def select_stale_leads(conn, older_than=None, missing=None, filters=None, limit=MAX_REFRESH_LEADS):
+    """(id, url) rows of leads due for a refresh, least recently scraped first.
+
+    older_than is in days (never scraped counts as stale); missing is a list
+    of fields, at least one of which must be empty. When both are given a
+    lead must match both; when neither is, REFRESH_MAX_AGE_DAYS applies.
+    filters are the list filters from leads.parse_filters.
+    """
+    if older_than is None and not missing:
+        older_than = REFRESH_MAX_AGE_DAYS
+    where, params = build_where(filters or {})
+    clauses = [where[len(' WHERE '):]] if where else []
+    if older_than is not None:
+        clauses.append('(last_scraped_at IS NULL OR last_scraped_at < ?)')
+        params.append(utc_timestamp(time.time() - older_than * 24 * 60 * 60))
+    if missing:
+        clauses.append('(' + ' OR '.join(f"{field} IS NULL OR {field} = ''" for field in missing) + ')')
+    return conn.execute(
+        f'SELECT id, url FROM leads WHERE {" AND ".join(clauses)} ORDER BY last_scraped_at, id LIMIT ?',
+        params + [limit]
+    ).fetchall()
+
+
+def apply_refresh(conn, result):
+    """Write a successful re-scrape into the lead with the same URL and commit.
+
+    Returns (lead_id, changed_fields). An empty or placeholder value never
+    overwrites a stored one. Raises LookupError if the lead is gone.
+    """
+    new_hash = content_hash(result)
+    with conn:
+        row = conn.execute(
+            f'SELECT id, content_hash, {", ".join(MERGE_FIELDS)} FROM leads WHERE url_key = ?',
+            (canonical_url(result['url']),)
+        ).fetchone()
+        if row is None:
+            raise LookupError(f'No lead for {result["url"]}')
+        if row['content_hash'] == new_hash:
+            conn.execute('UPDATE leads SET last_scraped_at = ? WHERE id = ?', (utc_timestamp(), row['id']))
+            LEAD_REFRESHES.inc('unchanged')
+            return row['id'], []
+
+        changes = {}
+        for field in MERGE_FIELDS:
+            value = result.get(field)
+            if value and value not in PLACEHOLDERS and value != row[field]:
+                changes[field] = value
+        assignments = ''.join(f'{field} = ?, ' for field in changes)
+        if 'logo_url' in changes or 'favicon_url' in changes:
+            # Fetch the new icon (assets.py)
+            assignments += 'icon_asset = NULL, icon_retry_at = NULL, icon_attempts = 0, '
+        conn.execute(
+            f'UPDATE leads SET {assignments}last_scraped_at = ?, content_hash = ? WHERE id = ?',
+            list(changes.values()) + [utc_timestamp(), new_hash, row['id']]
+        )
+    LEAD_REFRESHES.inc('updated' if changes else 'unchanged')
+    for field in changes:
+        LEAD_REFRESH_FIELDS.inc(field)
+    return row['id'], list(changes)
+
+
+def refresh_lead(result):
+    """BulkImporter save callable: apply a re-scrape on this thread's connection; returns the lead id"""
+    return apply_refresh(db.get_db(), result)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-scrape stale leads and update them in place')
+    parser.add_argument('--older-than', type=float, help=f'days since the last scrape (default {REFRESH_MAX_AGE_DAYS} '
+                                                         'unless --missing is given)')
+    parser.add_argument('--missing', default='', help='comma-separated fields, refresh leads missing any of them')
+    parser.add_argument('--domain', default='', help='only leads on this domain')
+    parser.add_argument('--limit', type=int, default=MAX_REFRESH_LEADS, help='most leads to refresh')
+    parser.add_argument('--workers', type=int, default=REFRESH_WORKERS, help='scrapes in flight')
+    parser.add_argument('--rate', type=float, default=REFRESH_RATE, help='scrapes started per second')
+    parser.add_argument('--crawl-contacts', action='store_true', help='also crawl contact pages')
+    parser.add_argument('--dry-run', action='store_true', help='only count the leads that would be refreshed')
+    args = parser.parse_args()
+
+    from app import create_app, drain, get_crawler, rescrape_website_async
+    try:
+        missing = parse_missing(args.missing)
+        filters = parse_filters({'domain': args.domain})
+    except ValueError as e:
+        sys.exit(str(e))
+
+    create_app(start_jobs=False)
+    leads = select_stale_leads(db.get_db(), args.older_than, missing, filters, args.limit)
+    print(f'{len(leads)} leads to refresh')
+    if args.dry_run or not leads:
+        return
+
+    outcomes = Counter()
+
+    def save(result):
+        lead_id, changed = apply_refresh(db.get_db(), result)
+        outcomes['updated' if changed else 'unchanged'] += 1
+        return lead_id
+
+    # A kind of its own, so only this run takes the job (what an interrupted run leaves is pruned later)
+    importer = BulkImporter(rescrape_website_async, save, kind=f'refresh-cli-{uuid.uuid4().hex[:8]}',
+                            max_in_flight=args.workers, per_host_limit=REFRESH_PER_HOST_LIMIT,
+                            enrich=lambda result: get_crawler().submit(result), rate=args.rate)
+    importer.start()
+    job = importer.submit([url for _, url in leads], enrich=args.crawl_contacts)
+    try:
+        while job['finished_at'] is None:
+            time.sleep(1)
+            job = importer.get(job['id'])
+            print(f'\r{job["completed"]}/{job["total"]} done, {job["failed"]} failed', end='', flush=True)
+    except KeyboardInterrupt:
+        print('\nStopping after the scrapes in progress')
+    importer.shutdown()
+    drain()
+    job = importer.get(job['id'])
+    print(f'\n{outcomes["updated"]} updated, {outcomes["unchanged"]} unchanged, {job["failed"]} failed')
+    for error in job['errors'][:10]:
+        print(f'  {error["url"]}: {error["error"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Headless-browser fallback for pages rendered by JavaScript.
+
+Single-page apps often send an empty shell - a <div id="root"> and a
+script bundle, with no meta description and no text - so the streamed
+scrape finds nothing. When RENDER_FALLBACK=1 and Playwright is installed,
+scrape_website hands only those pages (LeadExtractor.is_empty_shell) to a
+Renderer, which loads them in headless Chromium and returns the HTML after
+scripts have run. Ordinary pages never touch the browser.
+
+One browser is kept running on the Renderer's own event loop thread, with
+at most RENDER_CONTEXTS pages open at a time. Browser contexts are reused
+across renders and replaced every PAGES_PER_CONTEXT pages; images, fonts
+and media are not downloaded. Each render is bounded by RENDER_TIMEOUT.
+
+    pip install playwright
+    playwright install chromium
+"""
+import asyncio
+import os
+import threading
+
+try:
+    from playwright.async_api import Error as PlaywrightError
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    from playwright.async_api import async_playwright
+except ImportError:
+    async_playwright = None
+
+from fetcher import DEFAULT_HEADERS
+from metrics import RENDERS
+
+RENDER_ENABLED = os.environ.get('RENDER_FALLBACK', '0') == '1'
+# Pages rendered at once (one browser context each)
+RENDER_CONTEXTS = int(os.environ.get('RENDER_CONTEXTS', 2))
+# Seconds for a page to load before its render is abandoned
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 15))
+# Seconds to wait for the network to go quiet once the DOM has loaded
+SETTLE_TIMEOUT = 3.0
+# A context is closed and replaced after this many pages, so caches and leaks don't pile up
+PAGES_PER_CONTEXT = 100
+BLOCKED_RESOURCE_TYPES = frozenset(['image', 'font', 'media'])
+
+
+async def _block_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class Renderer:
+    """Pool of headless Chromium contexts on a background event loop.
+
+    render() and submit() may be called from any thread. The browser is
+    launched on first use and relaunched if it crashes.
+    """
+
+    def __init__(self, contexts=RENDER_CONTEXTS, timeout=RENDER_TIMEOUT):
+        self.size = max(1, contexts)
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='renderer', daemon=True)
+        self._thread.start()
+        self._playwright = None
+        self._browser = None
+        self._idle = []  # (context, pages rendered)
+        # Created on the loop
+        self._slots = None
+        self._launch_lock = None
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self._slots = asyncio.Semaphore(self.size)
+        self._launch_lock = asyncio.Lock()
+
+    def submit(self, url):
+        """Start rendering url; returns a concurrent.futures.Future of the HTML (None on failure)"""
+        return asyncio.run_coroutine_threadsafe(self._render(url), self._loop)
+
+    def render(self, url):
+        """HTML of url after its scripts have run, or None if it couldn't be rendered in time"""
+        return self.submit(url).result()
+
+    async def _render(self, url):
+        try:
+            async with self._slots:
+                context, pages = await self._checkout()
+                try:
+                    html = await self._load(context, url)
+                finally:
+                    await self._checkin(context, pages + 1)
+        except PlaywrightTimeoutError:
+            RENDERS.inc('timeout')
+            return None
+        except Exception:
+            # Browser missing or crashed, page errors - the raw HTML result stands
+            RENDERS.inc('error')
+            return None
+        RENDERS.inc('ok')
+        return html
+
+    async def _load(self, context, url):
+        page = await context.new_page()
+        try:
+            await page.goto(url, wait_until='domcontentloaded', timeout=self.timeout * 1000)
+            try:
+                await page.wait_for_load_state('networkidle', timeout=SETTLE_TIMEOUT * 1000)
+            except PlaywrightTimeoutError:
+                # Pages that poll never go idle; take what has rendered by now
+                pass
+            return await page.content()
+        finally:
+            await page.close()
+
+    async def _checkout(self):
+        browser = await self._ensure_browser()
+        if self._idle:
+            return self._idle.pop()
+        context = await browser.new_context(user_agent=DEFAULT_HEADERS['User-Agent'], service_workers='block')
+        await context.route('**/*', _block_resources)
+        return context, 0
+
+    async def _checkin(self, context, pages):
+        if pages < PAGES_PER_CONTEXT and context.browser is self._browser and self._browser.is_connected():
+            self._idle.append((context, pages))
+            return
+        try:
+            await context.close()
+        except PlaywrightError:
+            pass
+
+    async def _ensure_browser(self):
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            # Contexts of a crashed browser are gone with it
+            self._idle = []
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            return self._browser
+
+    async def _shutdown(self):
+        for context, _ in self._idle:
+            try:
+                await context.close()
+            except PlaywrightError:
+                pass
+        self._idle = []
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except PlaywrightError:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def close(self, timeout=30):
+        """Close the browser and stop the loop thread"""
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """Process-wide Renderer, created on first use; None when the fallback is off or Playwright is missing"""
+    global _renderer
+    if not RENDER_ENABLED or async_playwright is None:
+        return None
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = Renderer()
+    return _renderer
+
+
+def shutdown_renderer():
+    """Close the process-wide renderer if one was started"""
+    global _renderer
+    with _renderer_lock:
+        renderer, _renderer = _renderer, None
+    if renderer is not None:
+        renderer.close()
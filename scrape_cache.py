@@ -0,0 +1,154 @@
+"""
+On-disk cache of scrape results.
+
+Results are stored in a small SQLite database next to leads.db, keyed by
+normalized URL together with the ETag / Last-Modified validators from the
+response. Entries younger than the TTL are returned without touching the
+network; older ones are revalidated with a conditional GET, and a
+304 Not Modified reuses the stored extraction without re-parsing. The
+table is kept to a bounded size by evicting the least recently used rows.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import db
+from urlnorm import normalize_url
+
+# Default: scrape_cache.db in the leads database's directory
+CACHE_PATH = os.environ.get('SCRAPE_CACHE_PATH', '')
+CACHE_ENABLED = os.environ.get('SCRAPE_CACHE', '1') != '0'
+# Entries newer than this are served without revalidation
+CACHE_TTL = int(os.environ.get('SCRAPE_CACHE_TTL', 24 * 60 * 60))
+MAX_ENTRIES = int(os.environ.get('SCRAPE_CACHE_MAX_ENTRIES', 50000))
+# Eviction runs once every EVICT_EVERY writes rather than on each one
+EVICT_EVERY = 100
+
+
+class CacheEntry:
+    def __init__(self, result, etag, last_modified, fetched_at):
+        self.result = result
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.fetched_at < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def result_for(self, url):
+        """Copy of the stored result, reported under the URL that was asked for"""
+        return dict(self.result, url=url)
+
+
+class ScrapeCache:
+    """SQLite-backed scrape result cache, safe to share between threads"""
+
+    def __init__(self, path=None, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.path = path or CACHE_PATH or os.path.join(os.path.dirname(db.DATABASE_PATH), 'scrape_cache.db')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS scrape_cache (
+                url_key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                result TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_scrape_cache_accessed_at ON scrape_cache (accessed_at)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, url):
+        """Return the CacheEntry for url, or None"""
+        conn = self._conn()
+        key = normalize_url(url)
+        row = conn.execute(
+            'SELECT result, etag, last_modified, fetched_at FROM scrape_cache WHERE url_key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute('UPDATE scrape_cache SET accessed_at = ? WHERE url_key = ?', (time.time(), key))
+        return CacheEntry(json.loads(row[0]), row[1], row[2], row[3])
+
+    def put(self, url, result, etag=None, last_modified=None):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO scrape_cache (url_key, etag, last_modified, result, fetched_at, accessed_at)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (normalize_url(url), etag, last_modified, json.dumps(result), now, now)
+            )
+        self._maybe_evict()
+
+    def revalidated(self, url, etag=None, last_modified=None):
+        """Mark an entry fresh again after a 304, keeping its stored result"""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                '''UPDATE scrape_cache SET fetched_at = ?, accessed_at = ?,
+                   etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+                   WHERE url_key = ?''',
+                (now, now, etag, last_modified, normalize_url(url))
+            )
+
+    def evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                '''DELETE FROM scrape_cache WHERE url_key IN (
+                       SELECT url_key FROM scrape_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                   )''',
+                (self.max_entries,)
+            )
+
+    def _maybe_evict(self):
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_scrape_cache():
+    """Process-wide ScrapeCache, or None when caching is disabled"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ScrapeCache()
+    return _cache
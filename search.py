@@ -0,0 +1,140 @@
+"""
+Full-text search over leads with SQLite FTS5.
+
+leads_fts indexes company, title, description and industry_keywords as an
+external-content table over leads, so the text is not stored twice.
+Triggers keep it in step with every insert, update and delete, and results
+are ranked with bm25, company and title matches weighing most.
+"""
+import base64
+import html
+import json
+import re
+
+from leads import DEFAULT_PAGE_SIZE, READABLE_FIELDS, build_where
+
+SEARCH_COLUMNS = ('company', 'title', 'description', 'industry_keywords')
+# bm25 weight of each column in SEARCH_COLUMNS
+RANK_WEIGHTS = (4.0, 3.0, 1.0, 2.0)
+SNIPPET_TOKENS = 12
+# Private-use characters FTS5 puts around matches, swapped for <mark> tags once the snippet is escaped
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+MAX_QUERY_TERMS = 16
+
+_columns = ', '.join(SEARCH_COLUMNS)
+_new_values = ', '.join('new.' + column for column in SEARCH_COLUMNS)
+_old_values = ', '.join('old.' + column for column in SEARCH_COLUMNS)
+
+SCHEMA = (
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+            {_columns}, content='leads', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )''',
+    f'''CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads BEGIN
+            INSERT INTO leads_fts (rowid, {_columns}) VALUES (new.id, {_new_values});
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads BEGIN
+            INSERT INTO leads_fts (leads_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF {_columns} ON leads BEGIN
+            INSERT INTO leads_fts (leads_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+            INSERT INTO leads_fts (rowid, {_columns}) VALUES (new.id, {_new_values});
+        END''',
+)
+
+
+def ensure_search_index(conn):
+    """Create the search table and triggers, indexing existing leads the first time (in the caller's transaction)"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'leads_fts'").fetchone()
+    for statement in SCHEMA:
+        conn.execute(statement)
+    if not exists:
+        conn.execute(
+            "INSERT INTO leads_fts (leads_fts, rank) VALUES ('rank', ?)",
+            (f'bm25({", ".join(map(str, RANK_WEIGHTS))})',)
+        )
+        conn.execute("INSERT INTO leads_fts (leads_fts) VALUES ('rebuild')")
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    matched literally instead of raising syntax errors. Returns None if the
+    text holds no words.
+    """
+    terms = re.findall(r'\w+', text)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def snippet_html(snippet):
+    """HTML of an FTS5 snippet: the scraped text escaped, the matches wrapped in <mark> tags"""
+    if snippet is None:
+        return None
+    # Sentinels that came with the scraped text would open or close stray tags
+    matches = re.split(f'{MATCH_START}(.*?){MATCH_END}', snippet)
+    escaped = [html.escape(part.replace(MATCH_START, '').replace(MATCH_END, '')) for part in matches]
+    for i in range(1, len(escaped), 2):
+        escaped[i] = f'<mark>{escaped[i]}</mark>'
+    return ''.join(escaped)
+
+
+def encode_search_cursor(rank, lead_id):
+    return base64.urlsafe_b64encode(json.dumps([rank, lead_id]).encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    """Decode a search cursor request arg; None for the first page"""
+    if not cursor:
+        return None
+    try:
+        rank, lead_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(rank, (int, float)) or not isinstance(lead_id, int):
+        raise ValueError('Invalid cursor')
+    return rank, lead_id
+
+
+def search_leads(conn, query, filters=None, limit=DEFAULT_PAGE_SIZE, cursor=None, fields=None):
+    """One page of leads matching an FTS5 query, best match first.
+
+    Takes the same filters and fields as list_leads and a decoded search
+    cursor. Each lead gets a ``snippet`` of the best matching column with
+    the matched words wrapped in <mark> tags, as HTML with the scraped text
+escaped. Returns (leads, next_cursor).
+    """
+    columns = list(fields or READABLE_FIELDS)
+    select = ', '.join(f'leads.{column}' for column in columns)
+    where, params = build_where(filters or {})
+    clauses = [where[len(' WHERE '):]] if where else []
+    if cursor:
+        # Keyset on (rank, id), the sort order below
+        clauses.append('(leads_fts.rank > ? OR (leads_fts.rank = ? AND leads_fts.rowid > ?))')
+        params += [cursor[0], cursor[0], cursor[1]]
+    extra = ''.join(' AND ' + clause for clause in clauses)
+
+    rows = conn.execute(
+        f'''SELECT {select}, leads_fts.rank AS search_rank, leads_fts.rowid AS search_id,
+                   snippet(leads_fts, -1, '{MATCH_START}', '{MATCH_END}', '…', {SNIPPET_TOKENS}) AS snippet
+            FROM leads_fts JOIN leads ON leads.id = leads_fts.rowid
+            WHERE leads_fts MATCH ?{extra}
+            ORDER BY leads_fts.rank, leads_fts.rowid LIMIT ?''',
+        [query] + params + [limit + 1]
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1]['search_rank'], rows[-1]['search_id'])
+    leads = []
+    for row in rows:
+        lead = {column: row[column] for column in columns}
+        lead['snippet'] = snippet_html(row['snippet'])
+        leads.append(lead)
+    return leads, next_cursor
@@ -0,0 +1,45 @@
+"""
+Tests for the extension's batch upload endpoint.
+
+    python -m pytest test_batch.py
+"""
+import pytest
+
+import app as app_module
+import db
+from writer import LeadWriter
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db.configure(str(tmp_path / 'leads.db'))
+    writer = LeadWriter(flush_interval=0)
+    monkeypatch.setattr(app_module, 'get_writer', lambda: writer)
+    yield app_module.create_app(start_jobs=False).test_client()
+    writer.close()
+    db.close()
+
+
+def test_bad_leads_fail_alone_and_are_not_retryable(client):
+    response = client.post('/api/leads/batch', json=[
+        {'url': 'https://acme.com', 'title': 42, 'email': None},
+        {'url': 'http://[bad'},
+        {'url': 'https://widgets.io', 'phone': {'number': '555'}},
+        {'title': 'No URL'},
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['saved'] == 1
+    assert body['results'][0]['success']
+    assert [(result['success'], result.get('retryable')) for result in body['results'][1:]] == [
+        (False, False), (False, False), (False, False)
+    ]
+    assert body['results'][2]['error'] == 'phone must be a string'
+    row = db.get_db().execute('SELECT title, email FROM leads WHERE id = ?', (body['results'][0]['id'],)).fetchone()
+    assert tuple(row) == ('42', '')
+
+
+def test_single_lead_with_an_object_field_is_a_bad_request(client):
+    response = client.post('/api/leads', json={'url': 'https://acme.com', 'description': ['a', 'b']})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'description must be a string'
@@ -0,0 +1,71 @@
+"""
+Tests for bulk jobs surviving the process that took them.
+
+    python -m pytest test_bulk.py
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import db
+from bulk import BulkImporter
+
+
+@pytest.fixture
+def database(tmp_path):
+    db.configure(str(tmp_path / 'leads.db'))
+    db.init_db()
+    yield
+    db.close()
+
+
+def wait_finished(importer, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = importer.get(job_id)
+        if job['finished_at'] is not None:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_queued_urls_are_resumed_by_another_importer(database):
+    release = threading.Event()
+    saved = []
+
+    async def scrape(url, fetcher):
+        if 'slow' in url:
+            await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+        return {'success': True, 'url': url}
+
+    def save(result):
+        saved.append(result['url'])
+        return len(saved)
+
+    first = BulkImporter(scrape, save, max_in_flight=1, per_host_limit=1)
+    first.start()
+    urls = ['https://slow.example.com'] + [f'https://site{i}.example.com' for i in range(5)]
+    job = first.submit(urls, skipped=1)
+    time.sleep(0.2)
+    # Shut down with one scrape running and the other URLs still queued
+    threading.Timer(0.2, release.set).start()
+    first.shutdown()
+    assert saved == ['https://slow.example.com']
+
+    second = BulkImporter(scrape, save, max_in_flight=2)
+    second.start()
+    try:
+        job = wait_finished(second, job['id'])
+    finally:
+        second.shutdown()
+    assert sorted(saved) == sorted(urls)
+    assert (job['status'], job['completed'], job['total'], job['succeeded']) == ('finished', 7, 7, 6)
+
+
+def test_jobs_are_reported_by_kind(database):
+    imports = BulkImporter(None, None)
+    job = imports.submit(['https://example.com'])
+    assert job['status'] == 'queued'
+    assert BulkImporter(None, None, kind='refresh').get(job['id']) is None
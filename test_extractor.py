@@ -0,0 +1,54 @@
+"""
+Tests for stopping a streamed scrape early.
+
+    python -m pytest test_extractor.py
+"""
+from app import scrape_website
+from extractor import BODY_CHARS_AFTER_HEAD
+
+HEAD = '''<!DOCTYPE html>
+<html lang="en-GB">
+<head>
+<title>The Harbour Gazette - Local news</title>
+<meta name="description" content="Breaking news, sport and weather from the harbour towns.">
+<link rel="icon" href="/favicon.ico">
+</head>
+<body><main>
+'''
+ARTICLE = '<article><h2><a href="/news/{0}">Story {0}</a></h2><p>Harbour news and weather for story {0}.</p></article>\n'
+FOOTER = '</main><footer><a href="https://twitter.com/harbourgazette">Twitter</a></footer></body></html>'
+
+
+class ChunkFetcher:
+    """Serves one page in fixed-size chunks and counts how many were read"""
+
+    def __init__(self, html, size=16 * 1024):
+        self.chunks = [html[i:i + size] for i in range(0, len(html), size)]
+        self.read = 0
+
+    def stream_text(self, url, max_bytes, headers=None, meta=None):
+        meta['status_code'] = 200
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def test_large_page_stops_after_bounded_body():
+    articles = ''.join(ARTICLE.format(n) for n in range(20000))
+    fetcher = ChunkFetcher(HEAD + articles + FOOTER)
+    assert len(articles) > 3 * BODY_CHARS_AFTER_HEAD
+
+    result = scrape_website('https://harbourgazette.example', fetcher=fetcher, cache=False)
+    assert result['success']
+    assert result['title'] == 'The Harbour Gazette - Local news'
+    assert result['description'] == 'Breaking news, sport and weather from the harbour towns.'
+    assert result['language'] == 'en-GB'
+    assert fetcher.read * 16 * 1024 <= len(HEAD) + BODY_CHARS_AFTER_HEAD + 2 * 16 * 1024
+    assert fetcher.read < len(fetcher.chunks)
+
+
+def test_small_page_is_read_to_the_end():
+    fetcher = ChunkFetcher(HEAD + ''.join(ARTICLE.format(n) for n in range(100)) + FOOTER)
+    result = scrape_website('https://harbourgazette.example', fetcher=fetcher, cache=False)
+    assert fetcher.read == len(fetcher.chunks)
+    assert result['twitter_handle'] == 'harbourgazette'
@@ -0,0 +1,91 @@
+"""
+Tests for the scrape job queue: claiming, retries with backoff and lease expiry.
+
+    python -m pytest test_jobs.py
+"""
+import sqlite3
+import time
+
+import pytest
+
+from job_runner import JobRunner
+from jobs import (DONE, FAILED, MAX_RETRY_DELAY, QUEUED, RETRY_BASE_DELAY, RUNNING, SCHEMA, claim_job,
+                  complete_job, enqueue_job, get_job, retry_delay)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    for statement in SCHEMA:
+        conn.execute(statement)
+    yield conn
+    conn.close()
+
+
+def run(conn, scrape_result, saved_id=7):
+    """Claim the next job and run it through a JobRunner with a canned scrape result"""
+    runner = JobRunner(lambda url: scrape_result, lambda result: saved_id, workers=0)
+    job = claim_job(conn, 'worker')
+    runner._run(conn, 'worker', *job)
+    return get_job(conn, job[0])
+
+
+def test_claim_hands_out_each_due_job_once(conn):
+    first = enqueue_job(conn, 'https://acme.com')
+    second = enqueue_job(conn, 'https://widgets.io')
+    enqueue_job(conn, 'https://later.dev', delay=60)
+
+    assert tuple(claim_job(conn, 'a')) == (first['id'], 'https://acme.com', 1, first['max_attempts'])
+    assert claim_job(conn, 'b')[0] == second['id']
+    # The third job isn't due yet
+    assert claim_job(conn, 'c') is None
+    job = get_job(conn, first['id'])
+    assert (job['status'], job['attempts'], job['next_attempt_at']) == (RUNNING, 1, None)
+
+
+def test_success_completes_the_job(conn):
+    enqueue_job(conn, 'https://acme.com')
+    job = run(conn, {'success': True, 'url': 'https://acme.com'})
+    assert (job['status'], job['lead_id'], job['error']) == (DONE, 7, None)
+
+
+def test_retryable_failure_is_requeued_after_a_backoff(conn):
+    enqueue_job(conn, 'https://acme.com', max_attempts=2)
+    before = time.time()
+    job = run(conn, {'success': False, 'error': 'Timed out', 'error_category': 'timeout'})
+    assert (job['status'], job['error_category']) == (QUEUED, 'timeout')
+    # First retry waits RETRY_BASE_DELAY, jittered down by at most half
+    assert before + RETRY_BASE_DELAY / 2 <= job['next_attempt_at'] <= time.time() + RETRY_BASE_DELAY
+    assert claim_job(conn, 'worker') is None
+
+    # Out of attempts: the second failure is final
+    conn.execute('UPDATE scrape_jobs SET run_at = 0')
+    job = run(conn, {'success': False, 'error': 'Timed out', 'error_category': 'timeout'})
+    assert (job['status'], job['attempts']) == (FAILED, 2)
+
+
+def test_permanent_failure_is_not_retried(conn):
+    enqueue_job(conn, 'https://acme.com')
+    job = run(conn, {'success': False, 'error': 'Not found', 'error_category': 'http_4xx'})
+    assert (job['status'], job['attempts'], job['error']) == (FAILED, 1, 'Not found')
+
+
+def test_retry_delay_doubles_up_to_the_cap():
+    assert RETRY_BASE_DELAY <= retry_delay(2) <= RETRY_BASE_DELAY * 2
+    assert MAX_RETRY_DELAY / 2 <= retry_delay(30) <= MAX_RETRY_DELAY
+
+
+def test_expired_lease_is_claimed_again(conn):
+    job_id = enqueue_job(conn, 'https://acme.com')['id']
+    # A worker that died holding the job: its lease has already run out
+    claim_job(conn, 'dead', lease=-1)
+    job = claim_job(conn, 'alive')
+    assert (job[0], job[2]) == (job_id, 2)
+    assert claim_job(conn, 'other') is None
+
+    # Only the worker now holding the lease can record the outcome
+    complete_job(conn, job_id, 'dead', lead_id=1)
+    assert get_job(conn, job_id)['status'] == RUNNING
+    complete_job(conn, job_id, 'alive', lead_id=2)
+    assert (get_job(conn, job_id)['status'], get_job(conn, job_id)['lead_id']) == (DONE, 2)
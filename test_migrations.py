@@ -0,0 +1,88 @@
+"""
+Tests for the schema migrations, run over a database from the first release.
+
+    python -m pytest test_migrations.py
+"""
+import sqlite3
+
+import pytest
+
+from migrations import latest_version, migrate, schema_version
+
+# The leads table as the first release's app.py created it, before versioning
+BASELINE_SCHEMA = '''CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company TEXT,
+    url TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    email TEXT,
+    phone TEXT,
+    logo_url TEXT,
+    favicon_url TEXT,
+    twitter_handle TEXT,
+    linkedin_url TEXT,
+    facebook_url TEXT,
+    instagram_url TEXT,
+    contact_page TEXT,
+    industry_keywords TEXT,
+    language TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)'''
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'leads.db'))
+    conn.row_factory = sqlite3.Row
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO leads (company, url, title, email) VALUES (?, ?, ?, ?)', [
+        ('Acme', 'https://acme.com', 'Acme Robotics', ''),
+        ('Acme', 'https://www.acme.com/', 'No title found', 'sales@acme.com'),
+        ('Widgets', 'https://widgets.io/about', 'Widget Works', ''),
+    ])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def schema(conn):
+    return {row['name']: row['sql'] for row in conn.execute('SELECT name, sql FROM sqlite_master')}
+
+
+def test_migrate_brings_the_first_release_schema_up_to_date(conn):
+    assert schema_version(conn) == 0
+    assert migrate(conn) == list(range(1, latest_version() + 1))
+    assert schema_version(conn) == latest_version()
+
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(leads)')}
+    assert {'domain', 'url_key', 'last_scraped_at', 'content_hash', 'icon_asset', 'icon_retry_at',
+            'icon_attempts'} <= columns
+    names = schema(conn)
+    for index in ('idx_leads_created_at', 'idx_leads_domain', 'idx_leads_url_key', 'idx_leads_last_scraped',
+                  'idx_leads_icon_due', 'idx_scrape_jobs_due'):
+        assert index in names
+    assert 'idx_leads_icon_pending' not in names
+    for trigger in ('leads_fts_insert', 'leads_fts_delete', 'leads_fts_update', 'leads_version_insert'):
+        assert trigger in names
+
+    # Backfills: duplicate URLs merged into one lead, domains filled in, existing leads searchable
+    rows = conn.execute('SELECT url_key, domain, title, email FROM leads ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [
+        ('acme.com', 'acme.com', 'Acme Robotics', 'sales@acme.com'),
+        ('widgets.io/about', 'widgets.io', 'Widget Works', ''),
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM leads_fts WHERE leads_fts MATCH 'robotics'").fetchone()[0] == 1
+
+    # The triggers keep the search index in step with new rows
+    with conn:
+        conn.execute("INSERT INTO leads (url, url_key, title) VALUES ('https://gears.dev', 'gears.dev', 'Gear Co')")
+    assert conn.execute("SELECT COUNT(*) FROM leads_fts WHERE leads_fts MATCH 'gear'").fetchone()[0] == 1
+
+
+def test_second_run_changes_nothing(conn):
+    migrate(conn)
+    before = schema(conn)
+    assert migrate(conn) == []
+    assert schema(conn) == before
+    assert schema_version(conn) == latest_version()
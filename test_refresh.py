@@ -0,0 +1,37 @@
+"""
+Tests for refresh scrapes and the scrape cache.
+
+    python -m pytest test_refresh.py
+"""
+from app import scrape_website
+from scrape_cache import ScrapeCache
+
+PAGE = '<html lang="en"><head><title>Acme Robotics</title></head><body><p>Robots.</p></body></html>'
+
+
+class PageFetcher:
+    """Answers every request with PAGE, or 304 when sent the matching ETag"""
+
+    def __init__(self):
+        self.requests = []
+
+    def stream_text(self, url, max_bytes, headers=None, meta=None):
+        self.requests.append(headers or {})
+        if (headers or {}).get('If-None-Match') == '"v1"':
+            meta.update(status_code=304, etag='"v1"', last_modified=None)
+            return
+        meta.update(status_code=200, etag='"v1"', last_modified=None)
+        yield PAGE
+
+
+def test_revalidate_asks_the_site_despite_a_fresh_entry(tmp_path):
+    cache = ScrapeCache(str(tmp_path / 'cache.db'))
+    fetcher = PageFetcher()
+    first = scrape_website('https://acme.com', fetcher=fetcher, cache=cache)
+    assert scrape_website('https://acme.com', fetcher=fetcher, cache=cache) == first
+    assert len(fetcher.requests) == 1
+
+    again = scrape_website('https://acme.com', fetcher=fetcher, cache=cache, revalidate=True)
+    assert len(fetcher.requests) == 2
+    assert fetcher.requests[1].get('If-None-Match') == '"v1"'
+    assert again['title'] == first['title'] == 'Acme Robotics'
@@ -0,0 +1,28 @@
+"""
+Tests for full-text search snippets.
+
+    python -m pytest test_search.py
+"""
+import pytest
+
+import db
+from search import match_query, search_leads
+from writer import LeadWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    db.configure(str(tmp_path / 'leads.db'))
+    db.init_db()
+    writer = LeadWriter(flush_interval=0)
+    yield writer
+    writer.close()
+    db.close()
+
+
+def test_snippet_escapes_scraped_text(writer):
+    writer.save({'url': 'https://acme.com', 'company': 'Acme',
+                 'description': '<script>alert(1)</script> robotics & <mark>automation</mark>'})
+    leads, _ = search_leads(db.get_db(), match_query('robotics'))
+    assert leads[0]['snippet'] == ('&lt;script&gt;alert(1)&lt;/script&gt; <mark>robotics</mark> &amp; '
+                                   '&lt;mark&gt;automation&lt;/mark&gt;')
@@ -0,0 +1,69 @@
+"""
+Tests for the batched lead writer's upsert merge.
+
+    python -m pytest test_writer.py
+"""
+import sqlite3
+
+import pytest
+
+import db
+from writer import LeadWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    db.configure(str(tmp_path / 'leads.db'))
+    db.init_db()
+    writer = LeadWriter(flush_interval=0)
+    yield writer
+    writer.close()
+    db.close()
+
+
+def stored(lead_id, *fields):
+    return tuple(db.get_db().execute(f'SELECT {", ".join(fields)} FROM leads WHERE id = ?', (lead_id,)).fetchone())
+
+
+def test_placeholders_do_not_overwrite_stored_fields(writer):
+    lead_id = writer.save({'url': 'https://acme.com', 'company': 'Acme', 'title': 'Acme Robotics',
+                           'description': 'Industrial robots'})
+    # A later scrape that found nothing, as the job runner or the extension would send it
+    again = writer.save({'url': 'https://www.acme.com/', 'company': 'Acme', 'title': 'No title found',
+                         'description': 'No description found', 'email': 'sales@acme.com'})
+    assert again == lead_id
+    assert stored(lead_id, 'title', 'description', 'email') == ('Acme Robotics', 'Industrial robots',
+                                                                'sales@acme.com')
+
+
+def test_real_values_replace_placeholders(writer):
+    lead_id = writer.save({'url': 'https://acme.com', 'title': 'No title found', 'description': 'No description found'})
+    writer.save({'url': 'https://acme.com', 'title': 'Acme Robotics', 'description': ''})
+    assert stored(lead_id, 'title', 'description') == ('Acme Robotics', 'No description found')
+
+
+def test_client_saves_do_not_stamp_last_scraped_at(writer):
+    lead_id = writer.save({'url': 'https://acme.com', 'title': 'Acme'}, scraped=False)
+    assert stored(lead_id, 'last_scraped_at', 'content_hash') == (None, None)
+
+    writer.save({'url': 'https://acme.com', 'title': 'Acme Robotics'})
+    scraped = stored(lead_id, 'last_scraped_at', 'content_hash')
+    assert None not in scraped
+
+    writer.save({'url': 'https://acme.com', 'title': 'Acme Robotics GmbH'}, scraped=False)
+    assert stored(lead_id, 'title', 'last_scraped_at', 'content_hash') == ('Acme Robotics GmbH',) + scraped
+
+
+def test_connect_error_fails_the_batch_and_keeps_the_writer_running(writer, monkeypatch):
+    get_db = db.get_db
+
+    def unreachable():
+        monkeypatch.setattr(db, 'get_db', get_db)
+        raise sqlite3.OperationalError('unable to open database file')
+
+    monkeypatch.setattr(db, 'get_db', unreachable)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.save({'url': 'https://acme.com', 'title': 'Acme'})
+    # The next batch opens the database normally
+    lead_id = writer.save({'url': 'https://acme.com', 'title': 'Acme'})
+    assert stored(lead_id, 'title') == ('Acme',)
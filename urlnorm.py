@@ -0,0 +1,55 @@
+"""
+URL normalization helpers
+"""
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only track where a visitor came from
+TRACKING_PARAMS = {
+    'gclid', 'gclsrc', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', '_hsenc', '_hsmi', 'ref', 'ref_src', 'utm'
+}
+TRACKING_PREFIXES = ('utm_',)
+
+
+def normalize_url(url):
+    """Normalize a URL for use as a lookup key.
+
+    Adds a missing scheme, lowercases scheme and host, drops default ports
+    and the fragment, and gives an empty path a single slash.
+    """
+    url = url.strip()
+    if not url.lower().startswith(('http://', 'https://')):
+        url = 'https://' + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or port == DEFAULT_PORTS.get(scheme) else f'{host}:{port}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonical_url(url):
+    """Key identifying the page a URL points at, used to de-duplicate leads.
+
+    On top of normalize_url this ignores the scheme, a leading www., a
+    trailing slash and tracking parameters, and sorts the remaining query,
+    so https://www.acme.com/?utm_source=x and acme.com both give acme.com.
+    """
+    parts = urlsplit(normalize_url(url))
+    netloc = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    )
+    key = netloc + parts.path.rstrip('/')
+    return key + '?' + urlencode(query) if query else key
@@ -0,0 +1,226 @@
+"""
+Write-behind batching for lead inserts.
+
+Saves from concurrent requests and bulk import workers are queued and
+written by one background thread, many rows per transaction with
+executemany, so a burst of saves costs one commit (and one fsync) instead of
+one each. Callers still get the lead id back: save() blocks until the
+batch holding that lead has been committed.
+
+Saves are upserts keyed on the canonical URL (urlnorm.canonical_url): saving
+a page that already has a lead merges the new non-empty fields into that
+row and returns its id instead of adding a duplicate ("No title found" and
+the other leads.PLACEHOLDERS count as empty). Saves of server scrapes also
+stamp last_scraped_at and the content hash refresh.py compares against;
+leads sent by clients (scraped=False) leave both as they were. A changed
+logo or favicon URL sends the lead back to the icon pipeline.
+
+The queue is bounded. When the writer falls behind, save() waits for room
+and gives up with WriterBusyError after ENQUEUE_TIMEOUT seconds, which
+pushes back on bulk imports and lets the API answer 503 instead of piling
+up memory. It also gives up after SAVE_TIMEOUT seconds waiting for the
+commit, and a batch that can't be written (database unreachable, bad rows)
+fails its saves with the error instead of stopping the writer thread.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import db
+from leads import LEAD_FIELDS, MERGE_FIELDS, content_hash, lead_domain, merge_assignment, utc_timestamp
+from metrics import DB_WRITE_BATCH, DB_WRITE_SECONDS
+from urlnorm import canonical_url
+
+# A batch is written once it holds BATCH_SIZE leads or FLUSH_INTERVAL seconds after its first lead arrived
+BATCH_SIZE = int(os.environ.get('LEADS_WRITE_BATCH', 500))
+FLUSH_INTERVAL = int(os.environ.get('LEADS_WRITE_INTERVAL_MS', 20)) / 1000
+# Leads waiting to be written; save() blocks while the queue is full
+MAX_QUEUE = int(os.environ.get('LEADS_WRITE_QUEUE', 10000))
+ENQUEUE_TIMEOUT = 10
+# Seconds save() waits for the lead's batch to be committed
+SAVE_TIMEOUT = int(os.environ.get('LEADS_SAVE_TIMEOUT', 60))
+
+# Columns of a lead_row, in order
+ROW_COLUMNS = LEAD_FIELDS + ('last_scraped_at', 'content_hash', 'domain', 'url_key')
+
+# True when a save keeps the lead's logo and favicon URLs, so its icon stays as it is
+ICON_UNCHANGED = ("COALESCE(excluded.logo_url, '') IN ('', logo_url) "
+                  "AND COALESCE(excluded.favicon_url, '') IN ('', favicon_url)")
+
+UPSERT_SQL = f'''INSERT INTO leads ({', '.join(ROW_COLUMNS)})
+                 VALUES ({', '.join('?' * len(ROW_COLUMNS))})
+                 ON CONFLICT (url_key) DO UPDATE SET
+                 {', '.join(merge_assignment(field, 'excluded.' + field) for field in MERGE_FIELDS)},
+                 last_scraped_at = COALESCE(excluded.last_scraped_at, last_scraped_at),
+                 content_hash = COALESCE(excluded.content_hash, content_hash),
+                 icon_asset = CASE WHEN {ICON_UNCHANGED} THEN icon_asset END,
+                 icon_retry_at = CASE WHEN {ICON_UNCHANGED} THEN icon_retry_at END,
+                 icon_attempts = CASE WHEN {ICON_UNCHANGED} THEN icon_attempts ELSE 0 END'''
+
+_STOP = object()
+
+
+def _items(entry):
+    # A queue entry is one (row, future) pair or a list of them from submit_many
+    return entry if isinstance(entry, list) else [entry]
+
+
+class WriterBusyError(Exception):
+    """The write queue stayed full for longer than the enqueue timeout, or the commit took too long"""
+
+
+def wait_saved(future, timeout=SAVE_TIMEOUT):
+    """Id from a Future returned by LeadWriter.submit, waiting at most timeout seconds for the commit"""
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        raise WriterBusyError('Timed out waiting for the lead to be saved, try again shortly')
+
+
+def lead_row(lead, scraped=True):
+    """Parameters for UPSERT_SQL from a lead dict; the last one is the url_key.
+
+    Only a lead scraped by the server (scraped=True) is stamped with
+    last_scraped_at and a content hash.
+    """
+    stamps = [utc_timestamp(), content_hash(lead)] if scraped else [None, None]
+    return [lead.get(field, '') for field in LEAD_FIELDS] + stamps + [
+        lead_domain(lead['url']), canonical_url(lead['url'])]
+
+
+class LeadWriter:
+    """Background thread that commits queued leads in batches"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue=MAX_QUEUE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='lead-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, lead, timeout=ENQUEUE_TIMEOUT, scraped=True):
+        """Queue a lead dict; returns a Future resolving to its id once committed"""
+        self._check_running()
+        future = Future()
+        try:
+            self._queue.put((lead_row(lead, scraped), future), timeout=timeout)
+        except queue.Full:
+            raise WriterBusyError('Too many leads waiting to be saved, try again shortly')
+        return future
+
+    def save(self, lead, timeout=ENQUEUE_TIMEOUT, scraped=True):
+        """Queue a lead and wait for its batch to commit; returns the new id"""
+        return wait_saved(self.submit(lead, timeout, scraped))
+
+    def submit_many(self, leads, timeout=ENQUEUE_TIMEOUT, scraped=True):
+        """Queue lead dicts to be written in the same transaction; returns a Future per lead"""
+        self._check_running()
+        group = [(lead_row(lead, scraped), Future()) for lead in leads]
+        if not group:
+            return []
+        try:
+            # One queue slot, so the group can't be split across batches
+            self._queue.put(group, timeout=timeout)
+        except queue.Full:
+            raise WriterBusyError('Too many leads waiting to be saved, try again shortly')
+        return [future for _, future in group]
+
+    def _check_running(self):
+        if self._closed:
+            raise RuntimeError('Lead writer is closed')
+        if not self._thread.is_alive():
+            raise RuntimeError('Lead writer thread has stopped')
+
+    def close(self, timeout=None):
+        """Write everything already queued, then stop the thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = _items(first)
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.extend(_items(item))
+            self._write(batch)
+        db.close()
+
+    def _write(self, batch):
+        try:
+            conn = db.get_db()
+        except Exception as e:
+            # Can't open the database - fail this batch; the next one tries again
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        rows = [row for row, _ in batch]
+        keys = list({row[-1] for row in rows})
+        started = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(UPSERT_SQL, rows)
+                # Inserted and merged rows alike are found again by their url_key
+                ids = dict(conn.execute(
+                    f'SELECT url_key, id FROM leads WHERE url_key IN ({", ".join("?" * len(keys))})', keys
+                ))
+        except Exception:
+            # Don't fail the whole batch for one bad row - retry them one at a time
+            self._write_each(conn, batch)
+            return
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+        DB_WRITE_BATCH.observe(len(batch))
+
+        for row, future in batch:
+            future.set_result(ids[row[-1]])
+
+    def _write_each(self, conn, batch):
+        for row, future in batch:
+            try:
+                with conn:
+                    lead_id = conn.execute(UPSERT_SQL + ' RETURNING id', row).fetchone()[0]
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(lead_id)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide LeadWriter, started on first use"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LeadWriter()
+                # Flush whatever is still queued when the process exits
+                atexit.register(_writer.close)
+    return _writer
+
+
+def close_writer(timeout=None):
+    """Write everything queued on the process-wide writer, if one was started"""
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.close(timeout)
@@ -0,0 +1,19 @@
+"""
+Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app          # WSGI, multi-process
+    uvicorn wsgi:asgi_app --workers 4              # ASGI, needs asgiref
+
+Each worker process calls create_app(), which sets up the database.
+"""
+from app import create_app
+
+app = create_app()
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    asgi_app = None
+else:
+    # Flask is a WSGI app; requests run on asgiref's thread pool
+    asgi_app = WsgiToAsgi(app)